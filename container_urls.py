@@ -50,4 +50,13 @@ def get():
           containers['tv_add_size'] = 0       
 
 
+          #--- Delta Containers ---#
+
+          #changes since an earlier snapshot, applied in place of a full re-download
+          #of the containers above, see resources/lib/metadelta.py for the format
+          #eg. {'since': 'March 2012', 'date': 'April 2012', 'url': 'http://user.gosub.dk/eldorado/',
+          #     'filename': 'delta_2012_04.zip', 'size': 6}
+          containers['deltas'] = []
+
+
           return containers
@@ -15,6 +15,11 @@ import copy
 import threading
 import string
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 ############ Set prepare_zip to True in order to scrape the entire site to create a new meta pack ############
 ''' 
 Setting to true will also enable a new menu option 'Create Meta Pack' which will scrape all categories and download covers & backdrops 
@@ -47,6 +52,7 @@ sys.path.append( os.path.join( icepath, 'resources', 'lib' ) )
 #imports of things bundled in the addon
 import container_urls,clean_dirs,htmlcleaner
 import megaroutines, rapidroutines, debridroutines
+import httpclient, httpcache, workerpool, sourcetable, hosts, resolvers, linkcache, downloader, dlcontrol, dlqueue, streamproxy, dlindex, containerinstall, metadelta, metabatch, metacontext
 from metahandler import metahandlers
 from cleaners import *
 from BeautifulSoup import BeautifulSoup
@@ -84,6 +90,47 @@ iceurl = ICEFILMS_URL
 meta_setting = selfAddon.getSetting('use-meta')
 downloadPath = selfAddon.getSetting('download-folder')
 
+#Timeout for all site requests, shared by the pooled http client
+try:
+    httpclient.set_timeout(int(selfAddon.getSetting('http-timeout')))
+except ValueError:
+    pass
+
+#Connections used per download, when the host supports ranged requests
+try:
+    download_connections = int(selfAddon.getSetting('download-connections'))
+except ValueError:
+    download_connections = 4
+
+#On-disk cache of index pages, so browsing back through menus doesn't hit the site again
+page_cache = None
+if selfAddon.getSetting('http-cache') == 'true':
+    try:
+        cache_size = int(selfAddon.getSetting('http-cache-size'))
+    except ValueError:
+        cache_size = 20
+    page_cache = httpcache.HttpCache(os.path.join(datapath, 'http_cache'), cache_size * 1024 * 1024)
+
+#One MetaData for the whole invocation, built on first use
+meta_context = metacontext.MetaContext(lambda: metahandlers.MetaData(preparezip=prepare_zip))
+
+#Links resolved from file hosts, reused until they expire
+link_cache = linkcache.LinkCache(os.path.join(datapath, 'resolved_links.json'))
+
+#How long (seconds) a page stays fresh, first matching rule wins
+#Mirror pages and ajax calls hold tokens/cookies and must never be cached
+PAGE_CACHE_TTLS = [
+    ('membersonly/', 0),
+    ('ip', 0),
+    ('index', 10 * 60),
+    ('[^/]+/a-z/', 6 * 60 * 60),
+    ('tv/series/', 2 * 60 * 60),
+    ('[^/]+/(popular|rating|release|added|genres?)/', 60 * 60),
+    ]
+
+#Number of source links looked up at once when listing sources
+SOURCE_WORKERS = 4
+
 #Auto-watch
 currentTime = 1
 totalTime = 0
@@ -425,7 +472,7 @@ def ContainerStartup():
      #Initialize MetaHandler and MetaContainer classes
      #MetaContainer will clean up from previous installs, so good idea to always initialize at addon startup
      from metahandler import metacontainers
-     mh=metahandlers.MetaData(preparezip=prepare_zip)
+     mh=meta_context
      mc = metacontainers.MetaContainer()
 
      #Check meta cache DB if meta pack has been installed     
@@ -460,8 +507,17 @@ def ContainerStartup():
               elif get_db_zip==False:
                    Notify('small','Metacontainer DB Installation Failure','','')
 
+     #An installed meta pack is brought up to date with the deltas published since
+     elif containers['deltas']:
+         meta_installed = Meta_Delta_Update(containers['deltas'], mh, mc, meta_installed)
+
      #Only check/prompt for image pack downloads if the DB has been downloaded/installed
-     if meta_installed:
+     #and not while the packs picked last time are still being installed
+     status_file = os.path.join(datapath, 'container_install')
+     if meta_installed and containerinstall.running(status_file):
+         print 'Meta image packs are being installed in the background'
+
+     elif meta_installed:
 
          #Get metadata settings
          movie_fanart = selfAddon.getSetting('movie-fanart')
@@ -469,6 +525,20 @@ def ContainerStartup():
          tv_covers = selfAddon.getSetting('tv-covers')
          tv_posters = selfAddon.getSetting('tv-posters')
          tv_fanart = selfAddon.getSetting('tv-fanart')
+
+         #The packs picked are installed together in the background, each one flagged in the meta db once done
+         packs = []
+         pack_path = os.path.join(datapath, 'meta_downloads')
+         if not os.path.exists(pack_path): os.makedirs(pack_path)
+
+         def image_pack(url, filename, installtype, title, **installed):
+             def flag():
+                 #the meta db connection can't be shared with the installer thread
+                 metahandlers.MetaData(preparezip=prepare_zip).update_meta_installed(addon_id, **installed)
+             #image packs are unpacked straight into the image folders as they download,
+             #if this metahandler version doesn't tell us where those are its installer gets the zip
+             extract_to = getattr(mc, installtype, None)
+             return containerinstall.Pack(url + filename, os.path.join(pack_path, filename), installtype, title, flag, extract_to)
      
          #TV Covers/Banners
          if tv_covers =='true':
@@ -487,18 +557,10 @@ def ContainerStartup():
                  dialog = xbmcgui.Dialog()
                  ret = dialog.yesno('Download TV Covers?', 'There is a metadata container avaliable.','Install it to get cover images for TV Shows.', 'Would you like to get it? Its a large ' + str(tv_size) + 'MB download.','Remind me later', 'Install')
                  if ret==True:
-                     #download dem files
-                     get_cover_zip=Zip_DL_and_Install(tv_zip, tv_filename, 'tv_images', work_path, mc)
-                     
-                     if get_cover_zip:
-                         if tv_posters =='true':
-                             mh.update_meta_installed(addon_id, tv_covers='true')
-                         else:
-                             mh.update_meta_installed(addon_id, tv_banners='true')
-                         Notify('small','TV Cover Installation Success','','')
+                     if tv_posters =='true':
+                         packs.append(image_pack(tv_zip, tv_filename, 'tv_images', 'TV Cover', tv_covers='true'))
                      else:
-                         print '******* ERROR - TV cover install failed'
-                         Notify('small','TV Cover Installation Failure','','')                     
+                         packs.append(image_pack(tv_zip, tv_filename, 'tv_images', 'TV Cover', tv_banners='true'))
              else:
                  print 'TV Covers already installed'
 
@@ -508,15 +570,7 @@ def ContainerStartup():
                  dialog = xbmcgui.Dialog()
                  ret = dialog.yesno('Download Movie Covers?', 'There is a metadata container avaliable.','Install it to get cover images for Movies.', 'Would you like to get it? Its a large '+str(containers['mv_cover_size'])+'MB download.','Remind me later', 'Install')
                  if ret==True:
-                     #download dem files
-                     get_cover_zip=Zip_DL_and_Install(containers['mv_covers_url'],containers['mv_covers_filename'], 'movie_images', work_path, mc)
-                     
-                     if get_cover_zip:
-                         mh.update_meta_installed(addon_id, movie_covers='true')
-                         Notify('small','Movie Cover Installation Success','','')
-                     else:
-                         print '******* ERROR - Movie cover install failed'
-                         Notify('small','Movie Cover Installation Failure','','')                     
+                     packs.append(image_pack(containers['mv_covers_url'], containers['mv_covers_filename'], 'movie_images', 'Movie Cover', movie_covers='true'))
              else:
                  print 'Movie Covers already installed'
 
@@ -526,15 +580,7 @@ def ContainerStartup():
                  dialog = xbmcgui.Dialog()
                  ret = dialog.yesno('Download Movie Fanart?', 'There is a metadata container avaliable.','Install it to get background images for Movies.', 'Would you like to get it? Its a large '+str(containers['mv_backdrop_size'])+'MB download.','Remind me later', 'Install')
                  if ret==True:
-                     #download dem files
-                     get_backdrop_zip=Zip_DL_and_Install(containers['mv_backdrop_url'],containers['mv_backdrop_filename'], 'movie_images', work_path, mc)
-                     
-                     if get_backdrop_zip:
-                         mh.update_meta_installed(addon_id, movie_backdrops='true')
-                         Notify('small','Movie Fanart Installation Success','','')
-                     else:
-                         print '******* ERROR - Movie backrop install failed'
-                         Notify('small','Movie Fanart Installation Failure','','')
+                     packs.append(image_pack(containers['mv_backdrop_url'], containers['mv_backdrop_filename'], 'movie_images', 'Movie Fanart', movie_backdrops='true'))
              else:
                  print 'Movie fanart already installed'
 
@@ -544,19 +590,67 @@ def ContainerStartup():
                  dialog = xbmcgui.Dialog()
                  ret = dialog.yesno('Download TV Show Fanart?', 'There is a metadata container avaliable.','Install it to get background images for TV Shows.', 'Would you like to get it? Its a large '+str(containers['tv_backdrop_size'])+'MB download.','Remind me later', 'Install')
                  if ret==True:
-                     #download dem files
-                     get_backdrop_zip=Zip_DL_and_Install(containers['tv_backdrop_url'],containers['tv_backdrop_filename'], 'tv_images', work_path, mc)
-                     
-                     if get_backdrop_zip:
-                         mh.update_meta_installed(addon_id, tv_backdrops='true')
-                         Notify('small','TV Fanart Installation Success','','')
-                     else:
-                         print '******* ERROR - TV backrop install failed'
-                         Notify('small','TV Fanart Installation Failure','','')                     
+                     packs.append(image_pack(containers['tv_backdrop_url'], containers['tv_backdrop_filename'], 'tv_images', 'TV Fanart', tv_backdrops='true'))
     
              else:
                  print 'TV fanart already installed'
 
+         if packs:
+             def install(path, installtype):
+                 from metahandler import metacontainers
+                 return metacontainers.MetaContainer().install_metadata_container(path, installtype)
+
+             def notify(title, message):
+                 Notify('small', title, message, '')
+
+             Notify('small', 'Meta Containers', 'Installing %d image packs in the background' % len(packs), '')
+             containerinstall.Installer(packs, install, notify, status_file).start()
+
+
+def Meta_Delta_Update(deltas, mh, mc, meta_installed):
+
+     deltas = metadelta.chain(deltas, meta_installed['last_update'])
+     if not deltas:
+         print 'Meta containers are up to date: %s' % meta_installed['last_update']
+         return meta_installed
+
+     size = 0
+     for delta in deltas:
+         size = size + delta['size']
+
+     dialog = xbmcgui.Dialog()
+     ret = dialog.yesno('Update Meta Containers to '+str(deltas[-1]['date'])+' ?', 'There is a metadata update avaliable.','Install it to get meta information for new videos.', 'Would you like to get it? Its a small '+str(size)+'MB download.','Remind me later', 'Install')
+     if ret==False:
+         return meta_installed
+
+     #images of a delta go into the packs already installed, only when we know where those are
+     folders = {'movie_images': getattr(mc, 'movie_images', None), 'tv_images': getattr(mc, 'tv_images', None)}
+
+     for delta in deltas:
+         filepath = os.path.normpath(os.path.join(mc.work_path, delta['filename']))
+         if not os.path.exists(filepath) or os.path.exists(filepath + '.journal'):
+             print 'Downloading meta delta: %s' % delta['date']
+             if Download(delta['url'] + delta['filename'], filepath, 'Meta Update ' + str(delta['date'])) == False:
+                 return meta_installed
+
+         try:
+             metadelta.apply(filepath, mh.videocache, folders, meta_installed)
+         except Exception, e:
+             print '**** Meta delta %s failed: %s' % (delta['date'], e)
+             Notify('small','Metacontainer Update Failure','','')
+             return meta_installed
+
+         #Record the new snapshot date, keeping the image packs flagged as they were
+         mh.insert_meta_installed(addon_id, last_update=delta['date'], movie_covers=meta_installed['movie_covers'], tv_covers=meta_installed['tv_covers'], tv_banners=meta_installed['tv_banners'], movie_backdrops=meta_installed['movie_backdrops'], tv_backdrops=meta_installed['tv_backdrops'])
+         meta_installed = mh.check_meta_installed(addon_id)
+         try:
+             os.remove(filepath)
+         except OSError:
+             pass
+
+     Notify('small','Metacontainer Update Success','','')
+     return meta_installed
+
 
 def Zip_DL_and_Install(url, filename, installtype,work_folder,mc):
 
@@ -568,7 +662,8 @@ def Zip_DL_and_Install(url, filename, installtype,work_folder,mc):
      #define the path to save it to
      filepath=os.path.normpath(os.path.join(work_folder,filename))
 
-     filepath_exists=os.path.exists(filepath)
+     #a zip with a journal is an interrupted download, which the downloader resumes
+     filepath_exists=os.path.exists(filepath) and not os.path.exists(filepath + '.journal')
      #if zip does not already exist, download from url, with nice display name.
      if filepath_exists==False:
                     
@@ -590,483 +685,112 @@ def resolve_minus(url, filename):
     return 'http://i.minus.com%s/d%s/%s' % (r.group(2), r.group(1), filename)
 
 
-def resolve_180upload(url):
-
-    try:
-        dialog = xbmcgui.DialogProgress()
-        dialog.create('Resolving', 'Resolving 180Upload Link...')
-        dialog.update(0)
-        
-        print '180Upload - Requesting GET URL: %s' % url
-        html = net.http_GET(url).content
-        
-        op = 'download1'
-        id = re.search('<input type="hidden" name="id" value="(.+?)">', html).group(1)
-        rand = re.search('<input type="hidden" name="rand" value="(.+?)">', html).group(1)
-        method_free = ''
-        
-        data = {'op': op, 'id': id, 'rand': rand, 'method_free': method_free}
-        
-        dialog.update(33)
-        
-        print '180Upload - Requesting POST URL: %s' % url
-        html = net.http_POST(url, data).content
-        
-        op = 'download2'
-        id = re.search('<input type="hidden" name="id" value="(.+?)">', html).group(1)
-        rand = re.search('<input type="hidden" name="rand" value="(.+?)">', html).group(1)
-        method_free = ''
-
-        data = {'op': op, 'id': id, 'rand': rand, 'method_free': method_free, 'down_direct': 1}
-
-        dialog.update(66)
-
-        print '180Upload - Requesting POST URL: %s' % url
-        html = net.http_POST(url, data).content
-        link = re.search('<span style="background:#f9f9f9;border:1px dotted #bbb;padding:7px;">.+?<a href="(.+?)">', html,re.DOTALL).group(1)
-        print '180Upload Link Found: %s' % link
-    
-        dialog.update(100)
-        dialog.close()
-        return link
-    except Exception, e:
-        print '**** 180Upload Error occured: %s' % e
-        raise
-    
-
-def resolve_speedyshare(url):
-
-    try:    
-        dialog = xbmcgui.DialogProgress()
-        dialog.create('Resolving', 'Resolving SpeedyShare Link...')
-        dialog.update(50)
-        
-        print 'SpeedyShare - Requesting GET URL: %s' % url
-        html = net.http_GET(url).content
-        
-        dialog.close()
-        
-        host = 'http://speedy.sh'
-        #host = re.search("<input value='(http://www[0-9]*.speedy.sh)/.+?'", html).group(1)
-        link = re.search("<a class=downloadfilename href='(.+?)'>", html).group(1)
-        return host + link
-    except Exception, e:
-        print '**** SpeedyShare Error occured: %s' % e
-        raise
-
+def resolve_form_host(resolver, url, account=None, quiet=False):
+    #Walk the forms of a host, showing progress and doing the free user waits
+    cookie_jar = None
+    if account and str2bool(selfAddon.getSetting(account+'-account')):
+        print '%s - Setting Cookie file' % resolver.name
+        cookie_jar = cookielib.LWPCookieJar(os.path.join(cookie_path, account+'.lwp'))
+        try:
+            cookie_jar.load(ignore_discard=True)
+        except Exception, e:
+            print '%s - Failed loading cookies: %s' % (resolver.name, e)
 
-def resolve_vidhog(url):
+    #No dialogs when resolving in the background, waits are simply slept
+    if quiet:
+        return resolver.resolve(url, cookie_jar=cookie_jar)
 
-    try:
-        
-        #Show dialog box so user knows something is happening
-        dialog = xbmcgui.DialogProgress()
-        dialog.create('Resolving', 'Resolving VidHog Link...')
-        dialog.update(0)
-        
-        print 'VidHog - Requesting GET URL: %s' % url
-        html = net.http_GET(url).content
+    #Show dialog box so user knows something is happening
+    dialog = xbmcgui.DialogProgress()
+    dialog.create('Resolving', 'Resolving %s Link...' % resolver.name)
+    dialog.update(0)
 
-        dialog.update(33)
-        
-        #Check page for any error msgs
-        if re.search('This server is in maintenance mode', html):
-            print '***** VidHog - Site reported maintenance mode'
-            raise Exception('File is currently unavailable on the host')
-        
-        #Set POST data values
-        op = re.search('<input type="hidden" name="op" value="(.+?)">', html).group(1)
-        usr_login = re.search('<input type="hidden" name="usr_login" value="(.*?)">', html).group(1)
-        postid = re.search('<input type="hidden" name="id" value="(.+?)">', html).group(1)
-        fname = re.search('<input type="hidden" name="fname" value="(.+?)">', html).group(1)
-        method_free = re.search('<input type="submit" name="method_free" value="(.+?)" class="freebtn right">', html).group(1)
-        
-        data = {'op': op, 'usr_login': usr_login, 'id': postid, 'fname': fname, 'referer': url, 'method_free': method_free}
-        
-        print 'VidHog - Requesting POST URL: %s DATA: %s' % (url, data)
-        html = net.http_POST(url, data).content
-        
-        dialog.update(66)
-                
-        #Set POST data values
-        op = re.search('<input type="hidden" name="op" value="(.+?)">', html).group(1)
-        postid = re.search('<input type="hidden" name="id" value="(.+?)">', html).group(1)
-        rand = re.search('<input type="hidden" name="rand" value="(.+?)">', html).group(1)
-        method_free = re.search('<input type="hidden" name="method_free" value="(.+?)">', html).group(1)
-        down_direct = int(re.search('<input type="hidden" name="down_direct" value="(.+?)">', html).group(1))
-        wait = int(re.search('<span id="countdown_str">Wait <span id=".+?">([0-9]*)</span>', html).group(1))
-        
-        data = {'op': op, 'id': postid, 'rand': rand, 'referer': url, 'method_free': method_free, 'down_direct': down_direct}
-        
+    def wait(seconds):
         dialog.close()
-        
-        #Do wait time for free accounts    
-        finished = do_wait('VidHog', '', wait)
-
-        if finished:
-            print 'VidHog - Requesting POST URL: %s DATA: %s' % (url, data)
-            
-            dialog.create('Resolving', 'Resolving VidHog Link...')
-            dialog.update(66)
-            
-            html = net.http_POST(url, data).content
-            
-            dialog.update(100)
-            
-            dialog.close()
-        
-            link = re.search('<strong><a href="(.+?)">Click Here to download this file</a></strong>', html).group(1)
-            return link
-        else:
-            return None
-        
-    except Exception, e:
-        print '**** VidHog Error occured: %s' % e
-        raise
-
-
-def resolve_uploadorb(url):
+        finished = do_wait(resolver.name, '', seconds)
+        dialog.create('Resolving', 'Resolving %s Link...' % resolver.name)
+        return finished
 
     try:
-
-        #Show dialog box so user knows something is happening
-        dialog = xbmcgui.DialogProgress()
-        dialog.create('Resolving', 'Resolving UploadOrb Link...')       
-        dialog.update(0)
-        
-        print 'UploadOrb - Requesting GET URL: %s' % url
-        html = net.http_GET(url).content
-        
-        dialog.update(33)
-        
-        #Check page for any error msgs
-        if re.search('This server is in maintenance mode', html):
-            print '***** UploadOrb - Site reported maintenance mode'
-            raise Exception('File is currently unavailable on the host')
-
-        #Set POST data values
-        op = re.search('<input type="hidden" name="op" value="(.+?)">', html).group(1)
-        usr_login = re.search('<input type="hidden" name="usr_login" value="(.*?)">', html).group(1)
-        postid = re.search('<input type="hidden" name="id" value="(.+?)">', html).group(1)
-        fname = re.search('<input type="hidden" name="fname" value="(.+?)">', html).group(1)
-        method_free = re.search('<input type="submit" name="method_free" value="(.+?)" class="btn2">', html).group(1)
-        
-        data = {'op': op, 'usr_login': usr_login, 'id': postid, 'fname': fname, 'referer': url, 'method_free': method_free}
-        
-        print 'UploadOrb - Requesting POST URL: %s DATA: %s' % (url, data)
-        html = net.http_POST(url, data).content
-
-        dialog.update(66)
-        
-        #Set POST data values
-        op = re.search('<input type="hidden" name="op" value="(.+?)">', html).group(1)
-        postid = re.search('<input type="hidden" name="id" value="(.+?)">', html).group(1)
-        rand = re.search('<input type="hidden" name="rand" value="(.+?)">', html).group(1)
-        method_free = re.search('<input type="hidden" name="method_free" value="(.+?)">', html).group(1)
-        down_direct = int(re.search('<input type="hidden" name="down_direct" value="(.+?)">', html).group(1))
-        
-        data = {'op': op, 'id': postid, 'rand': rand, 'referer': url, 'method_free': method_free, 'down_direct': down_direct}
-        print data
-        
-        print 'UploadOrb - Requesting POST URL: %s DATA: %s' % (url, data)
-        html = net.http_POST(url, data).content
-        
-        dialog.update(100)
-        link = re.search('ACTION="(.+?)">', html).group(1)
+        try:
+            return resolver.resolve(url, progress=dialog.update, wait=wait, cookie_jar=cookie_jar)
+        except Exception, e:
+            print '**** %s Error occured: %s' % (resolver.name, e)
+            raise
+    finally:
         dialog.close()
-        
-        return link
-
-    except Exception, e:
-        print '**** UploadOrb Error occured: %s' % e
-        raise
 
 
-def resolve_sharebees(url):
+def form_host(resolver, account=None):
+    #Resolver function for the host registry
+    def resolve(url, quiet=False):
+        return resolve_form_host(resolver, url, account, quiet)
+    return resolve
 
-    try:
-        
-        if str2bool(selfAddon.getSetting('sharebees-account')):
-            print 'ShareBees - Setting Cookie file'
-            cookiejar = os.path.join(cookie_path,'sharebees.lwp')
-            net.set_cookies(cookiejar)
-        
-        #Show dialog box so user knows something is happening
-        dialog = xbmcgui.DialogProgress()
-        dialog.create('Resolving', 'Resolving ShareBees Link...')       
-        dialog.update(0)
-        
-        print 'ShareBees - Requesting GET URL: %s' % url
-        html = net.http_GET(url).content
-        
-        dialog.update(50)
-        
-        #Set POST data values
-        #op = re.search('''<input type="hidden" name="op" value="(.+?)">''', html, re.DOTALL).group(1)
-        op = 'download1'
-        usr_login = re.search('<input type="hidden" name="usr_login" value="(.*?)">', html).group(1)
-        postid = re.search('<input type="hidden" name="id" value="(.+?)">', html).group(1)
-        fname = re.search('<input type="hidden" name="fname" value="(.+?)">', html).group(1)
-        method_free = "method_free"
-        
-        data = {'op': op, 'usr_login': usr_login, 'id': postid, 'fname': fname, 'referer': url, 'method_free': method_free}
-        
-        print 'ShareBees - Requesting POST URL: %s DATA: %s' % (url, data)
-        html = net.http_POST(url, data).content
-        
-        dialog.update(100)
 
-        link = None
-        sPattern = '''<div id="player_code">.*?<script type='text/javascript'>(eval.+?)</script>'''
-        r = re.search(sPattern, html, re.DOTALL + re.IGNORECASE)
+def sharebees_link(html, url, data):
+    #The link is in packed javascript, without the real file name
+    r = re.search("""<div id="player_code">.*?<script type='text/javascript'>(eval.+?)</script>""", html, re.DOTALL + re.IGNORECASE)
+    if r:
+        sUnpacked = jsunpack.unpack(r.group(1))
+        print(sUnpacked)
         
+        #Grab first portion of video link, excluding ending 'video.xxx' in order to swap with real file name
+        #Note - you don't actually need the filename, but for purpose of downloading via Icefilms it's needed so download video has a name
+        r = re.search("""("video/divx"src="|addVariable\('file',')(.+?)video[.]""", sUnpacked)
         if r:
-            sJavascript = r.group(1)
-            sUnpacked = jsunpack.unpack(sJavascript)
-            print(sUnpacked)
-            
-            #Grab first portion of video link, excluding ending 'video.xxx' in order to swap with real file name
-            #Note - you don't actually need the filename, but for purpose of downloading via Icefilms it's needed so download video has a name
-            sPattern  = '''("video/divx"src="|addVariable\('file',')(.+?)video[.]'''
-            r = re.search(sPattern, sUnpacked)              
-            
-            #Video link found
-            if r:
-                link = r.group(2) + fname
-                dialog.close()
-                return link
-
-        if not link:
-            print '***** ShareBees - Link Not Found'
-            raise Exception("Unable to resolve ShareBees")
-
-    except Exception, e:
-        print '**** ShareBees Error occured: %s' % e
-        raise
-
-
-def resolve_glumbouploads(url):
-
-    try:
-
-        #Show dialog box so user knows something is happening
-        dialog = xbmcgui.DialogProgress()
-        dialog.create('Resolving', 'Resolving GlumboUploads Link...')       
-        dialog.update(0)
-        
-        print 'GlumboUploads - Requesting GET URL: %s' % url
-        html = net.http_GET(url).content
-        
-        dialog.update(33)
-        
-        #Set POST data values
-        op = 'download1'
-        usr_login = re.search('<input type="hidden" name="usr_login" value="(.*?)">', html).group(1)
-        postid = re.search('<input type="hidden" name="id" value="(.+?)">', html).group(1)
-        fname = re.search("""input\[name="fname"\]'\).attr\('value', '(.+?)'""", html).group(1)
-        method_free = 'Free Download'
-        
-        data = {'op': op, 'usr_login': usr_login, 'id': postid, 'fname': fname, 'referer': url, 'method_free': method_free}
-        
-        print 'GlumboUploads - Requesting POST URL: %s DATA: %s' % (url, data)
-        html = net.http_POST(url, data).content
-
-        dialog.update(66)
-        
-        countdown = re.search('var cdnum = ([0-9]+);', html).group(1)
-
-        #They need to wait for the link to activate in order to get the proper 2nd page
-        dialog.close()
-        do_wait('Waiting on link to activate', '', int(countdown))
-        dialog.create('Resolving', 'Resolving GlumboUploads Link...') 
-        dialog.update(66)
-
-        #Set POST data values
-        op = 'download2'
-        rand = re.search('<input type="hidden" name="rand" value="(.+?)">', html).group(1)
-        
-        data = {'op': op, 'rand': rand, 'id': postid, 'referer': url, 'method_free': method_free, 'down_direct': 1}
-        
-        print 'GlumboUploads - Requesting POST URL: %s DATA: %s' % (url, data)
-        html = net.http_POST(url, data).content
-        
-        dialog.update(100)
-        link = re.search('This download link will work for your IP for 24 hours<br><br>.+?<a href="(.+?)">', html, re.DOTALL).group(1)
-        dialog.close()
-        
-        return link
-
-    except Exception, e:
-        print '**** GlumboUploads Error occured: %s' % e
-        raise
+            return r.group(2) + data['fname']
 
-def resolve_jumbofiles(url):
 
-    try:
-
-        #Show dialog box so user knows something is happening
-        dialog = xbmcgui.DialogProgress()
-        dialog.create('Resolving', 'Resolving JumboFiles Link...')       
-        dialog.update(0)
-        
-        print 'JumboFiles - Requesting GET URL: %s' % url
-        html = net.http_GET(url).content
-        
-        dialog.update(33)
-        
-        #Check page for any error msgs
-        if re.search('This server is in maintenance mode', html):
-            print '***** JumboFiles - Site reported maintenance mode'
-            raise Exception('File is currently unavailable on the host')
-
-        #Set POST data values
-        #op = re.search('<input type="hidden" name="op" value="(.+?)">', html).group(1)
-        op = 'download1'
-        postid = re.search('<input type="hidden" name="id" value="(.+?)">', html).group(1)
-        fname = re.search('<input type="hidden" name="fname" value="(.+?)">', html).group(1)
-        #method_free = re.search('<input type="hidden" name="method_free" value="(.*?)">', html).group(1)
-        method_free = 'method_free'
-                
-        data = {'op': op, 'id': postid, 'referer': url, 'method_free': method_free}
-        
-        print 'JumboFiles - Requesting POST URL: %s DATA: %s' % (url, data)
-        html = net.http_POST(url, data).content
-
-        dialog.update(66)
-
-        #Set POST data values
-        #op = re.search('<input type="hidden" name="op" value="(.+?)">', html).group(1)
-        op = 'download2'
-        postid = re.search('<input type="hidden" name="id" value="(.+?)">', html).group(1)
-        rand = re.search('<input type="hidden" name="rand" value="(.+?)">', html).group(1)
-        method_free = 'method_free'
-                
-        data = {'op': op, 'id': postid, 'rand': rand, 'method_free': method_free}
-        
-        print 'JumboFiles - Requesting POST URL: %s DATA: %s' % (url, data)
-        html = net.http_POST(url, data).content        
-
-        dialog.update(100)        
-        link = re.search('<FORM METHOD="LINK" ACTION="(.+?)">', html).group(1)
-        dialog.close()
-        
-        return link
+def billionuploads_link(html, url, data):
+    r = re.search('&product_download_url=(.+?)"', html)
+    if r:
+        return r.group(1) + "|referer=" + url
 
-    except Exception, e:
-        print '**** JumboFiles Error occured: %s' % e
-        raise
 
+#File hosts resolved by walking their download forms, see resolvers.py
+UPLOAD180 = resolvers.FormWalker('180Upload',
+    [resolvers.Form({'op': 'download1', 'method_free': ''}),
+     resolvers.Form({'op': 'download2', 'method_free': '', 'down_direct': 1})],
+    link='<span style="background:#f9f9f9;border:1px dotted #bbb;padding:7px;">.+?<a href="(.+?)">', flags=re.DOTALL)
 
-def resolve_movreel(url):
+SPEEDYSHARE = resolvers.FormWalker('SpeedyShare', [],
+    link=lambda html, url, data: 'http://speedy.sh' + re.search("<a class=downloadfilename href='(.+?)'>", html).group(1))
 
-    try:
+VIDHOG = resolvers.FormWalker('VidHog',
+    [resolvers.Form(submit='method_free'),
+     resolvers.Form(wait='<span id="countdown_str">Wait <span id=".+?">([0-9]*)</span>')],
+    link='<strong><a href="(.+?)">Click Here to download this file</a></strong>')
 
-        if str2bool(selfAddon.getSetting('movreel-account')):
-            print 'ShareBees - Setting Cookie file'
-            cookiejar = os.path.join(cookie_path,'movreel.lwp')
-            net.set_cookies(cookiejar)
+UPLOADORB = resolvers.FormWalker('UploadOrb',
+    [resolvers.Form(submit='method_free'),
+     resolvers.Form()],
+    link='ACTION="(.+?)">')
 
-        #Show dialog box so user knows something is happening
-        dialog = xbmcgui.DialogProgress()
-        dialog.create('Resolving', 'Resolving Movreel Link...')       
-        dialog.update(0)
-        
-        print 'Movreel - Requesting GET URL: %s' % url
-        html = net.http_GET(url).content
-        
-        dialog.update(33)
-        
-        #Check page for any error msgs
-        if re.search('This server is in maintenance mode', html):
-            print '***** Movreel - Site reported maintenance mode'
-            raise Exception('File is currently unavailable on the host')
-
-        #Set POST data values
-        op = re.search('<input type="hidden" name="op" value="(.+?)">', html).group(1)
-        usr_login = re.search('<input type="hidden" name="usr_login" value="(.*?)">', html).group(1)
-        postid = re.search('<input type="hidden" name="id" value="(.+?)">', html).group(1)
-        fname = re.search('<input type="hidden" name="fname" value="(.+?)">', html).group(1)
-        method_free = re.search('<input type="submit" name="method_free" style=".+?" value="(.+?)">', html).group(1)
-        
-        data = {'op': op, 'usr_login': usr_login, 'id': postid, 'referer': url, 'fname': fname, 'method_free': method_free}
-        
-        print 'Movreel - Requesting POST URL: %s DATA: %s' % (url, data)
-        html = net.http_POST(url, data).content
+SHAREBEES = resolvers.FormWalker('ShareBees',
+    [resolvers.Form({'op': 'download1'}, submit='method_free')],
+    link=sharebees_link)
 
-        #Check for download limit error msg
-        if re.search('<p class="err">.+?</p>', html):
-            print '***** Download limit reached'
-            errortxt = re.search('<p class="err">(.+?)</p>', html).group(1)
-            raise Exception(errortxt)
+GLUMBOUPLOADS = resolvers.FormWalker('GlumboUploads',
+    [resolvers.Form({'op': 'download1', 'method_free': 'Free Download',
+                     'fname': resolvers.scrape("""input\[name="fname"\]'\)\.attr\('value', '(.+?)'""")}),
+     resolvers.Form({'op': 'download2', 'method_free': 'Free Download', 'down_direct': 1}, wait='var cdnum = ([0-9]+);')],
+    link='This download link will work for your IP for 24 hours<br><br>.+?<a href="(.+?)">', flags=re.DOTALL)
 
-        dialog.update(66)
-        
-        #Set POST data values
-        op = re.search('<input type="hidden" name="op" value="(.+?)">', html).group(1)
-        postid = re.search('<input type="hidden" name="id" value="(.+?)">', html).group(1)
-        rand = re.search('<input type="hidden" name="rand" value="(.+?)">', html).group(1)
-        method_free = re.search('<input type="hidden" name="method_free" value="(.+?)">', html).group(1)
-        
-        data = {'op': op, 'id': postid, 'rand': rand, 'referer': url, 'method_free': method_free, 'down_direct': 1}
+JUMBOFILES = resolvers.FormWalker('JumboFiles',
+    [resolvers.Form({'op': 'download1'}, submit='method_free'),
+     resolvers.Form({'op': 'download2'}, submit='method_free')],
+    link='<FORM METHOD="LINK" ACTION="(.+?)">')
 
-        print 'Movreel - Requesting POST URL: %s DATA: %s' % (url, data)
-        html = net.http_POST(url, data).content
-        
-        dialog.update(100)
-        link = re.search('<a id="lnk_download" href="(.+?)">Download Original Video</a>', html, re.DOTALL).group(1)
-        dialog.close()
-        
-        return link
+MOVREEL = resolvers.FormWalker('Movreel',
+    [resolvers.Form(submit='method_free'),
+     resolvers.Form({'down_direct': 1})],
+    link='<a id="lnk_download" href="(.+?)">Download Original Video</a>', flags=re.DOTALL,
+    errors=[resolvers.PAGE_ERROR])
 
-    except Exception, e:
-        print '**** Movreel Error occured: %s' % e
-        raise
-
-
-def resolve_billionuploads(url):
-
-    try:
-
-        #Show dialog box so user knows something is happening
-        dialog = xbmcgui.DialogProgress()
-        dialog.create('Resolving', 'Resolving BillionUploads Link...')       
-        dialog.update(0)
-        
-        print 'BillionUploads - Requesting GET URL: %s' % url
-        html = net.http_GET(url).content
-        
-        #They need to wait for the link to activate in order to get the proper 2nd page
-        dialog.close()
-        do_wait('Waiting on link to activate', '', 3)
-        dialog.create('Resolving', 'Resolving BillionUploads Link...') 
-        dialog.update(50)
-        
-        #Check page for any error msgs
-        if re.search('This server is in maintenance mode', html):
-            print '***** BillionUploads - Site reported maintenance mode'
-            raise Exception('File is currently unavailable on the host')
-
-        #Set POST data values
-        op = 'download2'
-        rand = re.search('<input type="hidden" name="rand" value="(.+?)">', html).group(1)
-        postid = re.search('<input type="hidden" name="id" value="(.+?)">', html).group(1)
-        method_free = re.search('<input type="hidden" name="method_free" value="(.*?)">', html).group(1)
-        down_direct = re.search('<input type="hidden" name="down_direct" value="(.+?)">', html).group(1)
-                
-        data = {'op': op, 'rand': rand, 'id': postid, 'referer': url, 'method_free': method_free, 'down_direct': down_direct}
-        
-        print 'BillionUploads - Requesting POST URL: %s DATA: %s' % (url, data)
-        html = net.http_POST(url, data).content
-        dialog.update(100)
-        link = re.search('&product_download_url=(.+?)"', html).group(1)
-        link = link + "|referer=" + url
-        dialog.close()
-        
-        return link
-
-    except Exception, e:
-        print '**** BillionUploads Error occured: %s' % e
-        raise
+BILLIONUPLOADS = resolvers.FormWalker('BillionUploads',
+    [resolvers.Form({'op': 'download2'}, wait=3)],
+    link=billionuploads_link)
 
 
 def Startup_Routines():
@@ -1094,35 +818,15 @@ def Startup_Routines():
 
 def create_meta_pack():
        
-    # This function will scrape all A-Z categories of the entire site
-    
-    #Insert starting record to addon table so that all data and images are scraped/downloaded
-    mh=metahandlers.MetaData(preparezip=prepare_zip)
-    mh.insert_meta_installed(addon_id, last_update='Now', movie_covers='true', tv_covers='true', tv_banners='true', movie_backdrops='true', tv_backdrops='true')
-    
-    A2Z=[chr(i) for i in xrange(ord('A'), ord('Z')+1)]
-    
-    print '### GETTING MOVIE METADATA FOR ALL *MUSIC* ENTRIES'
-    MOVIEINDEX(iceurl + 'music/a-z/1')
-    print '### GETTING MOVIE METADATA FOR ALL *STANDUP* ENTRIES'
-    MOVIEINDEX(iceurl + 'standup/a-z/1')
-    print '### GETTING MOVIE METADATA FOR ALL *OTHER* ENTRIES'
-    MOVIEINDEX(iceurl + 'other/a-z/1')
-    print '### GETTING MOVIE METADATA FOR ALL ENTRIES ON: '+'1'
-    MOVIEINDEX(iceurl + 'movies/a-z/1')
-    for theletter in A2Z:
-         print '### GETTING MOVIE METADATA FOR ALL ENTRIES ON: '+theletter
-         MOVIEINDEX(iceurl + 'movies/a-z/' + theletter)
-
-         
-    print '### GETTING TV METADATA FOR ALL ENTRIES ON: '+'1'
-    TVINDEX(iceurl + 'tv/a-z/1')
-    for theletter in A2Z:
-         print '### GETTING TV METADATA FOR ALL ENTRIES ON: '+theletter
-         TVINDEX(iceurl + 'tv/a-z/' + theletter)
-    
-    #Ensure to reset addon fields to false so database is ready to deploy     
-    mh.update_meta_installed(addon_id, movie_covers='false', tv_covers='false', tv_banners='false', movie_backdrops='false', tv_backdrops='false')
+    # Builds the meta containers with the headless builder, which crawls the site
+    # and looks up the meta of every title side by side, see resources/lib/metapack.py
+    #run without arguments it builds into the meta_pack folder of the profile,
+    #no path has to go through the comma separated RunScript arguments
+    out = os.path.join(datapath, 'meta_pack')
+    script = os.path.join(icepath, 'resources', 'lib', 'metapack.py')
+    print 'Building meta pack into: %s' % out
+    xbmc.executebuiltin('RunScript(%s)' % script)
+    Notify('small','Meta Pack Build Started','','')
 
 
 def CATEGORIES():  #  (homescreen of addon)
@@ -1152,6 +856,7 @@ def CATEGORIES():  #  (homescreen of addon)
                 addDir('Homepage',iceurl+'index',56,homepage)
           addDir('Favourites',iceurl,57,os.path.join(art,'favourites.png'))
           addDir('Search',iceurl,55,search)
+          addDir('Download Queue',iceurl,209,'')
           
           #Only show if prepare_zip = True - meaning you are creating a meta pack
           if prepare_zip:
@@ -1202,7 +907,7 @@ def addFavourites(enablemetadata,directory,dircontents,contentType):
     stringlist=prepare_list(directory,dircontents)
     
     if enablemetadata == True:
-        metaget=metahandlers.MetaData(preparezip=prepare_zip)
+        metaget=meta_context
         meta_installed = metaget.check_meta_installed(addon_id)
     else:
         meta_installed = False
@@ -1474,7 +1179,7 @@ def RECENT(url):
 
         #initialise meta class before loop
         if meta_setting=='true':
-            metaget=metahandlers.MetaData(preparezip=prepare_zip)
+            metaget=meta_context
             meta_installed = metaget.check_meta_installed(addon_id)
         else:
             meta_installed = False
@@ -1516,7 +1221,7 @@ def LATEST(url):
         
         #initialise meta class before loop
         if meta_setting=='true':
-            metaget=metahandlers.MetaData(preparezip=prepare_zip)
+            metaget=meta_context
             meta_installed = metaget.check_meta_installed(addon_id)
         else:
             meta_installed = False
@@ -1558,7 +1263,7 @@ def WATCHINGNOW(url):
 
         #initialise meta class before loop
         if meta_setting=='true':
-            metaget=metahandlers.MetaData(preparezip=prepare_zip)
+            metaget=meta_context
             meta_installed = metaget.check_meta_installed(addon_id)
         else:
             meta_installed = False
@@ -1828,10 +1533,19 @@ def MOVIEINDEX(url):
 
     #initialise meta class before loop    
     if meta_setting=='true':
-        metaget=metahandlers.MetaData(preparezip=prepare_zip)
+        metaget=meta_context
         meta_installed = metaget.check_meta_installed(addon_id)
         
     temp = re.compile('(<h3>|<a name=i id=.+?></a><img class=star><a href=)(.+?)(<div|</h3>|>(.+?)<br>)').findall(link)
+
+    #look up the meta of the whole page at once
+    if meta_setting=='true':
+        items = []
+        for tag, link, longname, name in temp:
+            if tag != '<h3>':
+                items.extend(re.compile('<a name=i id=(.+?)></a><img class=star><a href=/(.+?)>(.+?)<br>').findall(tag + link + longname + name))
+        metas = PREFETCH_META(metaget, meta_installed, items, 100)
+
     for tag, link, longname, name in temp:
         if tag == '<h3>':
             VaddDir('[COLOR blue]' + link + '[/COLOR]', '', 0, '', False)
@@ -1840,7 +1554,7 @@ def MOVIEINDEX(url):
             scrape=re.compile('<a name=i id=(.+?)></a><img class=star><a href=/(.+?)>(.+?)<br>').findall(string)
             for imdb_id,url,name in scrape:
                 if meta_setting=='true':
-                    ADD_ITEM(metaget,meta_installed,imdb_id,url,name,100, totalitems=len(temp))
+                    ADD_ITEM(metaget,meta_installed,imdb_id,url,name,100, totalitems=len(temp), meta=metas.get((imdb_id, name)))
                 else:
                     #add without metadata -- imdb is still passed for use with Add to Favourites
                     for imdb_id,url,name in scrape:
@@ -1858,7 +1572,7 @@ def TVINDEX(url):
 
     #initialise meta class before loop    
     if meta_setting=='true':
-        metaget=metahandlers.MetaData(preparezip=prepare_zip)
+        metaget=meta_context
         meta_installed = metaget.check_meta_installed(addon_id)
         
     #list scraper now tries to get number of episodes on icefilms for show. this only works in A-Z.
@@ -1875,13 +1589,21 @@ def TVINDEX(url):
         regex = '<h3>(.+?)</h3>'
     scrape=re.search('<a name=i id=(.+?)></a><img class=star><a href=/(.+?)>(.+?)<br>', link)
 
+    #Break the remaining source into seperate lines and check if it contains a text entry
+    temp = re.compile('r>(.+?)<b').findall(link)
+
+    #look up the meta of the whole page at once
     if meta_setting=='true':
-        ADD_ITEM(metaget,meta_installed,scrape.group(1),scrape.group(2),scrape.group(3),12, totalitems=1)
+        items = [scrape.groups()]
+        for entry in temp:
+            items.extend(re.compile('<a name=i id=(.+?)></a><img class=star><a href=/(.+?)>(.+?)</a>').findall(entry))
+        metas = PREFETCH_META(metaget, meta_installed, items, 12)
+
+    if meta_setting=='true':
+        ADD_ITEM(metaget,meta_installed,scrape.group(1),scrape.group(2),scrape.group(3),12, totalitems=1, meta=metas.get((scrape.group(1), scrape.group(3))))
     else:
         addDir(scrape.group(3),iceurl + scrape.group(2),12,'',imdb='tt'+str(scrape.group(1)), totalItems=1)
     
-    #Break the remaining source into seperate lines and check if it contains a text entry
-    temp = re.compile('r>(.+?)<b').findall(link)
     for entry in temp:
         text = re.compile(regex).findall(entry)
         if text:
@@ -1890,7 +1612,7 @@ def TVINDEX(url):
         if scrape:
             for imdb_id,url,name in scrape:
                 if meta_setting=='true':
-                    ADD_ITEM(metaget,meta_installed,imdb_id,url,name,12, totalitems=len(temp))
+                    ADD_ITEM(metaget,meta_installed,imdb_id,url,name,12, totalitems=len(temp), meta=metas.get((imdb_id, name)))
                 else:
                     #add without metadata -- imdb is still passed for use with Add to Favourites
                     for imdb_id,url,name in scrape:
@@ -1939,7 +1661,7 @@ def TVSEASONS(url, imdb_id):
             season_nums = re.compile('Season ([0-9]{1,2}) ').findall(seasons)                        
             
             if meta_setting=='true':
-                metaget=metahandlers.MetaData(preparezip=prepare_zip)
+                metaget=meta_context
                 meta_installed = metaget.check_meta_installed(addon_id)
                 if meta_installed:
                     season_meta = metaget.get_seasons(showname, imdb_id, season_nums)
@@ -1996,15 +1718,33 @@ def TVEPLINKS(source, season, imdb_id):
         
     if meta_setting=='true':
         #initialise meta class before loop
-        metaget=metahandlers.MetaData(preparezip=prepare_zip)
+        metaget=meta_context
         meta_installed = metaget.check_meta_installed(addon_id)
     else:
         metaget=False
         meta_installed=False
+
+    #the show name is the same for every episode, get it once
+    showname = None
+    if metaget:
+        showname = EPISODE_SHOWNAME()
+
+    #fetch the episodes of the season missing from the meta cache all at once,
+    #get_episode() then only reads them from the cache
+    se = re.search('Season ([0-9]{1,2})', season)
+    if meta_installed and se:
+        episodes = []
+        for url, name, hd in match:
+            ep = re.search('[0-9]+x([0-9]+)', CLEANUP(name))
+            if ep:
+                episodes.append(int(ep.group(1)))
+        new_metaget = lambda: metahandlers.MetaData(preparezip=prepare_zip)
+        metabatch.prefetch_season(getattr(metaget, 'videocache', None), CLEANUP_FOR_META(showname), imdb_id.replace('t',''), int(se.group(1)), episodes, new_metaget)
+
     for url, name, hd in match:
             name = name + ' ' + hd
             print " TVepLinks name " + name
-            get_episode(season, name, imdb_id, url, metaget, meta_installed, totalitems=len(match)) 
+            get_episode(season, name, imdb_id, url, metaget, meta_installed, totalitems=len(match), showname=showname) 
     
     # Enable library mode & set the right view for the content
     setView('episodes', 'episodes-view')
@@ -2171,16 +1911,18 @@ def GETMIRRORS(url,link):
     save(mirrorfile, link)
     
     #check for the existence of categories, and set values.
-    if re.search('<div class=ripdiv><b>DVDRip / Standard Def</b>', link) is not None: dvdrip = 1
+    qualities = sourcetable.qualities(sourcetable.parse(link))
+
+    if sourcetable.DVDRIP in qualities: dvdrip = 1
     else: dvdrip = 0
     
-    if re.search('<div class=ripdiv><b>HD 720p</b>', link) is not None: hd720p = 1
+    if sourcetable.HD720P in qualities: hd720p = 1
     else: hd720p = 0
     
-    if re.search('<div class=ripdiv><b>DVD Screener</b>', link) is not None: dvdscreener = 1
+    if sourcetable.DVDSCREENER in qualities: dvdscreener = 1
     else: dvdscreener = 0
     
-    if re.search('<div class=ripdiv><b>R5/R6 DVDRip</b>', link) is not None: r5r6 = 1
+    if sourcetable.R5R6 in qualities: r5r6 = 1
     else: r5r6 = 0
     
     FlattenSrcType = selfAddon.getSetting('flatten-source-type')        
@@ -2232,182 +1974,30 @@ def addCatDir(url,dvdrip,hd720p,dvdscreener,r5r6):
                 addDir('R5/R6 DVDRip',url,104,os.path.join(art,'source_types','r5r6.png'), imdb=imdbnum)
 
 
-def PART(scrap,sourcenumber,args,cookie):
-     #check if source exists
+def ADDPART(sourcenumber,partnum,url):
+     #Add the link of a source (or of one of its parts) once its url is known
      sourcestring='Source #'+sourcenumber
-     checkforsource = re.search(sourcestring, scrap)
-     
-     megapic=handle_file('megapic','')
-     shared2pic=handle_file('shared2pic','')
-     rapidpic=handle_file('rapidpic','')
-     u180pic=handle_file('180pic','')
-     speedypic=handle_file('speedypic','')
-     vihogpic=handle_file('vihogpic','')
-     uploadorbpic=handle_file('uploadorbpic','')
-     sharebeespic=handle_file('sharebeespic','')
-     glumbopic=handle_file('glumbopic','')
-     movreelpic=handle_file('movreelpic','')
-     jumbopic=handle_file('jumbopic','')
-     billionpic=handle_file('billionpic','')
-     
-     #if source exists proceed.
-     if checkforsource is not None:
-          
-          #check if source contains multiple parts
-          multiple_part = re.search('<p>Source #'+sourcenumber+':', scrap)
-          
-          if multiple_part is not None:
-               print sourcestring+' has multiple parts'
-               #get all text under source if it has multiple parts
-               multi_part_source=re.compile('<p>Source #'+sourcenumber+': (.+?)PART 1(.+?)</i><p>').findall(scrap)
-
-               #put scrape back together
-               for sourcescrape1,sourcescrape2 in multi_part_source:
-                    scrape=sourcescrape1+'PART 1'+sourcescrape2
-                    pair = re.compile("onclick='go\((\d+)\)'>PART\s+(\d+)").findall(scrape)
-
-                    for id, partnum in pair:
-                        url = GetSource(id, args, cookie)
-
-                        # check if source is megaupload or 2shared, and add all parts as links
-                        ismega = re.search('\.megaupload\.com/', url)
-                        is2shared = re.search('\.2shared\.com/', url)
-                        israpid = re.search('rapidshare\.com/', url)
-                        is180 = re.search('180upload\.com/', url)
-                        isspeedy = re.search('speedy\.sh/', url)
-                        isvidhog = re.search('vidhog\.com/', url)
-                        isuploadorb = re.search('uploadorb\.com/', url)
-                        issharebees = re.search('sharebees\.com/', url)
-                        isglumbo = re.search('glumbouploads\.com/', url)
-                        isjumbo = re.search('jumbofiles\.com/', url)
-                        ismovreel = re.search('movreel\.com/', url)
-                        isbillion = re.search('billionuploads\.com/', url)
-
-                        partname='Part '+partnum
-                        if ismega:
-                              fullname=sourcestring+' | MU | '+partname
-                              logo = megapic
-                        elif is2shared:
-                              fullname=sourcestring+' | 2S | '+partname
-                              logo = shared2pic
-                        elif israpid:
-                              fullname=sourcestring+' | RS | '+partname
-                              logo = rapidpic
-                        elif is180:
-                              fullname=sourcestring+' | 180 | '+partname
-                              logo = u180pic
-                        elif isspeedy:
-                              fullname=sourcestring+' | SS | '+partname
-                              logo = speedypic
-                        elif isvidhog:
-                              fullname=sourcestring+' | VH | '+partname
-                              logo = vihogpic
-                        elif isuploadorb:
-                              fullname=sourcestring+' | UO | '+partname
-                              logo = uploadorbpic
-                        elif issharebees:
-                              fullname=sourcestring+' | SB | '+partname
-                              logo = sharebeespic
-                        elif isglumbo:
-                              fullname=sourcestring+' | GU | '+partname
-                              logo = glumbopic
-                        elif isjumbo:
-                              fullname=sourcestring+' | JF | '+partname
-                              logo = jumbopic
-                        elif ismovreel:
-                              fullname=sourcestring+' | MR | '+partname
-                              logo = movreelpic
-                        elif isbillion:
-                              fullname=sourcestring+' | BU | '+partname
-                              logo = billionpic
 
+     host = hosts.lookup(url)
+     if host is None:
+          print 'Unknown host for '+sourcestring+': '+url
+          return
 
-                        try:
-                            sources = eval(cache.get("source"+str(sourcenumber)+"parts"))
-                        except:
-                            sources = {partnum: url}
-                            print 'sources havent been set yet...'  
-
-                        sources[partnum] = url
-                        cache.delete("source"+str(sourcenumber)+"parts")
-                        cache.set("source"+str(sourcenumber)+"parts", repr(sources))
-                        stacked = str2bool(selfAddon.getSetting('stack-multi-part'))
-
-                        if stacked and partnum == '1':
-                            fullname = fullname.replace('Part 1', 'Multiple Parts')
-                            addExecute(fullname,url,get_default_action(),logo,stacked)
-                        elif not stacked:
-                            addExecute(fullname,url,get_default_action(),logo)                                                
-
-          # if source does not have multiple parts...
-          elif multiple_part is None:
-               # print sourcestring+' is single part'
-               # find corresponding '<a rel=?' entry and add as a one-link source
-               source5=re.compile('<a\s+rel='+sourcenumber+'.+?onclick=\'go\((\d+)\)\'>Source\s+#'+sourcenumber+':').findall(scrap)
-               # print source5
-
-               for id in source5:
-                    url = GetSource(id, args, cookie)
-                    ismega = re.search('\.megaupload\.com/', url)
-                    is2shared = re.search('\.2shared\.com/', url)
-                    israpid = re.search('rapidshare\.com/', url)
-                    is180 = re.search('180upload\.com/', url)
-                    isspeedy = re.search('speedy\.sh/', url)
-                    isvidhog = re.search('vidhog\.com/', url)
-                    isuploadorb = re.search('uploadorb\.com/', url)
-                    issharebees = re.search('sharebees\.com/', url)
-                    isglumbo = re.search('glumbouploads\.com/', url)
-                    isjumbo = re.search('jumbofiles\.com/', url)
-                    ismovreel = re.search('movreel\.com/', url)
-                    isbillion = re.search('billionuploads\.com/', url)
-                    
-                    if ismega is not None:
-                         fullname=sourcestring+' | MU | Full'
-                         addExecute(fullname,url,get_default_action(),megapic)
-                    
-                    elif is2shared is not None:
-                         fullname=sourcestring+' | 2S  | Full'
-                         addExecute(fullname,url,get_default_action(),shared2pic)
+     # multiple part source, add all parts as links
+     if partnum is not None:
+          fullname=sourcestring+' | '+host.code+' | Part '+partnum
+          stacked = str2bool(selfAddon.getSetting('stack-multi-part'))
 
-                    elif israpid is not None:
-                         fullname=sourcestring+' | RS  | Full'
-                         addExecute(fullname,url,get_default_action(),rapidpic)
+          if stacked and partnum == '1':
+              fullname = fullname.replace('Part 1', 'Multiple Parts')
+              addExecute(fullname,url,get_default_action(),host.icon,stacked)
+          elif not stacked:
+              addExecute(fullname,url,get_default_action(),host.icon)
 
-                    elif is180 is not None:
-                         fullname=sourcestring+' | 180  | Full'
-                         addExecute(fullname,url,get_default_action(),u180pic)
-
-                    elif isspeedy is not None:
-                         fullname=sourcestring+' | SS  | Full'
-                         addExecute(fullname,url,get_default_action(),speedypic)
-
-                    elif isvidhog is not None:
-                         fullname=sourcestring+' | VH  | Full'
-                         addExecute(fullname,url,get_default_action(),vihogpic)
-
-                    elif isuploadorb is not None:
-                         fullname=sourcestring+' | UO  | Full'
-                         addExecute(fullname,url,get_default_action(),uploadorbpic)
-
-                    elif issharebees:
-                         fullname=sourcestring+' | SB  | Full'
-                         addExecute(fullname,url,get_default_action(),sharebeespic)
-
-                    elif isglumbo:
-                         fullname=sourcestring+' | GU  | Full'
-                         addExecute(fullname,url,get_default_action(),glumbopic)
-
-                    elif isjumbo:
-                         fullname=sourcestring+' | JF  | Full'
-                         addExecute(fullname,url,get_default_action(),jumbopic)
-
-                    elif ismovreel:
-                         fullname=sourcestring+' | MR  | Full'
-                         addExecute(fullname,url,get_default_action(),movreelpic)
-
-                    elif isbillion:
-                         fullname=sourcestring+' | BU  | Full'
-                         addExecute(fullname,url,get_default_action(),billionpic)
+     # single part source
+     else:
+          fullname=sourcestring+' | '+host.code+'  | Full'
+          addExecute(fullname,url,get_default_action(),host.icon)
 
 
 def GetSource(id, args, cookie):
@@ -2418,7 +2008,7 @@ def GetSource(id, args, cookie):
     params['m'] = m
     params['s'] = s
     paramsenc = urllib.urlencode(params)
-    body = GetURL(ICEFILMS_AJAX, params = paramsenc, cookie = cookie)
+    body = GetURL(ICEFILMS_AJAX, params = paramsenc, cookie = cookie, quiet = True)
     print 'response: %s' % body
     source = re.search('url=(http[^&]+)', body)
     if source:
@@ -2430,7 +2020,7 @@ def GetSource(id, args, cookie):
     return url
 
 
-def SOURCE(page, sources):
+def SOURCE(page, records):
           # get settings
           # extract the ingredients used to generate the XHR request
           #
@@ -2446,7 +2036,7 @@ def SOURCE(page, sources):
           #
           #     m:   starts at 0, decremented each time a mousemove event is fired e.g. -123
           #     s:   seconds since page loaded (> 5, < 250)
-          #     id:  source ID in the link's onclick attribute (extracted in PART)
+          #     id:  source ID in the link's onclick attribute (extracted by sourcetable.parse)
 
           args = {
               'iqs': '',
@@ -2470,69 +2060,93 @@ def SOURCE(page, sources):
           listitem=Item_Meta(vidname)
 
           try:
-              for fname in os.listdir(dlDir):
-                  match = re.match(re.escape(vidname)+' *(.*)\.avi$', fname)
-                  if match is not None:
-                      if os.path.exists(os.path.join(dlDir,fname)+'.dling'):
-                          listitem.setLabel("Play Downloading "+match.group(0))
-                          addDownloadControls(match.group(0),os.path.join(dlDir,fname), listitem)
-                      else:
-                          listitem.setLabel("Play Local File" + match.group(0))
-                          addLocal("Play Local File " + match.group(0), os.path.join(dlDir,fname), listitem)
-          except:
-              pass
-
-          # create a list of numbers: 1-21
-          num = 1
-          numlist = list('1')
-          while num < 21:
-              num = num+1
-              numlist.append(str(num))
-
-          #for every number, run PART.
-          #The first thing PART does is check whether that number source exists...
-          #...so it's not as CPU intensive as you might think.
-
-          for thenumber in numlist:
-               PART(sources,thenumber,args,cookie)
+              download_index = get_download_index()
+              entries = download_index.files(vidname)
+
+              #files downloaded before the index existed: pick up the single part file
+              if not entries and dlDir != 'path not set':
+                  oldpath = os.path.join(dlDir, Clean_Windows_String(vidname) + '.avi')
+                  if os.path.isfile(oldpath) and not os.path.exists(oldpath + '.dling'):
+                      download_index.complete(oldpath, title=vidname)
+                      entries = download_index.files(vidname)
+
+              for entry in entries:
+                  fname = os.path.basename(entry['path'])
+                  status = download_index.status(entry)
+                  if status == dlindex.MISSING:
+                      download_index.remove(entry['path'])
+                  elif os.path.exists(entry['path'] + '.dling'):
+                      listitem.setLabel("Play Downloading "+fname)
+                      addDownloadControls(fname, entry['path'], listitem)
+                  elif status == dlindex.COMPLETE:
+                      listitem.setLabel("Play Local File" + fname)
+                      addLocal("Play Local File " + fname, entry['path'], listitem)
+                  else:
+                      addLocal("Play Incomplete File " + fname, entry['path'], listitem)
+          except Exception, e:
+              print 'Failed to list local files: %s' % e
+
+          #one (source number, part number, ajax id) per link, in page order
+          links = []
+          for quality, thenumber, partnum, id in records:
+               links.append((thenumber, partnum, id))
+
+          #Each link needs its own ajax call, do them side by side.
+          #A failed call only loses its own link, and is reported once below
+          #rather than by a dialog from every worker thread
+          failed = []
+          def lookup(link):
+               try:
+                    return GetSource(link[2], args, cookie)
+               except Exception, e:
+                    print '**** Source lookup failed for %s: %s' % (link[2], e)
+                    failed.append(link)
+                    return ''
+          urls = workerpool.map_ordered(lookup, links, workers=SOURCE_WORKERS)
+          if failed:
+               Notify('big','Error Requesting Site','An error has occured communicating with Icefilms', '', '', 'Check your connection and the Icefilms site.' )
+
+          parts = {}
+          for (thenumber, partnum, id), url in zip(links, urls):
+               if partnum is not None:
+                    parts.setdefault(thenumber, {})[partnum] = url
+               ADDPART(thenumber, partnum, url)
+
+          #save the part urls of multi part sources, used when playing them stacked
+          for thenumber, sourceparts in parts.items():
+               cache.delete("source"+thenumber+"parts")
+               cache.set("source"+thenumber+"parts", repr(sourceparts))
           setView(None, 'default-view')
 
 def DVDRip(url):
         #link=cache.get('mirror')
         link=handle_file('mirror','open')
-        #string for all text under standard def border
-        defcat=re.compile('<div class=ripdiv><b>DVDRip / Standard Def</b>(.+?)</div>').findall(link)
-        for scrape in defcat:
-                SOURCE(link, scrape)
+        #all sources listed under the standard def border
+        SOURCE(link, sourcetable.for_quality(sourcetable.parse(link), sourcetable.DVDRIP))
         setView(None, 'default-view')
 
 def HD720p(url):
         #link=cache.get('mirror')
         link=handle_file('mirror','open')
-        #string for all text under hd720p border
-        defcat=re.compile('<div class=ripdiv><b>HD 720p</b>(.+?)</div>').findall(link)
-        for scrape in defcat:
-                SOURCE(link, scrape)
+        #all sources listed under the hd720p border
+        SOURCE(link, sourcetable.for_quality(sourcetable.parse(link), sourcetable.HD720P))
         setView(None, 'default-view')
 
 def DVDScreener(url):
         #link=cache.get('mirror')
         link=handle_file('mirror','open')
-        #string for all text under dvd screener border
-        defcat=re.compile('<div class=ripdiv><b>DVD Screener</b>(.+?)</div>').findall(link)
-        for scrape in defcat:
-                SOURCE(link, scrape)
+        #all sources listed under the dvd screener border
+        SOURCE(link, sourcetable.for_quality(sourcetable.parse(link), sourcetable.DVDSCREENER))
         setView(None, 'default-view')
         
 def R5R6(url):
         #link=cache.get('mirror')
         link=handle_file('mirror','open')
-        #string for all text under r5/r6 border
-        defcat=re.compile('<div class=ripdiv><b>R5/R6 DVDRip</b>(.+?)</div>').findall(link)
-        for scrape in defcat:
-                SOURCE(link, scrape)
+        #all sources listed under the r5/r6 border
+        SOURCE(link, sourcetable.for_quality(sourcetable.parse(link), sourcetable.R5R6))
         setView(None, 'default-view')
-        
+
+
 class TwoSharedDownloader:
      
      def __init__(self):
@@ -2556,7 +2170,7 @@ class TwoSharedDownloader:
 
      
           
-def SHARED2_HANDLER(url):
+def SHARED2_HANDLER(url, quiet=False):
           #downloader2Shared = TwoSharedDownloader()
           #vidFile = downloader2Shared.returnLink(url)
 
@@ -2570,7 +2184,9 @@ def SHARED2_HANDLER(url):
           #Check if a download limit msg is showing
           if re.search('Your free download limit is over.', html):
               wait_time = re.search('<span id="timeToWait">(.+?)</span>', html).group(1)
-              Notify('big','2Shared Download Limit Exceeded','You have reached your download limit', '', '', 'You must wait ' + wait_time + ' to try again' )
+              print '2Shared - Download limit reached, wait %s' % wait_time
+              if not quiet:
+                  Notify('big','2Shared Download Limit Exceeded','You have reached your download limit', '', '', 'You must wait ' + wait_time + ' to try again' )
               return None
           
           #If no download limit msg lets grab link, must post to it first for download to activate
@@ -2582,34 +2198,33 @@ def SHARED2_HANDLER(url):
               return d3link
 
 
-def GetURL(url, params = None, referrer = ICEFILMS_REFERRER, cookie = None, save_cookie = False):
+def GetURL(url, params = None, referrer = ICEFILMS_REFERRER, cookie = None, save_cookie = False, quiet = False):
+     #quiet requests raise their errors instead of showing them, for worker threads
      print 'GetUrl: ' + url
      print 'params: ' + repr(params)
      print 'referrer: ' + repr(referrer)
      print 'cookie: ' + repr(cookie)
      print 'save_cookie: ' + repr(save_cookie)
 
-     if params:
-        req = urllib2.Request(url, params)
-        # req.add_header('Content-type', 'application/x-www-form-urlencoded')
-     else:
-         req = urllib2.Request(url)
-
-     req.add_header('User-Agent', USER_AGENT)
+     headers = {}
 
      # as of 2011-06-02, IceFilms sources aren't displayed unless a valid referrer header is supplied:
      # http://forum.xbmc.org/showpost.php?p=810288&postcount=1146
      if referrer:
-         req.add_header('Referer', referrer)
+         headers['Referer'] = referrer
 
      if cookie:
-         req.add_header('Cookie', cookie)
+         headers['Cookie'] = cookie
 
      # avoid Python >= 2.5 ternary operator for backwards compatibility
      # http://wiki.xbmc.org/index.php?title=Python_Development#Version
      try:
-         response = urllib2.urlopen(req)
-         body = response.read()
+         ttl = page_cache_ttl(url)
+         if ttl and params is None and cookie is None and not save_cookie:
+             return page_cache.fetch(url, ttl, headers=headers)
+
+         response = httpclient.request(url, data=params, headers=headers)
+         body = response.content
 
          if save_cookie:
              setcookie = response.info().get('Set-Cookie', None)
@@ -2617,17 +2232,26 @@ def GetURL(url, params = None, referrer = ICEFILMS_REFERRER, cookie = None, save
              if setcookie:
                  setcookie = re.search('([^=]+=[^=;]+)', setcookie).group(1)
                  body = body + '<cookie>' + setcookie + '</cookie>'
-    
-         response.close()
 
      except Exception, e:
          print '****** ERROR: %s' % e
+         if quiet:
+             raise
          Notify('big','Error Requesting Site','An error has occured communicating with Icefilms', '', '', 'Check your connection and the Icefilms site.' )
          body = ''
          pass
 
      return body
 
+def page_cache_ttl(url):
+     if page_cache is None or not url.startswith(iceurl):
+         return 0
+     path = url[len(iceurl):]
+     for pattern, ttl in PAGE_CACHE_TTLS:
+         if re.match(pattern, path):
+             return ttl
+     return 0
+
 def WaitIf():
      #killing playback is necessary if switching playing of one megaup/2share stream to another
      if xbmc.Player().isPlayingVideo() == True:
@@ -2740,11 +2364,17 @@ def Item_Meta(name):
           return listitem
 
 
-def do_wait(source, account, wait_time):
+def do_wait(source, account, wait_time, quiet=False):
      # do the necessary wait, with  a nice notice and pre-set waiting time. I have found the below waiting times to never fail.
      
      if int(wait_time) == 0:
          wait_time = 1
+
+     #background resolves can't show a dialog, just sit the wait out
+     if quiet:
+         print 'waiting '+str(wait_time)+' secs'
+         xbmc.sleep(int(wait_time) * 1000)
+         return True
          
      if account == 'platinum':    
           return handle_wait(int(wait_time),source,'Loading video with your *Platinum* account.')
@@ -2789,22 +2419,27 @@ def handle_wait(time_to_wait,title,text):
          print 'done waiting'
          return True
 
-def Handle_Vidlink(url):
-     #video link preflight, pays attention to settings / checks if url is mega or 2shared
-     ismega = re.search('\.megaupload\.com/', url)
-     is2shared = re.search('\.2shared\.com/', url)
-     israpid = re.search('rapidshare\.com/', url)
-     is180 = re.search('180upload\.com/', url)
-     isspeedy = re.search('speedy\.sh/', url)
-     isvidhog = re.search('vidhog\.com/', url)
-     isuploadorb = re.search('uploadorb\.com/', url)
-     issharebees = re.search('sharebees\.com/', url)
-     isglumbo = re.search('glumbouploads\.com/', url)
-     isjumbo = re.search('jumbofiles\.com/', url)
-     ismovreel = re.search('movreel\.com/', url)
-     isbillion = re.search('billionuploads\.com/', url)
+def Handle_Vidlink(url, quiet=False):
+     #Reuse the link resolved last time if it hasn't expired yet
+     #quiet resolves show no dialogs, for resolving in the background
+     link = link_cache.get(url)
+     if link:
+          print 'Handle_Vidlink - Using cached link: %s' % link
+          return link
+
+     link = Resolve_Vidlink(url, quiet)
+
+     host = hosts.lookup(url)
+     if link and host is not None and host.link_ttl:
+          link_cache.put(url, link, host.link_ttl)
+     return link
+
+
+def Resolve_Vidlink(url, quiet=False):
+     #video link preflight, pays attention to settings / finds the host of the url
+     host = hosts.lookup(url)
      
-     host = re.search('//[w\.]*(.+?)/', url).group(1)
+     hostname = re.search('//[w\.]*(.+?)/', url).group(1)
          
     #Using real-debrid to get the generated premium link
      debrid_account = str2bool(selfAddon.getSetting('realdebrid-account'))
@@ -2814,85 +2449,83 @@ def Handle_Vidlink(url):
           debridpass = selfAddon.getSetting('realdebrid-password')
           rd = debridroutines.RealDebrid(cookie_jar, debriduser, debridpass)
           
-          if rd.valid_host(host):
+          if rd.valid_host(hostname):
               if rd.Login():
                    download_details = rd.Resolve(url)
                    link = download_details['download_link']
                    if not link:
-                       Notify('big','Real-Debrid','Error occurred attempting to stream the file.','',line2=download_link['message'])
+                       print 'Real-Debrid - Error resolving: %s' % download_details['message']
+                       if not quiet:
+                           Notify('big','Real-Debrid','Error occurred attempting to stream the file.','',line2=download_details['message'])
                        return None
                    else:
                        print 'Real-Debrid Link resolved: %s ' % download_details['download_link']
                        return link
 
-     if ismega:
-          WaitIf()
-          
-          mu = megaroutines.megaupload(datapath)
-          link = mu.resolve_megaup(url)
-
-          finished = do_wait('MegaUpload', link[3], link[4])
-
-          if finished:
-               return link[0]
-          else:
-               return None
-
-     elif is2shared:
-          shared2url=SHARED2_HANDLER(url)
-          return shared2url
-
-     elif is180:
-          return resolve_180upload(url)
-          
-     elif isspeedy:
-          return resolve_speedyshare(url)
-
-     elif isvidhog:
-          return resolve_vidhog(url)
+     if host is None:
+          print 'Handle_Vidlink - No resolver for: %s' % url
+          return None
 
-     elif isuploadorb:
-          return resolve_uploadorb(url)
+     return host.resolve(url, quiet)
 
-     elif issharebees:
-          return resolve_sharebees(url)
 
-     elif isglumbo:
-          return resolve_glumbouploads(url)
+def resolve_megaupload(url, quiet=False):
+     #a background resolve must not stop the part that is playing
+     if not quiet:
+         WaitIf()
+     
+     mu = megaroutines.megaupload(datapath)
+     link = mu.resolve_megaup(url)
 
-     elif isjumbo:
-          return resolve_jumbofiles(url)
+     finished = do_wait('MegaUpload', link[3], link[4], quiet)
 
-     elif ismovreel:
-          return resolve_movreel(url)
+     if finished:
+          return link[0]
+     else:
+          return None
 
-     elif isbillion:
-          return resolve_billionuploads(url)
 
-     elif israpid:
-          
-          account = selfAddon.getSetting('rapidshare-account')
-          if account == 'true':
-              rapid_cookie = cache.get('rapid_cookie')
-          else:
-              rapid_cookie = ''
-          
-          rapidssl = str2bool(selfAddon.getSetting('rapidshare-ssl'))
-          rs = rapidroutines.rapidshare(use_ssl=rapidssl)
-          download_details = rs.resolve_link(url, cookie=rapid_cookie)
-          
-          #Check if the returned status is good, else display the returned error message
-          if download_details['status'] == '1':
-          
-              finished = do_wait('RapidShare', '', download_details['wait_time'])
+def resolve_rapidshare(url, quiet=False):
+     account = selfAddon.getSetting('rapidshare-account')
+     if account == 'true':
+         rapid_cookie = cache.get('rapid_cookie')
+     else:
+         rapid_cookie = ''
+     
+     rapidssl = str2bool(selfAddon.getSetting('rapidshare-ssl'))
+     rs = rapidroutines.rapidshare(use_ssl=rapidssl)
+     download_details = rs.resolve_link(url, cookie=rapid_cookie)
+     
+     #Check if the returned status is good, else display the returned error message
+     if download_details['status'] == '1':
+     
+         finished = do_wait('RapidShare', '', download_details['wait_time'], quiet)
 
-              if finished == True:
-                   return download_details['download_link']
-              else:
-                   return None
-          else:
-              Notify('big','RapidShare','Error occurred attempting to stream the file.','', line2=download_details['message'])
+         if finished == True:
+              return download_details['download_link']
+         else:
               return None
+     else:
+         print 'RapidShare - Error resolving: %s' % download_details['message']
+         if not quiet:
+             Notify('big','RapidShare','Error occurred attempting to stream the file.','', line2=download_details['message'])
+         return None
+
+
+#Supported file hosts: domain, short code shown in the source list, icon, resolver
+#and how long a resolved link can be reused
+hosts.register('megaupload.com', 'MU', handle_file('megapic',''), resolve_megaupload, link_ttl=30*60)
+hosts.register('2shared.com', '2S', handle_file('shared2pic',''), SHARED2_HANDLER, link_ttl=60*60)
+hosts.register('rapidshare.com', 'RS', handle_file('rapidpic',''), resolve_rapidshare, link_ttl=30*60)
+hosts.register('180upload.com', '180', handle_file('180pic',''), form_host(UPLOAD180), link_ttl=2*60*60)
+hosts.register('speedy.sh', 'SS', handle_file('speedypic',''), form_host(SPEEDYSHARE), link_ttl=6*60*60)
+hosts.register('vidhog.com', 'VH', handle_file('vihogpic',''), form_host(VIDHOG), link_ttl=2*60*60)
+hosts.register('uploadorb.com', 'UO', handle_file('uploadorbpic',''), form_host(UPLOADORB), link_ttl=2*60*60)
+hosts.register('sharebees.com', 'SB', handle_file('sharebeespic',''), form_host(SHAREBEES, 'sharebees'), link_ttl=2*60*60)
+hosts.register('glumbouploads.com', 'GU', handle_file('glumbopic',''), form_host(GLUMBOUPLOADS), link_ttl=12*60*60)
+hosts.register('jumbofiles.com', 'JF', handle_file('jumbopic',''), form_host(JUMBOFILES), link_ttl=2*60*60)
+hosts.register('movreel.com', 'MR', handle_file('movreelpic',''), form_host(MOVREEL, 'movreel'), link_ttl=2*60*60)
+hosts.register('billionuploads.com', 'BU', handle_file('billionpic',''), form_host(BILLIONUPLOADS), link_ttl=2*60*60)
 
 
 def PlayFile(name,url):
@@ -2908,6 +2541,35 @@ def PlayFile(name,url):
         print 'local file playing failed'
 
 
+class PrefetchLink (threading.Thread):
+    #Resolves the link of the next part in the background while the current part plays
+    def __init__(self, url):
+        self.url = url
+        self.link = None
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+
+    def run(self):
+        print 'Prefetching link of next part: %s' % self.url
+        try:
+            self.link = Handle_Vidlink(self.url, quiet=True)
+        except Exception, e:
+            print '**** Prefetch failed for %s: %s' % (self.url, e)
+
+    def get_link(self):
+        #Wait for the background resolve, and fall back to a normal one if it failed.
+        #A link the link cache has dropped since, because it expired while a long
+        #part played or because it failed to play (invalidated), is resolved again
+        self.join()
+        host = hosts.lookup(self.url)
+        if self.link and host is not None and host.link_ttl and link_cache.get(self.url) is None:
+            print 'Prefetched link of %s expired, resolving again' % self.url
+            self.link = None
+        if self.link:
+            return self.link
+        return Handle_Vidlink(self.url)
+
+
 def Stream_Source(name, url, download_play=False, download=False, stacked=False):
     
     print 'Entering Stream Source with options - Name: %s Url: %s DownloadPlay: %s Download: %s Stacked: %s' % (name, url, download_play, download, stacked)
@@ -2922,6 +2584,8 @@ def Stream_Source(name, url, download_play=False, download=False, stacked=False)
 
     last_part = False
     current_part = 1
+    prefetch = None
+    next_url = None
 
     while last_part == False:
         
@@ -2944,9 +2608,13 @@ def Stream_Source(name, url, download_play=False, download=False, stacked=False)
 
         print 'Last video part: %s' % str(last_part)
         
-        #Grab the final playable link
+        #Grab the final playable link, already being resolved if this is a following part
         try:
-            link = Handle_Vidlink(url)
+            if prefetch is not None:
+                link = prefetch.get_link()
+                prefetch = None
+            else:
+                link = Handle_Vidlink(url)
             
             if link == None:
                callEndOfDirectory = False
@@ -2956,6 +2624,12 @@ def Stream_Source(name, url, download_play=False, download=False, stacked=False)
             Notify('big','Invalid Source','Unable to play selected source. \n Please try another.','', line3=str(e))
             break
 
+        #Start resolving the next part now, so it's ready when this one ends.
+        #Not while downloading, which can take longer than the link lives
+        if stacked and not last_part and not download_play and not download:
+            prefetch = PrefetchLink(next_url)
+            prefetch.start()
+
 
         #Download & Watch
         if download_play:
@@ -2979,9 +2653,18 @@ def Stream_Source(name, url, download_play=False, download=False, stacked=False)
         #Else play the file as normal stream
         else:               
             print 'Starting Normal Streaming'
-            completed = play_with_watched(link, listitem, mypath, last_part)
+            proxy = start_upstream_proxy(link)
+            if proxy:
+                completed = play_with_watched(proxy.url, listitem, mypath, last_part)
+                proxy.close()
+            else:
+                completed = play_with_watched(link, listitem, mypath, last_part)
             print 'Normal streaming completed: %s' % completed
 
+            #The link never started playing, don't hand it out again
+            if completed is None:
+                link_cache.invalidate(url)
+
         #Check if video was played until end - else assume user stopped watching video so break from loop
         if not completed:
             break                
@@ -2999,15 +2682,13 @@ def play_with_watched(url, listitem, mypath, last_part=False):
     mplayer = MyPlayer(last_part=last_part)
     mplayer.play(url, listitem)
 
+    #wait up to 20 seconds until the video is playing before getting totalTime
+    mplayer.wait_for_start(20)
     try:
         video_time = mplayer.getTotalTime()
-    except Exception:
-        xbmc.sleep(20000) #wait 20 seconds until the video is playing before getting totalTime
-        try:
-            video_time = mplayer.getTotalTime()
-        except Exception, e:
-            print 'Error grabbing video time: %s' % e
-            return False
+    except Exception, e:
+        print 'Error grabbing video time: %s' % e
+        return None
 
     #For stacked parts totalTime will need to be added up
     temp_total = totalTime
@@ -3015,22 +2696,15 @@ def play_with_watched(url, listitem, mypath, last_part=False):
     print '******** VIDEO TIME: %s' % video_time
     print '******** TOTAL TIME: %s' % totalTime
 
-    while(1):
-        try:
-            temp_current_time = mplayer.getTime()
-            currentTime= temp_current_time + temp_total
-        except Exception:
-            print 'XBMC is not currently playing a media file'
-            break
-        xbmc.sleep(1000)
+    position = mplayer.track(temp_total)
     
     print '******** CURRENT TIME: %s' % currentTime
 
     #Check if video was played until the end (-1 second)
-    if temp_current_time < (video_time - 1):
-        return False
-    else:
+    if mplayer.finished or position >= (video_time - 1):
         return True
+    else:
+        return False
 
 
 def get_watched_percent():
@@ -3071,46 +2745,65 @@ def Stream_Source_with_parts(name,url):
     mplayer.play(link, listitem)
 
     index = 2
+    totalTime = 0
+    finalPart = not source.has_key(str(index))
+
+    #resolve the next part in the background while this one plays
+    prefetch = None
+    if not finalPart:
+        prefetch = PrefetchLink(source[str(index)])
+        prefetch.start()
     
     # first part is playing... now wait to start 2nd part
     while not finalPart:
-        #Set the currentTime and totalTime to arbitrary numbers. This keeps it from pre-maturely starting the 3rd part immediately after the 2nd part starts
-        # using currentTime and totalTime from the first part.
-        currentTime = 0
-        totalTime = 20
+        #For stacked parts totalTime will need to be added up
+        if not mplayer.wait_for_start(20):
+            #The link never started playing, don't hand it out again
+            print 'Part %s never started playing' % str(index-1)
+            link_cache.invalidate(source[str(index-1)])
+            break
+        offset = totalTime
         try:
-            #Try to get the totalTime and currentTime from the player... If there is an exception and nothing is retrieved set it back to 20 to avoid moving
-            # on to the next part.
-            totalTime = mplayer.getTotalTime()
-            if totalTime == 0:
-                totalTime = 20
-            currentTime= mplayer.getTime()
+            totalTime = totalTime + mplayer.getTotalTime()
         except Exception:
             print 'XBMC is not currently playing a media file'
-        #start next part
-        #When the current part has less than 3 seconds remaining get ready to start next part.
-        if currentTime > totalTime-3:
-            xbmc.sleep(4000)
-            #Check the part list to see if there are parts remaining
-            if source[str(index)]:
-                link2=Handle_Vidlink(source[str(index)])
-                listitem=Item_Meta(name)
-                try:
-                    nextPart = source[str(index+1)]
-                except:
-                    print 'Attempting to stream the final part: %s' % str(link2)
-                    finalPart = True
-                    pass
-                mplayer = MyPlayer()
-                mplayer.play(link2, listitem)
-                index+=1
-        xbmc.sleep(500) 
+
+        #sleeps until the player reports the part is over
+        mplayer.track(offset)
+        if not mplayer.finished:
+            #a dead link ends playback early as well, resolve it again next time
+            print 'Playback stopped before the end of part %s' % str(index-1)
+            link_cache.invalidate(source[str(index-1)])
+            break
+
+        #start next part the moment the current one is over
+        link2=prefetch.get_link()
+        listitem=Item_Meta(name)
+        if source.has_key(str(index+1)):
+            prefetch = PrefetchLink(source[str(index+1)])
+            prefetch.start()
+        else:
+            print 'Attempting to stream the final part: %s' % str(link2)
+            prefetch = None
+            finalPart = True
+
+        mplayer = MyPlayer()
+        mplayer.play(link2, listitem)
+        index+=1
 
 
 class MyPlayer (xbmc.Player):
      def __init__ (self, last_part=False):
         self.dialog = None
         self.last_part = last_part
+        #set by the playback callbacks
+        self.started = False
+        self.ended = False
+        self.finished = False
+        #wakes track() as soon as playback is over
+        self.done = threading.Event()
+        self.offset = 0
+        self.position = 0
         xbmc.Player.__init__(self)
         
         print 'Initializing myPlayer...'
@@ -3123,10 +2816,54 @@ class MyPlayer (xbmc.Player):
      def isplaying(self):
         xbmc.Player.isPlaying(self)
 
+     def wait_for_start(self, timeout):
+        #give the player timeout seconds to report that playback started
+        waited = 0
+        while not self.started and not self.ended and waited < timeout * 1000:
+            xbmc.sleep(250)
+            waited += 250
+        return self.started
+
+     def sample(self):
+        #read the play position into currentTime, returns None once the player has no time
+        global currentTime
+        try:
+            position = self.getTime()
+        except Exception:
+            return None
+        self.position = position
+        currentTime = position + self.offset
+        return position
+
+     def track(self, offset=0):
+        #Sleep until playback ends and return the last position seen.
+        #The end is reported by the callbacks, the position is only sampled
+        #every minute or so, down to every second close to the end of the video
+        self.offset = offset
+        try:
+            video_time = self.getTotalTime()
+        except Exception:
+            video_time = 0
+
+        while not self.ended:
+            position = self.sample()
+            if position is None:
+                print 'XBMC is not currently playing a media file'
+                break
+            self.done.wait(min(max(int((video_time - position) / 10), 1), 60))
+        return self.position
+
+     def onPlayBackStarted(self):
+        self.started = True
+
      def onPlayBackEnded(self):
         global currentTime
         global totalTime
         global finalPart
+        self.sample()
+        self.ended = True
+        self.finished = True
+        self.done.set()
         if finalPart:
             percentWatched = currentTime / totalTime
             print 'current time: ' + str(currentTime) + ' total time: ' + str(totalTime) + ' percent watched: ' + str(percentWatched)
@@ -3141,6 +2878,10 @@ class MyPlayer (xbmc.Player):
         global currentTime
         global totalTime
         global finalPart
+        #the last sample can be a minute old, take the position while the player still has it
+        self.sample()
+        self.ended = True
+        self.done.set()
         if finalPart:
             percentWatched = currentTime / totalTime
             print 'current time: ' + str(currentTime) + ' total time: ' + str(totalTime) + ' percent watched: ' + str(percentWatched)
@@ -3155,12 +2896,25 @@ class MyPlayer (xbmc.Player):
 
 
 class DownloadThread (threading.Thread):
-    def __init__(self, url, dest, vidname=False, video_seek=False):
+    def __init__(self, url, dest, vidname=False, video_seek=False, progressive=False):
         self.url = url
         self.dest = dest
         self.vidname = vidname
         self.video_seek = video_seek
         self.dialog = None
+
+        #a progressive download is played through the stream proxy, which needs the download itself
+        if progressive:
+            self.download = downloader.Download(url, dest, connections=download_connections, chunk_size=streamproxy.CHUNK_SIZE)
+        else:
+            #the file is played while downloading: keep it growing from the start on one connection
+            self.download = downloader.Download(url, dest, connections=1, preallocate=False)
+
+        #state shared with the control channel, progress is pushed here by _dlhook
+        self.downloaded = 0
+        self.filesize = 0
+        self.show_requested = False
+        self.cancel_requested = False
         
         threading.Thread.__init__(self)
         
@@ -3173,17 +2927,22 @@ class DownloadThread (threading.Thread):
         
         save(self.dest + '.dling', 'dling')
 
-        #get settings
-        save(os.path.join(downloadPath,'Downloading'),self.dest+'\n'+self.vidname)
+        #other plugin invocations reach us through the control port
+        server = dlcontrol.Server(self.control)
+        save(os.path.join(downloadPath,'Downloading'),self.dest+'\n'+self.vidname+'\n'+str(server.port))
           
         delete_incomplete = selfAddon.getSetting('delete-incomplete-downloads')
+        download_index = get_download_index()
+        download_index.start(self.dest, self.vidname, self.url)
         
         start_time = time.time() 
         try: 
-            urllib.urlretrieve(self.url, self.dest, lambda nb, bs, fs: _dlhook(nb, bs, fs, self, start_time))
+            self.download.hook = lambda dl, fs: _dlhook(dl, fs, self, start_time)
+            self.download.run()
             if os.path.getsize(self.dest) < 10000:
                 print 'Got a very small file'
                 raise SmallFile('Small File')
+            download_index.complete(self.dest, self.download.expected)
             if self.dialog <> None:
                 self.dialog.close()
                 self.dialog = None
@@ -3192,6 +2951,7 @@ class DownloadThread (threading.Thread):
               os.remove(self.dest + '.dling')
             except:
               pass
+            server.close()
             os.remove(os.path.join(downloadPath,'Downloading'))
         
         except:
@@ -3200,6 +2960,7 @@ class DownloadThread (threading.Thread):
                 self.dialog = None
                 
             print 'Download interrupted'
+            server.close()
             os.remove(os.path.join(downloadPath,'Downloading'))
             
             #download is killed so remove .dling file
@@ -3216,6 +2977,8 @@ class DownloadThread (threading.Thread):
                         break
                     except:
                         pass
+                downloader.remove_journal(self.dest)
+                download_index.remove(self.dest)
             
             if sys.exc_info()[0] in (StopDownloading,) and not self.video_seek:
                 Notify('big','Download Canceled','Download has been canceled','')
@@ -3223,6 +2986,21 @@ class DownloadThread (threading.Thread):
                 raise 
 
 
+    def control(self, request):
+        #called from the control server thread, only flags are set here
+        command = request.get('command')
+        if command == 'status':
+            return {'ok': True, 'dest': self.dest, 'name': self.vidname,
+                    'downloaded': self.downloaded, 'size': self.filesize}
+        elif command == 'show':
+            self.show_requested = True
+        elif command == 'cancel':
+            self.cancel_requested = True
+        else:
+            return {'ok': False, 'error': 'Unknown command: %s' % command}
+        return {'ok': True}
+
+
     def show_dialog(self):
         self.dialog = xbmcgui.DialogProgress()
         self.dialog.create('Downloading', '', self.vidname)
@@ -3257,33 +3035,18 @@ def Download_And_Play(name,url, video_seek=False):
         Notify('Download Alert','You have not set the download folder.\n Please access the addon settings and set it.','','')
         return False
 
-    if os.path.exists(os.path.join(downloadPath, 'Ping')):
-        os.remove(os.path.join(downloadPath, 'Ping'))
-    if os.path.exists(os.path.join(downloadPath, 'Alive')):
-        os.remove(os.path.join(downloadPath, 'Alive'))
-
     if os.path.exists(os.path.join(downloadPath, 'Downloading')):
-      fhPing = open(os.path.join(downloadPath, 'Ping'), 'w')
-      fhPing.close()
-      xbmc.sleep(1000)
+      status = download_control('status')
       
-      if os.path.exists(os.path.join(downloadPath, 'Alive')):
-          fh = open(os.path.join(downloadPath, 'Alive'))          
-          filePathAlive = fh.readline().strip('\n')
-          fileNameAlive = fh.readline().strip('\n')
-          fh.close()
-          
-          try:
-              os.remove(os.path.join(downloadPath, 'Alive'))
-          except:
-              pass
+      if status:
+          filePathAlive = status['dest'].encode('utf-8')
+          fileNameAlive = status['name'].encode('utf-8')
           
           Notify('Download Alert','Currently downloading '+fileNameAlive,'','')
           addDownloadControls(fileNameAlive, filePathAlive)
           return False
 
       else:
-          os.remove(os.path.join(downloadPath, 'Ping'))
           delete_incomplete = selfAddon.getSetting('delete-incomplete-downloads')
           
           if delete_incomplete == 'true':
@@ -3300,13 +3063,16 @@ def Download_And_Play(name,url, video_seek=False):
                       os.remove(filePathDownloading + '.dling')
                   except:
                       pass
+                  downloader.remove_journal(filePathDownloading)
 
           if os.path.exists(os.path.join(downloadPath, 'Downloading')):
               os.remove(os.path.join(downloadPath, 'Downloading'))
 
 
     if os.path.isfile(mypath) is True:
-        if os.path.isfile(mypath + '.dling'):
+        if os.path.isfile(mypath + '.journal'):
+            print 'resuming incomplete download of %s' % mypath
+        elif os.path.isfile(mypath + '.dling'):
             try:
                 os.remove(mypath)
                 os.remove(mypath + '.dling')
@@ -3320,18 +3086,30 @@ def Download_And_Play(name,url, video_seek=False):
 
     try:
         print "Starting Download Thread"
-        dlThread = DownloadThread(url, mypath, vidname, video_seek)
+        progressive = selfAddon.getSetting('progressive-download') == 'true'
+        dlThread = DownloadThread(url, mypath, vidname, video_seek, progressive)
         dlThread.start()
-        buffer_delay = int(selfAddon.getSetting('buffer-delay'))
-        handle_wait(buffer_delay, "Buffering", "Waiting a bit before playing...")
-        if not handle_wait:
-            return False
+
+        proxy = None
+        if progressive:
+            proxy = start_stream_proxy(dlThread)
+            if proxy is False:
+                return False
+        if not proxy:
+            buffer_delay = int(selfAddon.getSetting('buffer-delay'))
+            handle_wait(buffer_delay, "Buffering", "Waiting a bit before playing...")
+            if not handle_wait:
+                return False
         if os.path.exists(mypath):
             if dlThread.isAlive():
                 listitem=Item_Meta(name)
                 
                 #Play file              
-                completed = play_with_watched(mypath, listitem, '')
+                if proxy:
+                    completed = play_with_watched(proxy.url, listitem, '')
+                    proxy.close()
+                else:
+                    completed = play_with_watched(mypath, listitem, '')
                
                 if video_seek:
                     if os.path.exists(mypath):
@@ -3364,17 +3142,75 @@ def Download_And_Play(name,url, video_seek=False):
         callEndOfDirectory = False
 
 
-def _dlhook(numblocks, blocksize, filesize, dt, start_time):
+def start_stream_proxy(dlThread):
+    #serve the download to the player once its first megabytes are on disk
+    #returns None if the host can't do it, False if the user cancelled
+    download = dlThread.download
+    while not download.ready.isSet():
+        if not dlThread.isAlive():
+            return None
+        download.ready.wait(1)
+    if not download.size:
+        print 'Host does not support range requests, playing the partial file'
+        return None
+
+    try:
+        start_buffer = int(selfAddon.getSetting('progressive-buffer')) * 1024 * 1024
+    except ValueError:
+        start_buffer = 4 * 1024 * 1024
+    start_buffer = max(1, min(start_buffer, download.size))
+
+    pDialog = xbmcgui.DialogProgress()
+    pDialog.create(' Buffering')
+    try:
+        while not download.wait_for(0, start_buffer - 1, 1):
+            if not dlThread.isAlive():
+                return None
+            if pDialog.iscanceled():
+                print 'buffering cancelled'
+                dlThread.cancel_requested = True
+                return False
+            pDialog.update(min(100, dlThread.downloaded * 100 / start_buffer), ' Downloading the start of the video...')
+    finally:
+        pDialog.close()
+
+    return streamproxy.Proxy(streamproxy.DownloadSource(download))
+
+
+def start_upstream_proxy(link):
+    #play a resolved link through the local read-ahead proxy if enabled, None to play it directly
+    if selfAddon.getSetting('stream-proxy') != 'true':
+        return None
+    try:
+        buffer_size = int(selfAddon.getSetting('stream-proxy-buffer')) * 1024 * 1024
+    except ValueError:
+        buffer_size = 16 * 1024 * 1024
+    try:
+        return streamproxy.Proxy(streamproxy.UpstreamSource(link, buffer_size))
+    except Exception, e:
+        print 'Stream proxy unavailable, playing the link directly: %s' % e
+        return None
+
+
+def _dlhook(downloaded, filesize, dt, start_time):
+
+    #called by the downloader about twice a second, the control channel reads this
+    dt.downloaded = downloaded
+    dt.filesize = filesize
+
+    if dt.cancel_requested:
+        print "Stopping download"
+        raise StopDownloading('Stopped Downloading')
 
     if dt.dialog != None:
         
         try: 
-            percent = min(numblocks * blocksize * 100 / filesize, 100)
-            currently_downloaded = float(numblocks) * blocksize / (1024 * 1024)
-            kbps_speed = numblocks * blocksize / (time.time() - start_time)
+            percent = min(downloaded * 100 / filesize, 100)
+            currently_downloaded = float(downloaded) / (1024 * 1024)
+            kbps_speed = downloaded / (time.time() - start_time)
             
             if kbps_speed > 0: 
-                eta = (filesize - numblocks * blocksize) / kbps_speed 
+                eta = (filesize - downloaded) / kbps_speed 
             else: 
                 eta = 0 
             
@@ -3392,39 +3228,9 @@ def _dlhook(numblocks, blocksize, filesize, dt, start_time):
         if dt.dialog.iscanceled():
             dt.hide_dialog()
             
-    elif os.path.exists(os.path.join(downloadPath, 'ShowDLInfo')):
-        while os.path.exists(os.path.join(downloadPath, 'ShowDLInfo')):
-            
-            try:
-                os.remove(os.path.join(downloadPath, 'ShowDLInfo'))
-            except:
-                continue
-            break
-        
+    elif dt.show_requested:
+        dt.show_requested = False
         dt.show_dialog()
-        
-    elif os.path.exists(os.path.join(downloadPath, 'Cancel')):
-        while os.path.exists(os.path.join(downloadPath, 'Cancel')):
-            
-            try:
-                os.remove(os.path.join(downloadPath, 'Cancel'))
-            except:
-                continue
-            break
-        
-        print "Stopping download"
-        raise StopDownloading('Stopped Downloading')
-        
-    elif os.path.exists(os.path.join(downloadPath, 'Ping')):
-        while os.path.exists(os.path.join(downloadPath, 'Ping')):
-            
-            try:
-                os.remove(os.path.join(downloadPath, 'Ping'))
-            except:
-                continue
-            break
-        
-        save(os.path.join(downloadPath,'Alive'),dt.dest+'\n'+dt.vidname)
 
 
 def Download_Source(name,url,stacked=False):
@@ -3437,23 +3243,33 @@ def Download_Source(name,url,stacked=False):
         Notify('Download Alert','You have not set the download folder.\n Please access the addon settings and set it.','','')
         return False
     else:
-        if os.path.isfile(mypath) is True:
+        download_index = get_download_index()
+        entry = download_index.get(mypath)
+        if entry is not None:
+            #both ends of the file are hashed again, a file changed since it was downloaded counts as truncated
+            complete = download_index.status(entry, deep=True) == dlindex.COMPLETE
+        else:
+            complete = os.path.isfile(mypath) is True and not os.path.isfile(mypath + '.journal')
+
+        if complete:
             Notify('Download Alert','The video you are trying to download already exists!','','')
             return False
-        else:              
+        elif os.path.isfile(mypath) is True:
+            #resumed from its journal if it has one, downloaded from the start otherwise
+            print 'Downloading again incomplete file %s' % mypath
                        
-            DownloadInBack=selfAddon.getSetting('download-in-background')
-            print 'attempting to download file, silent = '+ DownloadInBack
-            try:
-                if DownloadInBack == 'true':
-                    completed = QuietDownload(url, mypath, vidname)
-                    return completed
-                else:
-                    completed = Download(url, mypath, vidname)
-                    return completed
-            except:
-                print 'download failed'
-                return False
+        DownloadInBack=selfAddon.getSetting('download-in-background')
+        print 'attempting to download file, silent = '+ DownloadInBack
+        try:
+            if DownloadInBack == 'true':
+                completed = QuietDownload(url, mypath, vidname)
+                return completed
+            else:
+                completed = Download(url, mypath, vidname)
+                return completed
+        except:
+            print 'download failed'
+            return False
 
 
 def Check_Mega_Limits(name,url):
@@ -3481,9 +3297,13 @@ def Download(url, dest, displayname=False):
         delete_incomplete = selfAddon.getSetting('delete-incomplete-downloads')
         dp = xbmcgui.DialogProgress()
         dp.create('Downloading', '', displayname)
+        download_index = get_download_index()
+        download_index.start(dest, displayname, url)
         start_time = time.time() 
         try: 
-            urllib.urlretrieve(url, dest, lambda nb, bs, fs: _pbhook(nb, bs, fs, dp, start_time)) 
+            download = downloader.Download(url, dest, lambda dl, fs: _pbhook(dl, fs, dp, start_time), connections=download_connections)
+            download.run()
+            download_index.complete(dest, download.expected)
         except:
             if delete_incomplete == 'true':
                 #delete partially downloaded file if setting says to.
@@ -3493,6 +3313,8 @@ def Download(url, dest, displayname=False):
                         break 
                     except: 
                         pass 
+                downloader.remove_journal(dest)
+                download_index.remove(dest)
             #only handle StopDownloading (from cancel), ContentTooShort (from urlretrieve), and OS (from the race condition); let other exceptions bubble 
             if sys.exc_info()[0] in (urllib.ContentTooShortError, StopDownloading, OSError): 
                 return False 
@@ -3528,41 +3350,32 @@ def QuietDownload(url, dest):
         return 'downloaded' 
 '''
 def QuietDownload(url, dest, videoname):
-    #quote parameters passed to download script     
-    q_url = urllib.quote_plus(url)
-    q_dest = urllib.quote_plus(dest)
-    q_vidname = urllib.quote_plus(videoname)
-    
-    #Create possible values for notification
-    notifyValues = [2, 5, 10, 20, 25, 50, 100]
-
-    # get notify value from settings
-    NotifyPercent=int(selfAddon.getSetting('notify-percent'))
-    
+    #hand the download to the background download manager
     try:
-        script = os.path.join( icepath, 'resources', 'lib', "DownloadInBackground.py" )
-        xbmc.executebuiltin( "RunScript(%s, %s, %s, %s, %s)" % ( script, q_url, q_dest, q_vidname, str(notifyValues[NotifyPercent]) ) )
+        job_id = get_download_queue().add(url, dest, videoname)
+        print 'Queued download %s: %s' % (job_id, dest)
+        Notify('small','Download Queued', videoname,'')
+        wake_download_manager()
         return True
     except Exception, e:
         print '*** Error in Quiet Download: %s' % e
         return False
              
 
-def _pbhook(numblocks, blocksize, filesize, dp, start_time):
+def _pbhook(downloaded, filesize, dp, start_time):
         try: 
-            percent = min(numblocks * blocksize * 100 / filesize, 100) 
-            currently_downloaded = float(numblocks) * blocksize / (1024 * 1024) 
-            kbps_speed = numblocks * blocksize / (time.time() - start_time) 
+            percent = min(downloaded * 100 / filesize, 100) 
+            currently_downloaded = float(downloaded) / (1024 * 1024) 
+            kbps_speed = downloaded / (time.time() - start_time) 
             if kbps_speed > 0: 
-                eta = (filesize - numblocks * blocksize) / kbps_speed 
+                eta = (filesize - downloaded) / kbps_speed 
             else: 
                 eta = 0 
             kbps_speed = kbps_speed / 1024 
             total = float(filesize) / (1024 * 1024) 
             # print ( 
                 # percent, 
-                # numblocks, 
-                # blocksize, 
+                # downloaded, 
                 # filesize, 
                 # currently_downloaded, 
                 # kbps_speed, 
@@ -3871,8 +3684,60 @@ def cleanUnicode(string):
         return string
 
 
-def ADD_ITEM(metaget, meta_installed, imdb_id,url,name,mode,num_of_eps=False, totalitems=0):
+def META_LOOKUP(imdb_id, name, mode):
+            if mode==100:
+                return metabatch.lookup_for('movie', imdb_id, name)
+            return metabatch.lookup_for('tvshow', imdb_id, name)
+
+
+def PREFETCH_META(metaget, meta_installed, items, mode):
+            #returns the metadata of a page's (imdb_id, url, name) items keyed on (imdb_id, name),
+            #titles missing from the cache are fetched side by side instead of one row at a time
+            if not meta_installed:
+                return {}
+            lookups = [META_LOOKUP(imdb_id, name, mode) for imdb_id, url, name in items]
+
+            #lazy meta: show the page straight away, titles missing from the cache are
+            #added without meta (False) and filled in by a background script.
+            #Titles without an imdb id are never found by id, they're looked up by name as usual
+            if selfAddon.getSetting('lazy-meta') == 'true':
+                missing = metabatch.misses(getattr(metaget, 'videocache', None), lookups)
+                missing = [lookup for lookup in missing if metabatch.imdb_key(lookup[2])]
+                if missing:
+                    BACKFILL_META(missing)
+                missing = set(missing)
+                found = {}
+                for i in range(len(items)):
+                    if lookups[i] in missing:
+                        found[(items[i][0], items[i][2])] = False
+                    else:
+                        found[(items[i][0], items[i][2])] = metabatch.get_meta(metaget, lookups[i])
+                return found
+
+            new_metaget = lambda: metahandlers.MetaData(preparezip=prepare_zip)
+            metas = metabatch.lookup(metaget, lookups, new_metaget)
+            found = {}
+            for i in range(len(items)):
+                found[(items[i][0], items[i][2])] = metas[i]
+            return found
+
+
+def BACKFILL_META(lookups):
+            #hand the lookups to MetaBackfill.py, which refreshes this listing once they are cached
+            job_file = os.path.join(datapath, 'meta_backfill_%d.json' % int(time.time() * 1000))
+            fh = open(job_file, 'w')
+            try:
+                json.dump({'folder': sys.argv[0] + sys.argv[2], 'lookups': lookups}, fh)
+            finally:
+                fh.close()
+            print 'Backfilling meta of %d titles in the background' % len(lookups)
+            script = os.path.join(icepath, 'resources', 'lib', 'MetaBackfill.py')
+            xbmc.executebuiltin('RunScript(%s, %s)' % (script, job_file))
+
+
+def ADD_ITEM(metaget, meta_installed, imdb_id,url,name,mode,num_of_eps=False, totalitems=0, meta=None):
             #clean name of unwanted stuff
+            meta_lookup = META_LOOKUP(imdb_id, name, mode)
             name=CLEANUP(name)
             if url.startswith('http://www.icefilms.info') == False:
                 url=iceurl+url
@@ -3881,22 +3746,10 @@ def ADD_ITEM(metaget, meta_installed, imdb_id,url,name,mode,num_of_eps=False, to
             if num_of_eps is not False:
                 name = name + ' ' + str(num_of_eps)
                 
-            if meta_installed and meta_setting=='true':
-                #return the metadata dictionary
-                #we want a clean name with the year separated for proper meta search and storing
-                meta_name = CLEANUP_FOR_META(name)           
-                r=re.search('(.+?) [(]([0-9]{4})[)]',meta_name)
-                if r:
-                    meta_name = r.group(1)
-                    year = r.group(2)
-                else:
-                    year = ''
-                if mode==100:
-                    #return the metadata dictionary
-                    meta=metaget.get_meta('movie', meta_name, imdb_id=imdb_id, year=year)
-                elif mode==12:
-                    #return the metadata dictionary
-                    meta=metaget.get_meta('tvshow', meta_name, imdb_id=imdb_id)
+            if meta_installed and meta_setting=='true' and meta is not False:
+                #return the metadata dictionary, unless the listing already looked it up
+                if meta is None:
+                    meta = metabatch.get_meta(metaget, meta_lookup)
                 
                 addDir(name,url,mode,'',meta=meta,imdb='tt'+str(imdb_id),totalItems=totalitems, meta_install=meta_installed)  
            
@@ -3916,7 +3769,7 @@ def REFRESH(videoType, url,imdb_id,name,dirmode):
         imdb_id = imdb_id.replace('tttt','')
 
         if meta_setting=='true':
-            metaget=metahandlers.MetaData(preparezip=prepare_zip)
+            metaget=meta_context
             meta_installed = metaget.check_meta_installed(addon_id)          
             
             if meta_installed:
@@ -3938,7 +3791,7 @@ def episode_refresh(url, imdb_id, name, dirmode, season, episode):
         imdb_id = imdb_id.replace('tttt','')
 
         if meta_setting=='true':
-            metaget=metahandlers.MetaData(preparezip=prepare_zip)
+            metaget=meta_context
             meta_installed = metaget.check_meta_installed(addon_id)          
             
             if meta_installed:
@@ -3954,7 +3807,7 @@ def season_refresh(url, imdb_id, name, dirmode, season):
         imdb_id = imdb_id.replace('tttt','')
 
         if meta_setting=='true':
-            metaget=metahandlers.MetaData(preparezip=prepare_zip)
+            metaget=meta_context
             meta_installed = metaget.check_meta_installed(addon_id)          
             
             if meta_installed:
@@ -3963,7 +3816,16 @@ def season_refresh(url, imdb_id, name, dirmode, season):
                 xbmc.executebuiltin("XBMC.Container.Refresh")
 
 
-def get_episode(season, episode, imdb_id, url, metaget, meta_installed, tmp_season_num=-1, tmp_episode_num=-1, totalitems=0):
+def EPISODE_SHOWNAME():
+        #Get tvshow name - don't want the year portion
+        showname=cache.get('mediatvshowname')
+        r=re.search('(.+?) [(][0-9]{4}[)]',showname)
+        if r:
+            showname = r.group(1)
+        return showname
+
+
+def get_episode(season, episode, imdb_id, url, metaget, meta_installed, tmp_season_num=-1, tmp_episode_num=-1, totalitems=0, showname=None):
         # displays all episodes in the source it is passed.
         imdb_id = imdb_id.replace('t','')
    
@@ -3973,11 +3835,8 @@ def get_episode(season, episode, imdb_id, url, metaget, meta_installed, tmp_seas
             #clean name of unwanted stuff
             episode=CLEANUP(episode)
              
-            #Get tvshow name - don't want the year portion
-            showname=cache.get('mediatvshowname')
-            r=re.search('(.+?) [(][0-9]{4}[)]',showname)
-            if r:
-                showname = r.group(1)
+            if showname is None:
+                showname = EPISODE_SHOWNAME()
                            
             #return the metadata dictionary
             ep = re.search('[0-9]+x([0-9]+)', episode)
@@ -4010,7 +3869,7 @@ def get_episode(season, episode, imdb_id, url, metaget, meta_installed, tmp_seas
 def find_meta_for_search_results(results, mode, search=''):
     
     #initialise meta class before loop
-    metaget=metahandlers.MetaData(preparezip=prepare_zip)
+    metaget=meta_context
     meta_installed = metaget.check_meta_installed(addon_id)
     
     if mode == 100:        
@@ -4117,7 +3976,7 @@ def SearchForTrailer(search, imdb_id, type, manual=False):
             % str(trailer_url)[str(trailer_url).rfind("v=")+2:] )
         
         #dialog.ok(' title ', ' message ')
-        metaget=metahandlers.MetaData(preparezip=prepare_zip)
+        metaget=meta_context
         if type==100:
             type='movie'
         elif type==12:
@@ -4129,7 +3988,7 @@ def SearchForTrailer(search, imdb_id, type, manual=False):
 
 
 def ChangeWatched(imdb_id, videoType, name, season, episode, year='', watched='', refresh=False):
-    metaget=metahandlers.MetaData(preparezip=prepare_zip)
+    metaget=meta_context
     metaget.change_watched(videoType, name, imdb_id, season=season, episode=episode, year=year, watched=watched)
     if refresh:
         xbmc.executebuiltin("XBMC.Container.Refresh")
@@ -4173,20 +4032,171 @@ def addDownloadControls(name,localFilePath, listitem=None):
     return ok
 
 
+def download_control(command):
+    #send a command to the running download-and-play, None if there is none
+    control_file = os.path.join(downloadPath, 'Downloading')
+    if not os.path.exists(control_file):
+        return None
+    fh = open(control_file)
+    lines = fh.read().split('\n')
+    fh.close()
+    if len(lines) < 3:
+        return None
+    return dlcontrol.send(lines[2].strip(), command)
+
+
+def get_download_queue():
+    return dlqueue.Queue(os.path.join(datapath, 'downloads.db'))
+
+
+def get_download_index():
+    return dlindex.DownloadIndex(os.path.join(datapath, 'download_index.db'))
+
+
+def wake_download_manager():
+    #poke the running manager, or start one if none answers
+    port_file = os.path.join(datapath, 'download_manager')
+    if os.path.exists(port_file):
+        fh = open(port_file)
+        port = fh.read().strip()
+        fh.close()
+        if dlcontrol.send(port, 'wake') is not None:
+            return
+    script = os.path.join( icepath, 'resources', 'lib', 'DownloadManager.py' )
+    xbmc.executebuiltin( "RunScript(%s)" % script )
+
+
+def download_manager(command, args=None):
+    #send a command to the download manager, None if it isn't running
+    port_file = os.path.join(datapath, 'download_manager')
+    if not os.path.exists(port_file):
+        return None
+    fh = open(port_file)
+    port = fh.read().strip()
+    fh.close()
+    return dlcontrol.send(port, command, args)
+
+
+def stop_queued_download(job_id, state):
+    #ask the manager to stop a running job, True if it did
+    reply = download_manager('stop', {'id': job_id, 'state': state})
+    return reply is not None and reply['ok']
+
+
+def DownloadQueue():
+    states = {dlqueue.QUEUED: 'Queued', dlqueue.RUNNING: 'Downloading', dlqueue.PAUSED: 'Paused',
+              dlqueue.DONE: 'Done', dlqueue.FAILED: 'Failed', dlqueue.CANCELLED: 'Cancelled'}
+
+    status = download_manager('status')
+    if status is not None:
+        if status['rate']:
+            label = 'Speed Limit: %s KB/s' % status['rate']
+        else:
+            label = 'Speed Limit: None'
+        if status['override']:
+            label += ' (manual)'
+        liz=xbmcgui.ListItem(label)
+        xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]),url=sys.argv[0] + '?mode=215',listitem=liz,isFolder=False)
+
+    for job in get_download_queue().jobs():
+        label = '%s [%s' % (job['name'], states.get(job['state'], job['state']))
+        if job['size'] > 0 and job['state'] != dlqueue.DONE:
+            label += ' %d%%' % (job['downloaded'] * 100 / job['size'])
+        label += ']'
+
+        job_id = str(job['id'])
+        contextMenuItems = []
+        if job['state'] in (dlqueue.QUEUED, dlqueue.RUNNING):
+            contextMenuItems.append(('Pause Download', 'XBMC.RunPlugin(%s?mode=210&url=%s)' % (sys.argv[0], job_id)))
+        elif job['state'] in (dlqueue.PAUSED, dlqueue.FAILED):
+            contextMenuItems.append(('Resume Download', 'XBMC.RunPlugin(%s?mode=211&url=%s)' % (sys.argv[0], job_id)))
+        contextMenuItems.append(('Move Up', 'XBMC.RunPlugin(%s?mode=212&url=%s)' % (sys.argv[0], job_id)))
+        contextMenuItems.append(('Move Down', 'XBMC.RunPlugin(%s?mode=213&url=%s)' % (sys.argv[0], job_id)))
+        if job['state'] in (dlqueue.DONE, dlqueue.CANCELLED):
+            contextMenuItems.append(('Remove From Queue', 'XBMC.RunPlugin(%s?mode=214&url=%s)' % (sys.argv[0], job_id)))
+        else:
+            contextMenuItems.append(('Cancel Download', 'XBMC.RunPlugin(%s?mode=214&url=%s)' % (sys.argv[0], job_id)))
+
+        liz=xbmcgui.ListItem(label)
+        liz.setInfo( type="Video", infoLabels={ "Title": label } )
+        liz.addContextMenuItems(contextMenuItems, replaceItems=True)
+        xbmcplugin.addDirectoryItem(handle=int(sys.argv[1]),url=job['dest'],listitem=liz,isFolder=False)
+
+
+def PauseQueuedDownload(job_id):
+    queue = get_download_queue()
+    job = queue.get(job_id)
+    if job is None:
+        return
+    if job['state'] == dlqueue.RUNNING and stop_queued_download(job_id, dlqueue.PAUSED):
+        #the manager updates the queue once the job has stopped
+        xbmc.sleep(1000)
+    elif job['state'] in (dlqueue.QUEUED, dlqueue.RUNNING):
+        queue.set_state(job_id, dlqueue.PAUSED)
+    xbmc.executebuiltin("XBMC.Container.Refresh")
+
+
+def ResumeQueuedDownload(job_id):
+    queue = get_download_queue()
+    job = queue.get(job_id)
+    if job is not None and job['state'] in (dlqueue.PAUSED, dlqueue.FAILED):
+        queue.set_state(job_id, dlqueue.QUEUED)
+        wake_download_manager()
+    xbmc.executebuiltin("XBMC.Container.Refresh")
+
+
+def MoveQueuedDownload(job_id, offset):
+    get_download_queue().move(job_id, offset)
+    xbmc.executebuiltin("XBMC.Container.Refresh")
+
+
+def CancelQueuedDownload(job_id):
+    queue = get_download_queue()
+    job = queue.get(job_id)
+    if job is None:
+        return
+    if job['state'] == dlqueue.RUNNING and stop_queued_download(job_id, dlqueue.CANCELLED):
+        xbmc.sleep(1000)
+    else:
+        if job['state'] not in (dlqueue.DONE, dlqueue.CANCELLED):
+            #drop what was downloaded so far, a done file is left alone
+            try:
+                os.remove(job['dest'])
+            except OSError:
+                pass
+            downloader.remove_journal(job['dest'])
+        queue.remove(job_id)
+    xbmc.executebuiltin("XBMC.Container.Refresh")
+
+
+def SetDownloadSpeed():
+    choice = xbmcgui.Dialog().select('Download Speed Limit', ['Follow settings and schedule', 'No limit', 'Set limit...'])
+    if choice == 0:
+        rate = -1
+    elif choice == 1:
+        rate = 0
+    elif choice == 2:
+        rate = xbmcgui.Dialog().numeric(0, 'Speed limit in KB/s')
+        if not rate:
+            return
+        rate = int(rate)
+    else:
+        return
+    if download_manager('limit', {'rate': rate}) is None:
+        Notify('big','Download Manager','No background downloads are running','')
+    xbmc.executebuiltin("XBMC.Container.Refresh")
+
+
 def ShowDownloadInfo(name):
-    if not os.path.exists(os.path.join(downloadPath, 'Downloading')):
+    if download_control('show') is None:
         Notify('big','Download Inactive!','Download is not active','')
-    else:
-        save(os.path.join(downloadPath, 'ShowDLInfo'),'ShowDLInfo')
     return True
  
 
 def CancelDownload(name, video_seek=False):
-    if not os.path.exists(os.path.join(downloadPath, 'Downloading')):
+    if download_control('cancel') is None:
         if not video_seek:
             Notify('big','Download Inactive!','Download is not active','')
-    else:
-        save(os.path.join(downloadPath, 'Cancel'),'Cancel')    
     return True
 
 
@@ -4492,6 +4502,33 @@ elif mode==207:
 elif mode==208:
         CancelDownload(name)        
 
+elif mode==209:
+        DownloadQueue()
+
+elif mode==210:
+        PauseQueuedDownload(int(url))
+        callEndOfDirectory = False
+
+elif mode==211:
+        ResumeQueuedDownload(int(url))
+        callEndOfDirectory = False
+
+elif mode==212:
+        MoveQueuedDownload(int(url), -1)
+        callEndOfDirectory = False
+
+elif mode==213:
+        MoveQueuedDownload(int(url), 1)
+        callEndOfDirectory = False
+
+elif mode==214:
+        CancelQueuedDownload(int(url))
+        callEndOfDirectory = False
+
+elif mode==215:
+        SetDownloadSpeed()
+        callEndOfDirectory = False
+
 elif mode==555:
         print "Mode 555 (Get More...) ******* search string is " + search + " *************  nextPage is " + nextPage
         DoSearch(url, search, int(nextPage))
@@ -0,0 +1,289 @@
+'''
+Background download manager.
+
+Runs the jobs of the download queue (dlqueue) a few at a time, with a limit
+per host. It is started by the addon service at login, to pick up what was
+left when xbmc closed, and by the plugin whenever a download is queued. Only
+one manager runs: it listens on a localhost port (saved in the profile) and
+a second one started while it is alive just wakes it up and exits.
+
+Plugin modes change the queue and send one of these (see dlcontrol):
+
+    {"command": "wake"}                    re-read the queue
+    {"command": "stop", "id": 3, "state": "paused"}
+                                           stop a running job, leaving it in that state
+    {"command": "limit", "rate": 300}      cap all downloads to 300 KB/s (0 for no cap),
+                                           a rate of -1 goes back to the settings
+    {"command": "status"}                  current speed limit and running jobs
+
+All jobs share one rate limiter. Unless set from the plugin, its rate comes
+from the settings: one limit while xbmc plays something, another when idle,
+and no limit at all inside the optional full speed schedule window.
+
+The manager exits once the queue has nothing left to run.
+'''
+import os, time, threading
+import xbmc, xbmcaddon
+from traceback import print_exc
+import downloader, dlcontrol, dlqueue, dlindex
+
+selfAddon = xbmcaddon.Addon(id='plugin.video.icefilms')
+addon_path = selfAddon.getAddonInfo('path')
+datapath = xbmc.translatePath(selfAddon.getAddonInfo('profile'))
+art = os.path.join(addon_path, 'resources', 'art')
+
+QUEUE_FILE = os.path.join(datapath, 'downloads.db')
+INDEX_FILE = os.path.join(datapath, 'download_index.db')
+PORT_FILE = os.path.join(datapath, 'download_manager')
+
+#Seconds between progress updates of the queue database
+SAVE_INTERVAL = 5
+
+#Create possible values for notification, same as the notify-percent setting
+notifyValues = [2, 5, 10, 20, 25, 50, 100]
+
+
+def int_setting(name, default):
+    try:
+        return int(selfAddon.getSetting(name))
+    except ValueError:
+        return default
+
+
+def Notification(title, message):
+    icon_file = os.path.join(art, 'smalltransparent2.png')
+    xbmc.executebuiltin("XBMC.Notification(%s,%s,%i,%s)" % (title, message, 5000, icon_file))
+
+
+class StopJob(Exception):
+    pass
+
+
+def in_schedule(now, start, end):
+    '''
+    True if the time of day now is inside the "HH:MM" window start-end,
+    which may run over midnight
+    '''
+    try:
+        start = int(start[:2]) * 60 + int(start[3:5])
+        end = int(end[:2]) * 60 + int(end[3:5])
+    except ValueError:
+        return False
+    minute = now.tm_hour * 60 + now.tm_min
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+
+def scheduled_rate():
+    #speed limit in bytes per second the settings ask for right now
+    if selfAddon.getSetting('download-schedule') == 'true':
+        if in_schedule(time.localtime(), selfAddon.getSetting('download-schedule-start'), selfAddon.getSetting('download-schedule-end')):
+            return 0
+    if xbmc.Player().isPlaying():
+        return int_setting('download-limit-playing', 0) * 1024
+    return int_setting('download-limit-idle', 0) * 1024
+
+
+class Job(threading.Thread):
+
+    def __init__(self, queue, job, connections, notify_percent, limiter):
+        self.queue = queue
+        self.job = job
+        self.connections = connections
+        self.limiter = limiter
+        self.notify_percents = range(0, 100 + notify_percent, notify_percent)
+        #state to leave the job in when asked to stop
+        self.stop_state = None
+        self.last_save = 0
+
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+
+
+    def run(self):
+        job = self.job
+        print 'Download Manager - Starting %s: %s' % (job['name'], job['url'])
+        index = dlindex.DownloadIndex(INDEX_FILE)
+        index.start(job['dest'], job['name'], job['url'])
+        try:
+            download = downloader.Download(job['url'], job['dest'], self.progress, connections=self.connections, limiter=self.limiter)
+            download.run()
+            index.complete(job['dest'], download.expected)
+            self.queue.set_state(job['id'], dlqueue.DONE)
+            Notification('Download Complete', job['name'])
+        except StopJob:
+            print 'Download Manager - %s %s' % (self.stop_state, job['name'])
+            self.queue.set_state(job['id'], self.stop_state)
+            if self.stop_state == dlqueue.CANCELLED:
+                self.delete_file()
+        except Exception, e:
+            print_exc()
+            self.queue.set_state(job['id'], dlqueue.FAILED, str(e))
+            if selfAddon.getSetting('delete-incomplete-downloads') == 'true':
+                self.delete_file()
+            Notification('Download Failed', job['name'])
+
+
+    def progress(self, downloaded, filesize):
+        if self.stop_state is not None:
+            raise StopJob()
+
+        if time.time() - self.last_save >= SAVE_INTERVAL:
+            self.last_save = time.time()
+            self.queue.set_progress(self.job['id'], downloaded, filesize)
+
+        if filesize > 0:
+            percent = min(downloaded * 100 / filesize, 100)
+            passed = [p for p in self.notify_percents if p <= percent]
+            if passed:
+                for p in passed:
+                    self.notify_percents.remove(p)
+                Notification('Download Progress - %s%%' % passed[-1], self.job['name'])
+
+
+    def delete_file(self):
+        try:
+            os.remove(self.job['dest'])
+        except OSError:
+            pass
+        downloader.remove_journal(self.job['dest'])
+        dlindex.DownloadIndex(INDEX_FILE).remove(self.job['dest'])
+
+
+class Manager:
+
+    def __init__(self):
+        self.queue = dlqueue.Queue(QUEUE_FILE)
+        self.running = {}
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.limiter = downloader.RateLimiter()
+        #rate set from the plugin, None follows the settings
+        self.rate_override = None
+
+
+    def control(self, request):
+        command = request.get('command')
+        if command == 'wake':
+            self.wake.set()
+        elif command == 'stop':
+            self.lock.acquire()
+            try:
+                job = self.running.get(request.get('id'))
+            finally:
+                self.lock.release()
+            if job is None:
+                return {'ok': False, 'error': 'Job is not running'}
+            job.stop_state = request.get('state', dlqueue.PAUSED)
+        elif command == 'limit':
+            rate = int(request.get('rate', -1))
+            if rate < 0:
+                self.rate_override = None
+            else:
+                self.rate_override = rate * 1024
+            self.wake.set()
+        elif command == 'status':
+            return {'ok': True, 'rate': self.limiter.rate / 1024, 'override': self.rate_override is not None,
+                    'running': self.running.keys()}
+        else:
+            return {'ok': False, 'error': 'Unknown command: %s' % command}
+        return {'ok': True}
+
+
+    def run(self):
+        server = dlcontrol.Server(self.control)
+        save_port(server.port)
+        try:
+            self.queue.recover()
+            while not xbmc.abortRequested:
+                self.reap()
+                self.update_rate()
+                self.start_jobs()
+                if not self.running and not self.queue.pending():
+                    print 'Download Manager - Queue is empty, exiting'
+                    break
+                self.wake.wait(1)
+                self.wake.clear()
+
+            if xbmc.abortRequested:
+                #put the running jobs back in the queue, their journals let them resume next time
+                for job in self.running.values():
+                    job.stop_state = dlqueue.QUEUED
+                for job in self.running.values():
+                    job.join()
+        finally:
+            server.close()
+            remove_port()
+
+
+    def reap(self):
+        self.lock.acquire()
+        try:
+            for job_id, job in self.running.items():
+                if not job.isAlive():
+                    del self.running[job_id]
+        finally:
+            self.lock.release()
+
+
+    def update_rate(self):
+        if self.rate_override is not None:
+            rate = self.rate_override
+        else:
+            rate = scheduled_rate()
+        if rate != self.limiter.rate:
+            print 'Download Manager - Speed limit now %s KB/s' % (rate / 1024)
+            self.limiter.set_rate(rate)
+
+
+    def start_jobs(self):
+        max_jobs = int_setting('download-jobs', 2)
+        max_per_host = int_setting('download-jobs-per-host', 1)
+        connections = int_setting('download-connections', 4)
+        notify_percent = notifyValues[int_setting('notify-percent', 2)]
+
+        hosts = [job.job['host'] for job in self.running.values()]
+        for found in self.queue.next_jobs(hosts, max_jobs, max_per_host):
+            self.queue.set_state(found['id'], dlqueue.RUNNING)
+            job = Job(self.queue, found, connections, notify_percent, self.limiter)
+            self.lock.acquire()
+            try:
+                self.running[found['id']] = job
+            finally:
+                self.lock.release()
+            job.start()
+
+
+def load_port():
+    try:
+        fh = open(PORT_FILE, 'r')
+        try:
+            return fh.read().strip()
+        finally:
+            fh.close()
+    except IOError:
+        return None
+
+
+def save_port(port):
+    fh = open(PORT_FILE, 'w')
+    fh.write(str(port))
+    fh.close()
+
+
+def remove_port():
+    try:
+        os.remove(PORT_FILE)
+    except OSError:
+        pass
+
+
+if not os.path.exists(datapath):
+    os.makedirs(datapath)
+
+port = load_port()
+if port and dlcontrol.send(port, 'wake') is not None:
+    print 'Download Manager - Already running on port %s' % port
+else:
+    Manager().run()
@@ -0,0 +1,53 @@
+'''
+Background meta backfill for listings shown without waiting for metadata.
+
+With the lazy-meta setting on, a listing adds the titles missing from the
+meta cache without their meta and hands their lookups to this script:
+
+    RunScript(.../MetaBackfill.py, <profile>/meta_backfill_<time>.json)
+
+The job file holds the plugin url of the listing and its (type, name,
+imdb_id, year) lookups. They are fetched the same way a listing fetches
+them (metabatch), after which the listing is refreshed once so it shows
+the new meta, if it is still the one on screen.
+'''
+import os, sys
+import xbmc
+from metahandler import metahandlers
+import metabatch
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+def load_job(path):
+    fh = open(path, 'r')
+    try:
+        job = json.load(fh)
+    finally:
+        fh.close()
+    os.remove(path)
+    #json hands back unicode, metahandler and xbmc get plain strings
+    lookups = []
+    for lookup in job['lookups']:
+        lookups.append(tuple([value.encode('utf-8') for value in lookup]))
+    return job['folder'].encode('utf-8'), lookups
+
+
+def run(path):
+    folder, lookups = load_job(path)
+    metaget = metahandlers.MetaData()
+    fetched = metabatch.prefetch(getattr(metaget, 'videocache', None), lookups, metahandlers.MetaData)
+    print 'Meta Backfill - Cached %d of %d titles for %s' % (fetched, len(lookups), folder)
+
+    #only when something new is cached, a listing whose lookups keep failing would refresh forever
+    if fetched and xbmc.getInfoLabel('Container.FolderPath') == folder:
+        xbmc.executebuiltin('Container.Refresh')
+
+
+try:
+    run(sys.argv[1])
+except Exception, e:
+    print 'Meta Backfill - Failed: %s' % e
@@ -0,0 +1,251 @@
+'''
+Background installer for the metadata image packs.
+
+The image packs are large zips (the movie backdrops alone are over 700 MB).
+Instead of downloading them one after the other behind modal dialogs, the
+packs the user picked are handed to an Installer thread which downloads
+them side by side with the resumable downloader, checks each zip as soon
+as it is complete and installs it right away. Installs are done one at a
+time, they all write to the same meta database.
+
+    packs = [containerinstall.Pack(url, path, 'movie_images', 'Movie Covers', on_installed)]
+    installer = containerinstall.Installer(packs, install, notify, status_file)
+    installer.start()
+
+install(path, installtype) does the actual extraction and returns True on
+success, notify(title, message) tells the user about each pack. While it
+runs the installer answers {"command": "status"} on the port saved in
+status_file (see dlcontrol), so the home screen doesn't offer the packs
+again, use running(status_file) to ask.
+
+An interrupted download resumes from its journal the next time the pack
+is installed, a zip that fails the check is deleted to be fetched again.
+
+A pack given the folder it unpacks to (extract_to) skips all that: it is
+unpacked by zipstream while it downloads and never stored, which halves
+the disk space needed and saves reading the archive a second time. After
+each entry its end offset is saved next to where the zip would have been
+(<path>.offset), a broken connection or a later run picks up from there
+with a Range request.
+'''
+
+import os, time, threading, zipfile
+import httpclient, downloader, dlcontrol, zipstream
+
+#Attempts to pick up a streamed pack after the connection broke
+RETRIES = 3
+
+#Seconds between saves of the offset a streamed pack resumes from
+OFFSET_INTERVAL = 5
+
+#Connections per pack, all packs come from the same host
+CONNECTIONS = 2
+
+
+class Pack:
+
+    def __init__(self, url, path, installtype, title, installed=None, extract_to=None):
+        self.url = url
+        self.path = path
+        self.installtype = installtype
+        self.title = title
+        #called once the pack is installed, eg. to flag it in the meta db
+        self.installed = installed
+        #folder to unpack to while downloading, None to download the zip and install() it
+        self.extract_to = extract_to
+        self.downloaded = 0
+        self.size = 0
+        self.state = 'queued'
+
+
+class Installer(threading.Thread):
+
+    def __init__(self, packs, install, notify, status_file):
+        self.packs = packs
+        self.install = install
+        self.notify = notify
+        self.status_file = status_file
+        self.install_lock = threading.Lock()
+        threading.Thread.__init__(self)
+
+
+    def run(self):
+        server = dlcontrol.Server(self.control)
+        _save(self.status_file, str(server.port))
+        try:
+            threads = []
+            for pack in self.packs:
+                thread = threading.Thread(target=self.handle, args=(pack,))
+                thread.start()
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+        finally:
+            server.close()
+            try:
+                os.remove(self.status_file)
+            except OSError:
+                pass
+
+
+    def handle(self, pack):
+        if pack.extract_to:
+            self.stream(pack)
+            return
+        try:
+            if not os.path.exists(pack.path) or os.path.exists(pack.path + '.journal'):
+                pack.state = 'downloading'
+                print 'Container Installer - Downloading %s' % pack.url
+                download = downloader.Download(pack.url, pack.path, lambda done, size: self.progress(pack, done, size), connections=CONNECTIONS)
+                download.run()
+                expected = download.expected
+            else:
+                print 'Container Installer - %s already downloaded' % pack.path
+                expected = 0
+            verify(pack.path, expected)
+        except Exception, e:
+            print 'Container Installer - Download of %s failed: %s' % (pack.title, e)
+            pack.state = 'failed'
+            self.notify('%s Installation Failure' % pack.title, '')
+            return
+
+        pack.state = 'installing'
+        self.install_lock.acquire()
+        try:
+            try:
+                installed = self.install(pack.path, pack.installtype)
+            except Exception, e:
+                print 'Container Installer - Install of %s failed: %s' % (pack.title, e)
+                installed = False
+        finally:
+            self.install_lock.release()
+
+        if installed:
+            if pack.installed:
+                pack.installed()
+            pack.state = 'installed'
+            self.notify('%s Installation Success' % pack.title, '')
+        else:
+            pack.state = 'failed'
+            self.notify('%s Installation Failure' % pack.title, '')
+
+
+    def stream(self, pack):
+        offset_file = pack.path + '.offset'
+        offset = _load_offset(offset_file)
+        pack.state = 'downloading'
+        state = {'offset': offset, 'saved': time.time()}
+
+        def entry_done(name, next_offset):
+            state['offset'] = next_offset
+            pack.downloaded = next_offset
+            if time.time() - state['saved'] >= OFFSET_INTERVAL:
+                state['saved'] = time.time()
+                _save(offset_file, str(next_offset))
+
+        attempt = 1
+        while True:
+            try:
+                self.stream_from(pack, state['offset'], entry_done)
+                break
+            except Exception, e:
+                _save(offset_file, str(state['offset']))
+                print 'Container Installer - Streaming %s stopped at %d (attempt %d): %s' % (pack.title, state['offset'], attempt, e)
+                if attempt >= RETRIES or isinstance(e, zipstream.ZipStreamError):
+                    pack.state = 'failed'
+                    self.notify('%s Installation Failure' % pack.title, '')
+                    return
+                attempt += 1
+
+        try:
+            os.remove(offset_file)
+        except OSError:
+            pass
+        if pack.installed:
+            pack.installed()
+        pack.state = 'installed'
+        self.notify('%s Installation Success' % pack.title, '')
+
+
+    def stream_from(self, pack, offset, entry_done):
+        headers = {}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+        response = httpclient.request(pack.url, headers=headers, stream=True)
+        try:
+            if offset and response.status != 206:
+                print 'Container Installer - Host ignored the range, unpacking %s from the start' % pack.title
+                offset = 0
+            pack.size = offset + int(response.get_header('Content-Length') or 0)
+            print 'Container Installer - Unpacking %s from offset %d into %s' % (pack.url, offset, pack.extract_to)
+            count = zipstream.extract(response, pack.extract_to, offset, entry_done)
+            print 'Container Installer - Unpacked %d files of %s' % (count, pack.title)
+        finally:
+            response.close()
+
+
+    def progress(self, pack, downloaded, size):
+        pack.downloaded = downloaded
+        pack.size = size
+
+
+    def control(self, request):
+        if request.get('command') != 'status':
+            return {'ok': False, 'error': 'Unknown command: %s' % request.get('command')}
+        packs = []
+        for pack in self.packs:
+            packs.append({'title': pack.title, 'state': pack.state, 'downloaded': pack.downloaded, 'size': pack.size})
+        return {'ok': True, 'packs': packs}
+
+
+def verify(path, expected=0):
+    '''
+    Raise if the zip at path is shorter than expected or unreadable, deleting it
+    '''
+    try:
+        if expected and os.path.getsize(path) != expected:
+            raise zipfile.BadZipfile('%s is %d bytes, expected %d' % (path, os.path.getsize(path), expected))
+        #reads the central directory at the end of the file, a cut off zip fails here
+        archive = zipfile.ZipFile(path)
+        archive.close()
+    except (zipfile.BadZipfile, IOError), e:
+        print 'Container Installer - Removing bad zip %s: %s' % (path, e)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        downloader.remove_journal(path)
+        raise
+
+
+def running(status_file):
+    '''
+    Status reply of the installer if one is running, None otherwise
+    '''
+    if not os.path.exists(status_file):
+        return None
+    fh = open(status_file, 'r')
+    try:
+        port = fh.read().strip()
+    finally:
+        fh.close()
+    return dlcontrol.send(port, 'status')
+
+
+def _load_offset(path):
+    try:
+        fh = open(path, 'r')
+        try:
+            return int(fh.read().strip())
+        finally:
+            fh.close()
+    except (IOError, ValueError):
+        return 0
+
+
+def _save(path, contents):
+    fh = open(path, 'w')
+    try:
+        fh.write(contents)
+    finally:
+        fh.close()
@@ -1,5 +1,6 @@
-import urllib, urllib2
+import urllib
 import re, os, cookielib
+import httpclient
 
 class RealDebrid:
 
@@ -16,23 +17,20 @@ class RealDebrid:
         if self.cookie_file is not None and os.path.exists(self.cookie_file):
             cj = cookielib.LWPCookieJar()
             cj.load(self.cookie_file)
-            req = urllib2.Request(url)
-            req.add_header('User-Agent', 'Mozilla/5.0 (Windows; U; Windows NT 5.1; en-GB; rv:1.9.0.3) Gecko/2008092417 Firefox/3.0.3')   
-            opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cj))
-            response = opener.open(req)
+            #stream, so a redirect to a file doesn't download it
+            response = httpclient.request(url, cookie_jar=cj, stream=True)
 
             #check if we might have been redirected (megapremium Direct Downloads...)
             finalurl = response.geturl()
 
             #if we weren't redirected, return the page source
-            if finalurl is url:
-                link=response.read()
-                response.close()
-                return link
+            if finalurl == url:
+                return response.read()
 
             #if we have been redirected, return the redirect url
-            elif finalurl is not url:               
-                return finalurl    
+            else:
+                response.close()
+                return finalurl
 
 
     def Resolve(self, url):
@@ -76,18 +74,12 @@ class RealDebrid:
 
     def Login(self):    
         if self.checkLogin():
-            cj = cookielib.LWPCookieJar()
             login_data = urllib.urlencode({'user' : self.username, 'pass' : self.password})
             url = 'https://real-debrid.com/ajax/login.php?' + login_data
-            req = urllib2.Request(url)
-            req.add_header('User-Agent', 'Mozilla/5.0 (Windows; U; Windows NT 5.1; en-GB; rv:1.9.0.3) Gecko/2008092417 Firefox/3.0.3')
             cj = cookielib.LWPCookieJar()
-            opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cj))
 
             #do the login and get the response
-            response = opener.open(req)
-            source = response.read()
-            response.close()
+            source = httpclient.request(url, cookie_jar=cj).content
             cj.save(self.cookie_file)
             print source
             if re.search('OK', source):
@@ -0,0 +1,101 @@
+'''
+Control channel of the download-and-play download, also used to talk to
+the background download manager.
+
+The download runs inside the plugin invocation that started it. Other
+invocations (download info, cancel, the next download-and-play) talk to it
+over a socket on localhost, whose port is kept in the 'Downloading' file of
+the download folder. One json request and one json reply per connection:
+
+    {"command": "status"}  -> {"ok": true, "dest": ..., "name": ..., "downloaded": ..., "size": ...}
+    {"command": "show"}    -> {"ok": true}
+    {"command": "cancel"}  -> {"ok": true}
+
+A tcp socket on 127.0.0.1 rather than a unix socket, as xbmc runs on windows
+too. A refused connection means the download is gone, no need to wait for it.
+'''
+
+import socket, threading
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+#Seconds a client waits for the download process to answer
+TIMEOUT = 2
+
+
+class Server:
+    '''
+    Answer requests on a free localhost port with handler(request) -> reply
+    '''
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+
+    def close(self):
+        #shutdown wakes up the accept() on linux, close does it on windows
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.sock.close()
+
+
+    def _serve(self):
+        while True:
+            try:
+                conn, address = self.sock.accept()
+            except socket.error:
+                return
+            try:
+                conn.settimeout(TIMEOUT)
+                try:
+                    reply = self.handler(json.loads(_read_line(conn)))
+                except Exception, e:
+                    reply = {'ok': False, 'error': str(e)}
+                conn.sendall(json.dumps(reply) + '\n')
+            except socket.error, e:
+                print 'Download control - Request failed: %s' % e
+            conn.close()
+
+
+def send(port, command, args=None):
+    '''
+    Send a command, with optional extra request fields, to the process
+    listening on port
+
+    Returns the reply, or None if nothing is listening there.
+    '''
+    request = dict(args or {})
+    request['command'] = command
+    try:
+        sock = socket.create_connection(('127.0.0.1', int(port)), TIMEOUT)
+        try:
+            sock.sendall(json.dumps(request) + '\n')
+            return json.loads(_read_line(sock))
+        finally:
+            sock.close()
+    except (socket.error, ValueError), e:
+        print 'Download control - No answer on port %s: %s' % (port, e)
+        return None
+
+
+def _read_line(sock):
+    data = ''
+    while not data.endswith('\n'):
+        chunk = sock.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+    return data
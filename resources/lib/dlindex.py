@@ -0,0 +1,143 @@
+'''
+Index of the files downloaded by the addon.
+
+Every download is entered when it starts and completed when it finishes,
+with its size, the size the host announced, an md5 of its first and last
+megabyte and the link it came from. The source list then finds the local
+copies of a title with one indexed query instead of listing the download
+folder, and can tell a complete file from a truncated or interrupted one:
+
+    index = dlindex.DownloadIndex(os.path.join(datapath, 'download_index.db'))
+    index.start(path, title, link)
+    ...download...
+    index.complete(path, expected_size)
+    for entry in index.files(title):
+        print entry['path'], index.status(entry)
+'''
+
+import os, time
+
+try:
+    from sqlite3 import dbapi2 as sqlite
+except ImportError:
+    from pysqlite2 import dbapi2 as sqlite
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+#Status of an indexed file, see status()
+COMPLETE = 'complete'
+INCOMPLETE = 'incomplete'
+TRUNCATED = 'truncated'
+MISSING = 'missing'
+
+#Bytes hashed at each end of a file
+SAMPLE_SIZE = 1024 * 1024
+
+_columns = ['path', 'title', 'source', 'size', 'expected', 'head', 'tail', 'started', 'completed']
+
+
+class DownloadIndex:
+
+    def __init__(self, path):
+        self.path = path
+        db = self._connect()
+        try:
+            db.execute('CREATE TABLE IF NOT EXISTS files ('
+                       'path TEXT PRIMARY KEY, title TEXT, source TEXT, size INTEGER, expected INTEGER, '
+                       'head TEXT, tail TEXT, started REAL, completed REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS files_title ON files (title)')
+            db.commit()
+        finally:
+            db.close()
+
+
+    def start(self, path, title, source):
+        self._execute('INSERT OR REPLACE INTO files (path, title, source, size, expected, started) VALUES (?, ?, ?, 0, 0, ?)',
+                      (path, title, source.split('|')[0], time.time()))
+
+
+    def complete(self, path, expected=0, title=None, source=''):
+        '''
+        Record a finished file, expected being the size the host announced
+        (0 if unknown). Files not started through the index are added.
+        '''
+        size, head, tail = fingerprint(path)
+        if title is not None and self.get(path) is None:
+            self.start(path, title, source)
+        self._execute('UPDATE files SET size = ?, expected = ?, head = ?, tail = ?, completed = ? WHERE path = ?',
+                      (size, expected or size, head, tail, time.time(), path))
+
+
+    def get(self, path):
+        entries = self._select('WHERE path = ?', (path,))
+        if entries:
+            return entries[0]
+        return None
+
+
+    def files(self, title):
+        return self._select('WHERE title = ? ORDER BY path', (title,))
+
+
+    def remove(self, path):
+        self._execute('DELETE FROM files WHERE path = ?', (path,))
+
+
+    def status(self, entry, deep=False):
+        '''
+        COMPLETE, INCOMPLETE (never finished), TRUNCATED (shorter than
+        announced, or changed since) or MISSING. Only sizes are compared
+        unless deep is set, which hashes both ends of the file again.
+        '''
+        if not os.path.exists(entry['path']):
+            return MISSING
+        if not entry['completed']:
+            return INCOMPLETE
+        size = os.path.getsize(entry['path'])
+        if size != entry['size'] or size < entry['expected']:
+            return TRUNCATED
+        if deep and fingerprint(entry['path'])[1:] != (entry['head'], entry['tail']):
+            return TRUNCATED
+        return COMPLETE
+
+
+    def _select(self, where, args):
+        db = self._connect()
+        try:
+            rows = db.execute('SELECT %s FROM files %s' % (', '.join(_columns), where), args).fetchall()
+        finally:
+            db.close()
+        return [dict(zip(_columns, row)) for row in rows]
+
+
+    def _execute(self, sql, args):
+        db = self._connect()
+        try:
+            db.execute(sql, args)
+            db.commit()
+        finally:
+            db.close()
+
+
+    def _connect(self):
+        db = sqlite.connect(self.path, timeout=10)
+        db.text_factory = str
+        return db
+
+
+def fingerprint(path):
+    '''
+    (size, md5 of the first megabyte, md5 of the last megabyte) of a file
+    '''
+    size = os.path.getsize(path)
+    fh = open(path, 'rb')
+    try:
+        head = md5(fh.read(SAMPLE_SIZE)).hexdigest()
+        fh.seek(max(0, size - SAMPLE_SIZE))
+        tail = md5(fh.read(SAMPLE_SIZE)).hexdigest()
+    finally:
+        fh.close()
+    return size, head, tail
@@ -0,0 +1,164 @@
+'''
+Durable queue of background downloads.
+
+Jobs are kept in a small sqlite database in the addon profile, so the queue
+outlives the plugin invocation that filled it and an xbmc restart. The
+download manager (DownloadManager.py) takes jobs from here, the plugin
+modes only change rows and wake the manager up.
+
+A job moves through these states:
+
+    queued -> running -> done | failed
+    queued / running -> paused -> queued
+    any -> cancelled
+
+Each call opens its own connection, the manager runs one thread per job and
+sqlite connections can't be shared between threads.
+'''
+
+import time, urlparse
+from linkcache import split_link
+
+try:
+    from sqlite3 import dbapi2 as sqlite
+except ImportError:
+    from pysqlite2 import dbapi2 as sqlite
+
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+_columns = ['id', 'url', 'dest', 'name', 'host', 'state', 'position', 'downloaded', 'size', 'error', 'added']
+
+
+class Queue:
+
+    def __init__(self, path):
+        self.path = path
+        db = self._connect()
+        try:
+            db.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                       'id INTEGER PRIMARY KEY, url TEXT, dest TEXT, name TEXT, host TEXT, '
+                       'state TEXT, position INTEGER, downloaded INTEGER DEFAULT 0, '
+                       'size INTEGER DEFAULT 0, error TEXT, added REAL)')
+            db.commit()
+        finally:
+            db.close()
+
+
+    def add(self, url, dest, name):
+        host = urlparse.urlsplit(split_link(url)[0]).hostname or ''
+        db = self._connect()
+        try:
+            position = db.execute('SELECT COALESCE(MAX(position), 0) + 1 FROM jobs').fetchone()[0]
+            cursor = db.execute('INSERT INTO jobs (url, dest, name, host, state, position, added) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                (url, dest, name, host, QUEUED, position, time.time()))
+            db.commit()
+            return cursor.lastrowid
+        finally:
+            db.close()
+
+
+    def get(self, job_id):
+        jobs = self._select('WHERE id = ?', (job_id,))
+        if jobs:
+            return jobs[0]
+        return None
+
+
+    def jobs(self):
+        return self._select('ORDER BY position')
+
+
+    def next_jobs(self, running, max_jobs, max_per_host):
+        '''
+        Queued jobs to start now, given the jobs already running
+
+        running is a list of the hosts of the running jobs.
+        '''
+        running = list(running)
+        found = []
+        for job in self._select('WHERE state = ? ORDER BY position', (QUEUED,)):
+            if len(running) >= max_jobs:
+                break
+            if running.count(job['host']) >= max_per_host:
+                continue
+            running.append(job['host'])
+            found.append(job)
+        return found
+
+
+    def set_state(self, job_id, state, error=None):
+        self._execute('UPDATE jobs SET state = ?, error = ? WHERE id = ?', (state, error, job_id))
+
+
+    def set_progress(self, job_id, downloaded, size):
+        self._execute('UPDATE jobs SET downloaded = ?, size = ? WHERE id = ?', (downloaded, size, job_id))
+
+
+    def remove(self, job_id):
+        self._execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+
+    def move(self, job_id, offset):
+        '''
+        Swap a job with its neighbour, offset -1 moves it up and 1 down
+        '''
+        ids = [job['id'] for job in self.jobs()]
+        if job_id not in ids:
+            return
+        index = ids.index(job_id)
+        other = index + offset
+        if other < 0 or other >= len(ids):
+            return
+        ids[index], ids[other] = ids[other], ids[index]
+
+        db = self._connect()
+        try:
+            for position, moved_id in enumerate(ids):
+                db.execute('UPDATE jobs SET position = ? WHERE id = ?', (position + 1, moved_id))
+            db.commit()
+        finally:
+            db.close()
+
+
+    def recover(self):
+        '''
+        Put back in the queue the jobs left running by a manager that died
+        '''
+        self._execute('UPDATE jobs SET state = ? WHERE state = ?', (QUEUED, RUNNING))
+
+
+    def pending(self):
+        db = self._connect()
+        try:
+            return db.execute('SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)', (QUEUED, RUNNING)).fetchone()[0]
+        finally:
+            db.close()
+
+
+    def _select(self, where='', args=()):
+        db = self._connect()
+        try:
+            rows = db.execute('SELECT %s FROM jobs %s' % (', '.join(_columns), where), args).fetchall()
+        finally:
+            db.close()
+        return [dict(zip(_columns, row)) for row in rows]
+
+
+    def _execute(self, sql, args):
+        db = self._connect()
+        try:
+            db.execute(sql, args)
+            db.commit()
+        finally:
+            db.close()
+
+
+    def _connect(self):
+        db = sqlite.connect(self.path, timeout=10)
+        db.text_factory = str
+        return db
@@ -0,0 +1,487 @@
+'''
+Download engine used by all the download modes of the addon.
+
+When the host answers Range requests the file is fetched in chunks, handed
+out in file order to several connections at once. The target file is
+preallocated and the completed chunks are listed in a small journal next to
+it (<dest>.journal), so an interrupted download picks up where it stopped
+instead of starting again from byte zero. Hosts without Range support are
+downloaded on a single stream, like urllib.urlretrieve did.
+
+Data is gathered in a reusable buffer per connection and written out in
+large blocks, and the file is synced once per journal save rather than on
+every write, just before the journal that lists the chunks it holds.
+
+    import downloader
+    downloader.download(url, dest, hook=progress, connections=4)
+
+hook(downloaded, filesize) is called about twice a second from the calling
+thread, raising from it cancels the download. An incomplete single stream
+download raises urllib.ContentTooShortError, as urlretrieve does.
+
+A RateLimiter shared between downloads caps their combined speed, and can be
+changed while they run.
+
+To play a file while it downloads, run the Download in a thread and use
+prioritize() to move the connections to where the player reads next and
+wait_for() to block until a byte range is on disk (see streamproxy).
+'''
+
+import os, re, time, threading, urllib
+import httpclient
+from linkcache import split_link
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+#Socket reads stay small enough to notice a cancel quickly,
+#writes are gathered and hit the disk in large blocks
+READ_SIZE = 256 * 1024
+BUFFER_SIZE = 2 * 1024 * 1024
+
+#Attempts for a single chunk before the whole download is given up
+RETRIES = 3
+
+#Seconds between progress callbacks and between journal saves
+PROGRESS_INTERVAL = 0.5
+JOURNAL_INTERVAL = 5
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+def download(url, dest, hook=None, connections=4, preallocate=True, limiter=None):
+    '''
+    Download url to dest, resuming a previous attempt if its journal is found
+
+    preallocate=False keeps the file growing from the start, for files that
+    are played while downloading (use a single connection for that too).
+    '''
+    return Download(url, dest, hook, connections, preallocate, limiter).run()
+
+
+class RateLimiter:
+    '''
+    Token bucket shared by every connection it is given to
+
+    rate is in bytes per second, 0 means unlimited. Up to a second worth of
+    data may go through at once, after that readers sleep until the bucket
+    fills up again.
+    '''
+
+    def __init__(self, rate=0):
+        self.lock = threading.Lock()
+        self.rate = 0
+        self.tokens = 0
+        self.updated = time.time()
+        self.set_rate(rate)
+
+
+    def set_rate(self, rate):
+        self.lock.acquire()
+        try:
+            if rate != self.rate:
+                self.rate = rate
+                self.tokens = min(self.tokens, rate)
+                self.updated = time.time()
+        finally:
+            self.lock.release()
+
+
+    def consume(self, amount):
+        self.lock.acquire()
+        try:
+            if not self.rate:
+                return
+            now = time.time()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            delay = -self.tokens / float(self.rate)
+        finally:
+            self.lock.release()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Download:
+
+    def __init__(self, url, dest, hook=None, connections=4, preallocate=True, limiter=None, chunk_size=CHUNK_SIZE):
+        self.url, self.headers = split_link(url)
+        self.dest = dest
+        self.journal = dest + '.journal'
+        self.hook = hook
+        self.connections = max(1, connections)
+        self.preallocate = preallocate
+        self.limiter = limiter
+        self.chunk_size = chunk_size
+
+        self.lock = threading.Lock()
+        #notified whenever a chunk is done and when the download ends
+        self.changed = threading.Condition(self.lock)
+        #set once the size is known and the chunks are laid out
+        self.ready = threading.Event()
+        self.stop = threading.Event()
+        self.finished = False
+        self.error = None
+        self.size = 0
+        #size announced by the host, 0 if it didn't say
+        self.expected = 0
+        self.pending = []
+        self.done = []
+        self.active = {}
+
+
+    def run(self):
+        try:
+            return self._run()
+        finally:
+            #nothing more is coming, wake up whoever still waits for data
+            self.changed.acquire()
+            self.finished = True
+            self.changed.notifyAll()
+            self.changed.release()
+            self.ready.set()
+
+
+    def prioritize(self, position):
+        '''
+        Fetch the chunks from position onwards first, in file order
+        '''
+        first = position / self.chunk_size
+        self.lock.acquire()
+        try:
+            ahead = [chunk for chunk in self.pending if chunk >= first]
+            behind = [chunk for chunk in self.pending if chunk < first]
+            ahead.sort()
+            behind.sort()
+            self.pending = ahead + behind
+        finally:
+            self.lock.release()
+
+
+    def wait_for(self, start, end, timeout=None):
+        '''
+        Block until bytes start-end (inclusive) are on disk
+
+        Returns False if the download ended without them or on timeout.
+        '''
+        end = min(end, self.size - 1)
+        chunks = range(start / self.chunk_size, end / self.chunk_size + 1)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        self.changed.acquire()
+        try:
+            while True:
+                missing = [chunk for chunk in chunks if chunk not in self.done]
+                if not missing:
+                    return True
+                if self.finished:
+                    return False
+                if deadline is None:
+                    self.changed.wait(1)
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self.changed.wait(min(remaining, 1))
+        finally:
+            self.changed.release()
+
+
+    def _run(self):
+        #Ask for the first byte only: a 206 tells us ranges work and the file size
+        response = httpclient.request(self.url, headers=self._headers(0, 0), stream=True)
+        if response.status == 206:
+            self.size = range_total(response.get_header('Content-Range'))
+            if not self.size:
+                #ranges work but the size is unknown, fetch it whole
+                response.close()
+                response = httpclient.request(self.url, headers=self.headers, stream=True)
+        if not self.size:
+            print 'Downloader - No range support, using a single stream: %s' % self.url
+            self.ready.set()
+            return self._single(response)
+        response.read()
+        response.close()
+        self.expected = self.size
+
+        #follow redirects once only
+        self.url = response.geturl()
+        self._prepare()
+        self.ready.set()
+
+        connections = min(self.connections, len(self.pending))
+        print 'Downloader - %s bytes in %s chunks over %s connections, %s chunks already done' % (self.size, len(self.pending) + len(self.done), connections, len(self.done))
+
+        threads = []
+        for i in range(connections):
+            thread = threading.Thread(target=self._worker)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+
+        last_journal = time.time()
+        try:
+            while _alive(threads):
+                time.sleep(PROGRESS_INTERVAL)
+                self._progress()
+                if time.time() - last_journal >= JOURNAL_INTERVAL:
+                    self._save_journal()
+                    last_journal = time.time()
+        except:
+            #cancelled from the hook, let the workers finish their current read
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+            self._save_journal()
+            raise
+
+        if self.error is not None:
+            self._save_journal()
+            raise self.error
+
+        self._progress()
+        _remove(self.journal)
+        return self.dest
+
+
+    def _prepare(self):
+        chunks = (self.size + self.chunk_size - 1) / self.chunk_size
+        journal = self._load_journal()
+
+        if journal and os.path.exists(self.dest) and journal.get('size') == self.size and journal.get('chunk') == self.chunk_size:
+            self.done = journal['done']
+            print 'Downloader - Resuming %s' % self.dest
+        else:
+            self.done = []
+            fh = open(self.dest, 'wb')
+            try:
+                if self.preallocate:
+                    fh.truncate(self.size)
+            finally:
+                fh.close()
+            self._save_journal()
+
+        self.pending = [i for i in range(chunks) if i not in self.done]
+
+
+    def _worker(self):
+        #unbuffered, the writer does the buffering
+        fh = open(self.dest, 'r+b', 0)
+        writer = _Writer(fh, min(BUFFER_SIZE, self.chunk_size))
+        try:
+            while not self.stop.isSet():
+                self.lock.acquire()
+                try:
+                    if not self.pending:
+                        return
+                    chunk = self.pending.pop(0)
+                finally:
+                    self.lock.release()
+
+                attempt = 1
+                while not self.stop.isSet():
+                    try:
+                        if self._fetch(writer, chunk):
+                            self.changed.acquire()
+                            self.active.pop(chunk, None)
+                            self.done.append(chunk)
+                            self.changed.notifyAll()
+                            self.changed.release()
+                        break
+                    except Exception, e:
+                        print 'Downloader - Chunk %s failed (attempt %s): %s' % (chunk, attempt, e)
+                        if attempt >= RETRIES or isinstance(e, RangeNotSupported):
+                            self.error = e
+                            self.stop.set()
+                        attempt += 1
+                self.active.pop(chunk, None)
+        finally:
+            fh.close()
+
+
+    def _fetch(self, writer, chunk):
+        start = chunk * self.chunk_size
+        end = min(start + self.chunk_size, self.size) - 1
+        self.active[chunk] = 0
+        writer.reset(start)
+
+        response = httpclient.request(self.url, headers=self._headers(start, end), stream=True)
+        try:
+            if response.status != 206:
+                raise RangeNotSupported('Host stopped answering range requests')
+
+            position = start
+            while position <= end:
+                if self.stop.isSet():
+                    return False
+                data = response.read(min(READ_SIZE, end - position + 1))
+                if not data:
+                    raise urllib.ContentTooShortError('chunk %s incomplete: got %i of %i bytes' % (chunk, position - start, end - start + 1), None)
+                writer.write(data)
+                position += len(data)
+                self.active[chunk] = position - start
+                if self.limiter:
+                    self.limiter.consume(len(data))
+            writer.flush()
+            return True
+        finally:
+            response.close()
+
+
+    def _single(self, response):
+        size = response.get_header('Content-Length')
+        if size:
+            size = int(size)
+            self.expected = size
+        else:
+            size = -1
+
+        read = 0
+        last_progress = 0
+        fh = open(self.dest, 'wb', 0)
+        writer = _Writer(fh)
+        try:
+            while True:
+                data = response.read(READ_SIZE)
+                if not data:
+                    break
+                writer.write(data)
+                read += len(data)
+                if self.limiter:
+                    self.limiter.consume(len(data))
+                if self.hook and time.time() - last_progress >= PROGRESS_INTERVAL:
+                    last_progress = time.time()
+                    self.hook(read, size)
+        finally:
+            response.close()
+            writer.flush()
+            fh.close()
+
+        if size >= 0 and read < size:
+            raise urllib.ContentTooShortError('retrieval incomplete: got only %i out of %i bytes' % (read, size), (self.dest, response.info()))
+        if self.hook:
+            self.hook(read, size)
+        return self.dest
+
+
+    def _progress(self):
+        if self.hook:
+            downloaded = 0
+            for chunk in self.done:
+                downloaded += min(self.chunk_size, self.size - chunk * self.chunk_size)
+            for received in self.active.values():
+                downloaded += received
+            self.hook(downloaded, self.size)
+
+
+    def _headers(self, start, end):
+        headers = dict(self.headers)
+        headers['Range'] = 'bytes=%d-%d' % (start, end)
+        return headers
+
+
+    def _load_journal(self):
+        try:
+            fh = open(self.journal, 'r')
+            try:
+                return json.load(fh)
+            finally:
+                fh.close()
+        except Exception:
+            return None
+
+
+    def _save_journal(self):
+        self.lock.acquire()
+        try:
+            journal = {'size': self.size, 'chunk': self.chunk_size, 'done': list(self.done)}
+        finally:
+            self.lock.release()
+        #the chunks listed were flushed before being marked done, make sure they are on disk
+        _sync(self.dest)
+        try:
+            fh = open(self.journal, 'w')
+            try:
+                json.dump(journal, fh)
+            finally:
+                fh.close()
+        except Exception, e:
+            print 'Downloader - Failed to save journal %s: %s' % (self.journal, e)
+
+
+class _Writer:
+    '''
+    Gather reads in a reusable buffer and write them at position in large blocks
+    '''
+
+    def __init__(self, fh, size=BUFFER_SIZE):
+        self.fh = fh
+        self.buffer = bytearray(size)
+        self.used = 0
+        self.position = 0
+
+
+    def reset(self, position):
+        self.used = 0
+        self.position = position
+
+
+    def write(self, data):
+        if self.used + len(data) > len(self.buffer):
+            self.flush()
+        self.buffer[self.used:self.used + len(data)] = data
+        self.used += len(data)
+
+
+    def flush(self):
+        if self.used:
+            self.fh.seek(self.position)
+            self.fh.write(memoryview(self.buffer)[:self.used])
+            self.position += self.used
+            self.used = 0
+
+
+def remove_journal(dest):
+    _remove(dest + '.journal')
+
+
+def _sync(path):
+    #fsync syncs the file, not the handle, so one call covers every connection
+    try:
+        fd = os.open(path, os.O_RDWR)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError, e:
+        print 'Downloader - Failed to sync %s: %s' % (path, e)
+
+
+def range_total(content_range):
+    #bytes 0-0/12345
+    match = re.search('/(\d+)', content_range or '')
+    if match:
+        return int(match.group(1))
+    return 0
+
+
+def _alive(threads):
+    for thread in threads:
+        if thread.isAlive():
+            return True
+    return False
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
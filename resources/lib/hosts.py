@@ -0,0 +1,67 @@
+'''
+Registry of the file hosts the addon can play from.
+
+Each host is registered once with the domain(s) it serves from, the short
+code shown in the source list, its icon, the function that turns a host
+page url into a playable link and how long (seconds) such a link stays
+usable. Resolvers are called as resolver(url, quiet), a quiet resolve runs in
+the background and must not show any dialog:
+
+    import hosts
+    hosts.register('megaupload.com', 'MU', megapic, resolve_megaupload, link_ttl=30*60)
+
+lookup() parses the netloc of a url and finds its host with a dict lookup,
+trying the full hostname first and then its parent domains, so
+www.megaupload.com and dl3.megaupload.com both find megaupload.com.
+'''
+
+import urlparse
+
+
+class Host:
+
+    def __init__(self, domains, code, icon, resolver, link_ttl=0):
+        self.domains = domains
+        self.code = code
+        self.icon = icon
+        self.resolver = resolver
+        self.link_ttl = link_ttl
+
+    def resolve(self, url, quiet=False):
+        return self.resolver(url, quiet)
+
+
+_hosts = {}
+
+
+def register(domains, code, icon, resolver, link_ttl=0):
+    '''
+    Add a host to the registry, domains may be a single domain or a list.
+    Registering a domain again replaces the previous host.
+    A link_ttl of 0 means resolved links must not be reused.
+    '''
+    if isinstance(domains, basestring):
+        domains = [domains]
+    host = Host(domains, code, icon, resolver, link_ttl)
+    for domain in domains:
+        _hosts[domain.lower()] = host
+    return host
+
+
+def lookup(url):
+    '''
+    Return the Host serving url, or None if it isn't a known host
+    '''
+    try:
+        hostname = urlparse.urlsplit(url).hostname
+    except ValueError:
+        return None
+    if not hostname:
+        return None
+
+    labels = hostname.lower().split('.')
+    for i in range(len(labels) - 1):
+        host = _hosts.get('.'.join(labels[i:]))
+        if host is not None:
+            return host
+    return None
@@ -0,0 +1,184 @@
+'''
+On-disk cache for site pages fetched through httpclient.
+
+Every cached url is kept as two files in the cache folder, named after the
+md5 of the url:
+
+    <key>.body   the decoded page
+    <key>.meta   json with the url, expiry time and validators
+
+Entries are fresh for the ttl the caller asks for. Once stale they are
+revalidated with If-None-Match/If-Modified-Since when the server gave us an
+ETag or Last-Modified, so an unchanged page costs a 304 instead of a full
+download. The .body mtime is bumped on every hit and used to evict the least
+recently used entries when the folder grows past max_size.
+'''
+
+import os, time, hashlib
+import httpclient
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+class HttpCache:
+
+    def __init__(self, path, max_size=20 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+
+
+    def fetch(self, url, ttl, headers=None):
+        '''
+        Return the body of url, from the cache when still fresh
+
+        A stale copy is returned as is if the site can't be reached.
+        '''
+        key = self._key(url)
+        meta = self._load_meta(key)
+        now = time.time()
+
+        if meta and meta['expires'] > now:
+            body = self._load_body(key)
+            if body is not None:
+                print 'HttpCache - Hit: %s' % url
+                return body
+
+        req_headers = {}
+        if headers:
+            req_headers.update(headers)
+        if meta:
+            if meta.get('etag'):
+                req_headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                req_headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            response = httpclient.request(url, headers=req_headers)
+        except Exception, e:
+            body = None
+            if meta:
+                body = self._load_body(key)
+            if body is None:
+                raise
+            print 'HttpCache - Request failed (%s), using stale copy of: %s' % (e, url)
+            return body
+
+        if response.status == 304 and meta:
+            body = self._load_body(key)
+            if body is not None:
+                print 'HttpCache - Revalidated: %s' % url
+                meta['expires'] = now + ttl
+                self._save_meta(key, meta)
+                return body
+            #body went missing, fetch it again without validators
+            response = httpclient.request(url, headers=headers)
+
+        body = response.content
+        meta = {'url': url,
+                'expires': now + ttl,
+                'etag': response.get_header('ETag'),
+                'last_modified': response.get_header('Last-Modified')}
+        self.store(key, body, meta)
+        return body
+
+
+    def store(self, key, body, meta):
+        try:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            _write(os.path.join(self.path, key + '.body'), body, 'wb')
+            self._save_meta(key, meta)
+            self.evict()
+        except Exception, e:
+            print 'HttpCache - Failed to store %s: %s' % (meta['url'], e)
+
+
+    def invalidate(self, url):
+        key = self._key(url)
+        for ext in ('.body', '.meta'):
+            try:
+                os.remove(os.path.join(self.path, key + ext))
+            except OSError:
+                pass
+
+
+    def evict(self):
+        #Drop least recently used pages until we are back under max_size
+        entries = []
+        total = 0
+        for filename in os.listdir(self.path):
+            if filename.endswith('.body'):
+                filepath = os.path.join(self.path, filename)
+                try:
+                    st = os.stat(filepath)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, filename[:-5]))
+                total += st.st_size
+
+        if total <= self.max_size:
+            return
+
+        entries.sort()
+        for mtime, size, key in entries:
+            if total <= self.max_size:
+                break
+            for ext in ('.body', '.meta'):
+                try:
+                    os.remove(os.path.join(self.path, key + ext))
+                except OSError:
+                    pass
+            total -= size
+
+
+    def _key(self, url):
+        return hashlib.md5(url).hexdigest()
+
+
+    def _load_meta(self, key):
+        try:
+            fh = open(os.path.join(self.path, key + '.meta'), 'r')
+            try:
+                return json.load(fh)
+            finally:
+                fh.close()
+        except Exception:
+            return None
+
+
+    def _save_meta(self, key, meta):
+        _write(os.path.join(self.path, key + '.meta'), json.dumps(meta), 'w')
+
+
+    def _load_body(self, key):
+        filepath = os.path.join(self.path, key + '.body')
+        try:
+            fh = open(filepath, 'rb')
+            try:
+                body = fh.read()
+            finally:
+                fh.close()
+        except IOError:
+            return None
+        #mark as recently used for the LRU eviction
+        try:
+            os.utime(filepath, None)
+        except OSError:
+            pass
+        return body
+
+
+def _write(filepath, contents, mode):
+    #write to a temp file first so a killed plugin never leaves half a page behind
+    tmp = filepath + '.tmp'
+    fh = open(tmp, mode)
+    try:
+        fh.write(contents)
+    finally:
+        fh.close()
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    os.rename(tmp, filepath)
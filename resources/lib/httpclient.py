@@ -0,0 +1,355 @@
+'''
+Shared HTTP client for the Icefilms addon.
+
+Keeps a small pool of persistent (keep-alive) connections per host, so that
+browsing an index and then resolving a handful of mirrors on the same site
+does not pay for a new TCP (and SSL) handshake on every request. Responses
+are requested gzip/deflate compressed and transparently decoded.
+
+Simple usage:
+
+    import httpclient
+    html = httpclient.request('http://www.icefilms.info/').content
+
+Cookies are handled by passing any cookielib jar as cookie_jar, exactly like
+urllib2.HTTPCookieProcessor would do it.
+'''
+
+import socket, threading, zlib, gzip
+import urllib, urllib2, urlparse, httplib
+from StringIO import StringIO
+
+USER_AGENT = 'Mozilla/5.0 (Windows; U; Windows NT 5.1; en-GB; rv:1.9.0.3) Gecko/2008092417 Firefox/3.0.3'
+
+#Seconds to wait on connect/read before giving up on a request
+DEFAULT_TIMEOUT = 30
+
+#Number of idle keep-alive connections kept open per host
+MAX_IDLE_PER_HOST = 4
+
+#Number of requests allowed in flight at once per host, further requests
+#wait for a free slot so parallel lookups don't get us rate-limited.
+#Stream requests (downloads, the stream proxy) don't take a slot, their
+#callers decide how many connections they open and hold them for long
+MAX_ACTIVE_PER_HOST = 4
+
+MAX_REDIRECTS = 5
+
+
+class HttpError(Exception):
+    def __init__(self, code, url, reason=''):
+        self.code = code
+        self.url = url
+        self.reason = reason
+    def __str__(self):
+        return 'HTTP Error %s: %s (%s)' % (self.code, self.reason, self.url)
+
+
+class HttpResponse:
+    '''
+    Response returned by HttpClient.request()
+
+    For normal requests the body is already read and decoded into .content.
+    For stream=True requests the body is left on the connection, use read()
+    to consume it and close() when done so the connection can be reused.
+
+    info() and geturl() mimic urllib2 responses so cookielib can use them.
+    '''
+
+    def __init__(self, url, status, reason, headers, content=None, raw=None, pool=None, conn=None):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self._raw = raw
+        self._pool = pool
+        self._conn = conn
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+    def getcode(self):
+        return self.status
+
+    def get_header(self, name, default=None):
+        return self.headers.getheader(name, default)
+
+    def read(self, amt=None):
+        if self._raw is None:
+            content = self.content or ''
+            self.content = ''
+            return content
+        if amt is None:
+            data = self._raw.read()
+        else:
+            data = self._raw.read(amt)
+        if not data or self._raw.isclosed():
+            self._finish(True)
+        return data
+
+    def close(self):
+        #A half read stream can't be reused, drop the connection instead
+        if self._raw is not None:
+            self._finish(self._raw.isclosed())
+
+    def __del__(self):
+        #give the host slot back if a stream was never closed
+        self.close()
+
+    def _finish(self, reusable):
+        if self._conn is not None:
+            #only streams hold on to their connection, and they never take a slot
+            self._pool.release(self._conn, reusable and not self._raw.will_close, slot=False)
+        self._raw = None
+        self._conn = None
+
+
+class _HostPool:
+    '''
+    Idle connections for a single scheme://host:port
+
+    Every acquire() takes one of max_active slots unless told otherwise,
+    which is given back by release(), so at most max_active requests run
+    against the host at once.
+    '''
+
+    def __init__(self, scheme, host, port, max_idle, max_active):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.idle = []
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(max_active)
+
+    def acquire(self, timeout, slot=True):
+        if slot:
+            self.slots.acquire()
+        self.lock.acquire()
+        try:
+            if self.idle:
+                conn = self.idle.pop()
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+        finally:
+            self.lock.release()
+
+        if self.scheme == 'https':
+            conn = httplib.HTTPSConnection(self.host, self.port, timeout=timeout)
+        else:
+            conn = httplib.HTTPConnection(self.host, self.port, timeout=timeout)
+        return conn, False
+
+    def release(self, conn, reusable, slot=True):
+        try:
+            if reusable:
+                self.lock.acquire()
+                try:
+                    if len(self.idle) < self.max_idle:
+                        self.idle.append(conn)
+                        return
+                finally:
+                    self.lock.release()
+            conn.close()
+        finally:
+            if slot:
+                self.slots.release()
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            for conn in self.idle:
+                conn.close()
+            self.idle = []
+        finally:
+            self.lock.release()
+
+
+class HttpClient:
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_idle=MAX_IDLE_PER_HOST, max_active=MAX_ACTIVE_PER_HOST, user_agent=USER_AGENT):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_active = max_active
+        self.user_agent = user_agent
+        self._pools = {}
+        self._lock = threading.Lock()
+
+
+    def request(self, url, data=None, headers=None, cookie_jar=None, method=None, follow_redirects=True, stream=False, timeout=None):
+        '''
+        Perform a request and return an HttpResponse
+
+        data may be a dict (it will be urlencoded) or an already encoded string,
+        when given the request is a POST unless method says otherwise.
+        Raises HttpError for 4xx/5xx replies, like urllib2.urlopen.
+        '''
+        if isinstance(data, dict):
+            data = urllib.urlencode(data)
+        if timeout is None:
+            timeout = self.timeout
+
+        redirects = 0
+        while True:
+            response = self._open(url, data, headers, cookie_jar, method, stream, timeout)
+            location = response.get_header('Location')
+
+            if follow_redirects and location and response.status in (301, 302, 303, 307) and redirects < MAX_REDIRECTS:
+                response.close()
+                redirects += 1
+                url = urlparse.urljoin(url, location)
+                #browsers turn a redirected POST into a GET, except for 307
+                if response.status != 307:
+                    data = None
+                    method = None
+                continue
+            break
+
+        if response.status >= 400:
+            response.close()
+            raise HttpError(response.status, url, response.reason)
+        return response
+
+
+    def get(self, url, **kwargs):
+        return self.request(url, **kwargs)
+
+
+    def post(self, url, data, **kwargs):
+        return self.request(url, data=data, **kwargs)
+
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools = {}
+        finally:
+            self._lock.release()
+
+
+    def _get_pool(self, scheme, host, port):
+        key = (scheme, host, port)
+        self._lock.acquire()
+        try:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = _HostPool(scheme, host, port, self.max_idle, self.max_active)
+                self._pools[key] = pool
+            return pool
+        finally:
+            self._lock.release()
+
+
+    def _build_headers(self, url, data, headers, cookie_jar, stream):
+        #Build through urllib2.Request so cookielib can add its Cookie header
+        req = urllib2.Request(url, data)
+        req.add_header('User-Agent', self.user_agent)
+        if stream:
+            #compressed bodies can't be resumed with Range, ask for the raw bytes
+            req.add_header('Accept-encoding', 'identity')
+        else:
+            req.add_header('Accept-encoding', 'gzip, deflate')
+        if data is not None:
+            req.add_header('Content-type', 'application/x-www-form-urlencoded')
+        if headers:
+            for key, value in headers.items():
+                req.add_header(key, value)
+        if cookie_jar is not None:
+            cookie_jar.add_cookie_header(req)
+        return req, dict(req.header_items())
+
+
+    def _open(self, url, data, headers, cookie_jar, method, stream, timeout):
+        parts = urlparse.urlsplit(url)
+        scheme = parts[0].lower()
+        host = parts.hostname
+        port = parts.port
+        if port is None:
+            if scheme == 'https':
+                port = 443
+            else:
+                port = 80
+        path = parts[2] or '/'
+        if parts[3]:
+            path = path + '?' + parts[3]
+
+        if method is None:
+            if data is None:
+                method = 'GET'
+            else:
+                method = 'POST'
+
+        req, req_headers = self._build_headers(url, data, headers, cookie_jar, stream)
+        pool = self._get_pool(scheme, host, port)
+
+        #A pooled connection may have been closed by the server while idle,
+        #in that case retry once on a fresh connection
+        while True:
+            conn, reused = pool.acquire(timeout, slot=not stream)
+            try:
+                conn.request(method, path, data, req_headers)
+                raw = conn.getresponse()
+                break
+            except (httplib.HTTPException, socket.error):
+                pool.release(conn, False, slot=not stream)
+                if not reused:
+                    raise
+
+        if cookie_jar is not None:
+            cookie_jar.extract_cookies(HttpResponse(url, raw.status, raw.reason, raw.msg), req)
+
+        if stream:
+            return HttpResponse(url, raw.status, raw.reason, raw.msg, raw=raw, pool=pool, conn=conn)
+
+        try:
+            body = raw.read()
+        except:
+            pool.release(conn, False)
+            raise
+        pool.release(conn, not raw.will_close)
+
+        return HttpResponse(url, raw.status, raw.reason, raw.msg, content=_decode(body, raw.msg))
+
+
+def _decode(body, headers):
+    encoding = (headers.getheader('Content-Encoding') or '').lower()
+    if encoding == 'gzip':
+        return gzip.GzipFile(fileobj=StringIO(body)).read()
+    elif encoding == 'deflate':
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            #some servers send a raw deflate stream without the zlib header
+            return zlib.decompress(body, -zlib.MAX_WBITS)
+    return body
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    #Shared client, so every module in the addon draws from the same pools
+    global _client
+    _client_lock.acquire()
+    try:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+    finally:
+        _client_lock.release()
+
+
+def set_timeout(timeout):
+    get_client().timeout = timeout
+
+
+def request(url, **kwargs):
+    return get_client().request(url, **kwargs)
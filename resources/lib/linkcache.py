@@ -0,0 +1,97 @@
+'''
+Cache of resolved file host links.
+
+Resolving a host link can take several requests plus a free user countdown,
+so the final link is kept for a while, keyed on the source url it was
+resolved from. Links using xbmc's "url|header=value" form are stored as the
+direct url plus a dict of headers, and put back together on get().
+
+Everything lives in one small json file, loaded on every call since each
+plugin invocation is a separate process.
+'''
+
+import os, time, urllib, urlparse
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+class LinkCache:
+
+    def __init__(self, path):
+        self.path = path
+
+
+    def get(self, source):
+        entry = self._load().get(source)
+        if entry is None or entry['expires'] <= time.time():
+            return None
+        #json hands back unicode, xbmc wants plain strings
+        link = entry['url'].encode('utf-8')
+        if entry['headers']:
+            headers = {}
+            for key, value in entry['headers'].items():
+                headers[key.encode('utf-8')] = value.encode('utf-8')
+            link = link + '|' + urllib.urlencode(headers)
+        return link
+
+
+    def put(self, source, link, ttl):
+        url, headers = split_link(link)
+        links = self._purge(self._load())
+        links[source] = {'url': url, 'headers': headers, 'expires': time.time() + ttl}
+        self._save(links)
+
+
+    def invalidate(self, source):
+        links = self._load()
+        if source in links:
+            print 'LinkCache - Dropping link for: %s' % source
+            del links[source]
+            self._save(links)
+
+
+    def _purge(self, links):
+        now = time.time()
+        for source in links.keys():
+            if links[source]['expires'] <= now:
+                del links[source]
+        return links
+
+
+    def _load(self):
+        try:
+            fh = open(self.path, 'r')
+            try:
+                return json.load(fh)
+            finally:
+                fh.close()
+        except Exception:
+            return {}
+
+
+    def _save(self, links):
+        try:
+            tmp = self.path + '.tmp'
+            fh = open(tmp, 'w')
+            try:
+                json.dump(links, fh)
+            finally:
+                fh.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmp, self.path)
+        except Exception, e:
+            print 'LinkCache - Failed to save %s: %s' % (self.path, e)
+
+
+def split_link(link):
+    '''
+    Split an xbmc style "url|header=value&header=value" link
+    '''
+    if '|' not in link:
+        return link, {}
+    url, headers = link.split('|', 1)
+    return url, dict(urlparse.parse_qsl(headers))
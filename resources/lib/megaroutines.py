@@ -8,7 +8,8 @@ Python link resolver for megaupload.
 '''
 
 import re,sys,os
-import urllib,urllib2,cookielib
+import urllib,cookielib
+import httpclient
 
 def openfile(filename):
      fh = open(filename, 'r')
@@ -290,15 +291,10 @@ def __doLogin(baseurl, cookiepath, username, password):
 
 		#build the login code, from user, pass, baseurl and cookie
 		login_data = urllib.urlencode({'username' : username, 'password' : password, 'login' : 1, 'redir' : 1})	
-		req = urllib2.Request(baseurl + '?c=login', login_data)
-		req.add_header('User-Agent', 'Mozilla/5.0 (Windows; U; Windows NT 5.1; en-GB; rv:1.9.0.3) Gecko/2008092417 Firefox/3.0.3')
 		cj = cookielib.LWPCookieJar()
-		opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cj))
 
 		#do the login and get the response
-		response = opener.open(req)
-		source = response.read()
-		response.close()
+		source = httpclient.request(baseurl + '?c=login', data=login_data, cookie_jar=cj).content
 
 		login = new_check_login(source)
 
@@ -346,30 +342,22 @@ def GetURL(url,self=False,disable_cookies=False):
 
      # don't use cookie, if not logged in          
      if use_cookie is False:
-          req = urllib2.Request(url)
-          req.add_header('User-Agent', 'Mozilla/5.0 (Windows; U; Windows NT 5.1; en-GB; rv:1.9.0.3) Gecko/2008092417 Firefox/3.0.3')       
-          response = urllib2.urlopen(req)
-          link=response.read()
-          response.close()
-          return link
+          return httpclient.request(url).content
 
      # use cookie, if logged in
      if use_cookie is True:
           cj = cookielib.LWPCookieJar()
           cj.load(self.cookie)
-          req = urllib2.Request(url)
-          req.add_header('User-Agent', 'Mozilla/5.0 (Windows; U; Windows NT 5.1; en-GB; rv:1.9.0.3) Gecko/2008092417 Firefox/3.0.3')       
-          opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cj))
-          response = opener.open(req)
+          #stream, so a redirect to a file doesn't download it
+          response = httpclient.request(url, cookie_jar=cj, stream=True)
 
           #check if we were redirected (megapremium Direct Downloads...)
           finalurl = response.geturl()
-          if finalurl is url:
-               link=response.read()
-               response.close()
-               return link
-          elif finalurl is not url:
+          if finalurl == url:
+               return response.read()
+          else:
                #if we have been redirected, return the redirect url
+               response.close()
                return finalurl
 
 
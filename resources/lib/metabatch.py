@@ -0,0 +1,195 @@
+'''
+Batched meta lookups for whole directory listings.
+
+Listing an A-Z page used to call get_meta() row after row, so every title
+missing from the meta cache waited for its own remote lookup before the next
+row was even looked at. Instead the page's lookups are collected first:
+
+    lookups = [('movie', 'Heat', '113277', '1995'), ...]
+    metas = metabatch.lookup(metaget, lookups, new_metaget)
+
+One IN (...) query per BATCH_SIZE ids tells which titles are cached. The
+misses are fetched side by side by a few workers, each with its own
+MetaData from new_metaget() as sqlite connections can't be shared between
+threads, and stored in the cache by get_meta() as usual. The rows are then
+read back through metaget, which only hits the local cache now.
+Formatting a cached row (local image paths, cast, trailer) stays with
+metahandler.
+
+Episode lists work the same per season: prefetch_season() finds the cached
+episodes of a season with one query and fetches the rest side by side.
+'''
+
+import re, threading
+import workerpool
+from cleaners import CLEANUP, CLEANUP_FOR_META
+
+try:
+    from sqlite3 import dbapi2 as sqlite
+except ImportError:
+    from pysqlite2 import dbapi2 as sqlite
+
+#meta cache table of each media type, keyed on the imdb id
+TABLES = {'movie': 'movie_meta', 'tvshow': 'tvshow_meta'}
+EPISODES = 'episode_meta'
+
+#sqlite takes at most 999 parameters in one statement
+BATCH_SIZE = 500
+
+#remote lookups running at once
+WORKERS = 4
+
+
+def lookup_for(media_type, imdb_id, name):
+    '''
+    The (type, name, imdb_id, year) lookup of a title as listed on the site
+    '''
+    #we want a clean name with the year separated for proper meta search and storing
+    meta_name = CLEANUP_FOR_META(CLEANUP(name))
+    year = ''
+    r = re.search('(.+?) [(]([0-9]{4})[)]', meta_name)
+    if r:
+        meta_name = r.group(1)
+        year = r.group(2)
+    if media_type != 'movie':
+        year = ''
+    return (media_type, meta_name, imdb_id, year)
+
+
+def imdb_key(imdb_id):
+    '''
+    The imdb id as the meta cache stores it, None for pages without one
+    '''
+    if not imdb_id or imdb_id == 'None':
+        return None
+    imdb_id = str(imdb_id)
+    if not imdb_id.startswith('tt'):
+        imdb_id = 'tt' + imdb_id
+    return imdb_id
+
+
+def cached_ids(db_path, media_type, imdb_ids):
+    '''
+    Return the set of imdb_ids already in the meta cache
+    '''
+    found = set()
+    imdb_ids = list(imdb_ids)
+    if not imdb_ids or media_type not in TABLES:
+        return found
+    db = sqlite.connect(db_path)
+    try:
+        for start in range(0, len(imdb_ids), BATCH_SIZE):
+            batch = imdb_ids[start:start + BATCH_SIZE]
+            sql = 'SELECT imdb_id FROM %s WHERE imdb_id IN (%s)' % (TABLES[media_type], ', '.join(['?'] * len(batch)))
+            for row in db.execute(sql, batch):
+                found.add(row[0])
+    finally:
+        db.close()
+    return found
+
+
+def misses(db_path, lookups):
+    '''
+    Return the lookups whose title isn't in the meta cache yet
+    '''
+    by_type = {}
+    for media_type, name, imdb_id, year in lookups:
+        key = imdb_key(imdb_id)
+        if key:
+            by_type.setdefault(media_type, set()).add(key)
+
+    cached = set()
+    try:
+        for media_type, imdb_ids in by_type.items():
+            for imdb_id in cached_ids(db_path, media_type, imdb_ids):
+                cached.add((media_type, imdb_id))
+    except Exception, e:
+        #a cache we can't query is treated as empty, get_meta() still finds what's there
+        print 'Meta Batch - Cache query failed: %s' % e
+
+    found = []
+    for lookup in lookups:
+        if (lookup[0], imdb_key(lookup[2])) not in cached:
+            found.append(lookup)
+    return found
+
+
+def get_meta(metaget, lookup):
+    media_type, name, imdb_id, year = lookup
+    if media_type == 'movie':
+        return metaget.get_meta(media_type, name, imdb_id=imdb_id, year=year)
+    return metaget.get_meta(media_type, name, imdb_id=imdb_id)
+
+
+def prefetch(db_path, lookups, new_metaget, workers=WORKERS):
+    '''
+    Fetch the lookups missing from the meta cache side by side, so that
+    get_meta() finds all of them in the cache afterwards. Returns the number
+    of misses that are cached now, lookups that failed and titles without an
+    imdb id (which can't be told apart in the cache) don't count.
+    '''
+    todo = misses(db_path, lookups)
+    if not todo:
+        return 0
+    print 'Meta Batch - %d of %d titles not cached, fetching' % (len(todo), len(lookups))
+    _fetch(todo, get_meta, new_metaget, workers)
+    return len(todo) - len(misses(db_path, todo))
+
+
+def cached_episodes(db_path, imdb_id, season):
+    '''
+    Return the set of episode numbers of a season already in the meta cache
+    '''
+    db = sqlite.connect(db_path)
+    try:
+        sql = 'SELECT episode FROM %s WHERE imdb_id = ? AND season = ?' % EPISODES
+        return set([int(row[0]) for row in db.execute(sql, (imdb_key(imdb_id), int(season)))])
+    finally:
+        db.close()
+
+
+def prefetch_season(db_path, showname, imdb_id, season, episodes, new_metaget, workers=WORKERS):
+    '''
+    Fetch the episodes of a season missing from the meta cache side by side,
+    so that get_episode_meta() finds all of them in the cache afterwards.
+    Returns the number of misses.
+    '''
+    try:
+        cached = cached_episodes(db_path, imdb_id, season)
+    except Exception, e:
+        print 'Meta Batch - Episode cache query failed: %s' % e
+        cached = set()
+
+    todo = [(showname, imdb_id, season, episode) for episode in episodes if episode not in cached]
+    if not todo:
+        return 0
+    print 'Meta Batch - %d of %d episodes of %s season %s not cached, fetching' % (len(todo), len(episodes), showname, season)
+    _fetch(todo, get_episode_meta, new_metaget, workers)
+    return len(todo)
+
+
+def get_episode_meta(metaget, lookup):
+    showname, imdb_id, season, episode = lookup
+    return metaget.get_episode_meta(showname, imdb_id, season, episode)
+
+
+def _fetch(todo, call, new_metaget, workers):
+    local = threading.local()
+    def fetch(lookup):
+        if not hasattr(local, 'metaget'):
+            local.metaget = new_metaget()
+        try:
+            call(local.metaget, lookup)
+        except Exception, e:
+            #left to the listing, which looks it up again on its own
+            print 'Meta Batch - Lookup failed for %s: %s' % (repr(lookup), e)
+
+    workerpool.map_ordered(fetch, todo, workers=workers)
+
+
+def lookup(metaget, lookups, new_metaget, workers=WORKERS):
+    '''
+    Return the meta of every lookup, in order
+    '''
+    prefetch(getattr(metaget, 'videocache', None), lookups, new_metaget, workers)
+    return [get_meta(metaget, item) for item in lookups]
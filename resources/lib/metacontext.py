@@ -0,0 +1,81 @@
+'''
+One metahandler MetaData per plugin invocation.
+
+Listings used to build a new MetaData, opening the meta database again, and
+ask check_meta_installed() every time they ran, once per favourite or
+recent item in places. A MetaContext stands in for MetaData and is shared
+by the whole invocation:
+
+    meta_context = metacontext.MetaContext(lambda: metahandlers.MetaData(preparezip=prepare_zip))
+    meta_installed = meta_context.check_meta_installed(addon_id)
+    meta = meta_context.get_meta('tvshow', name)
+
+The MetaData is only built on first use. The installed flags and the meta
+lookups are remembered, eg. a show listed with ten recent episodes is
+looked up once. Callers get copies, so changing a returned meta doesn't
+change what the next caller gets. Anything that writes to the meta
+database (update_*, insert_*, change_*) forgets what was remembered.
+
+MetaData's sqlite connection belongs to the thread that made it, worker
+threads still build their own.
+'''
+
+import copy
+
+#MetaData methods that change the meta database
+_WRITES = ('update_', 'insert_', 'change_')
+
+
+class MetaContext:
+
+    def __init__(self, new_metaget):
+        self._new_metaget = new_metaget
+        self._metaget = None
+        self._memo = {}
+
+
+    def metaget(self):
+        if self._metaget is None:
+            self._metaget = self._new_metaget()
+        return self._metaget
+
+
+    def check_meta_installed(self, addon_id):
+        return self._remember('check_meta_installed', addon_id)
+
+
+    def get_meta(self, *args, **kwargs):
+        return self._remember('get_meta', *args, **kwargs)
+
+
+    def get_episode_meta(self, *args, **kwargs):
+        return self._remember('get_episode_meta', *args, **kwargs)
+
+
+    def get_seasons(self, *args, **kwargs):
+        return self._remember('get_seasons', *args, **kwargs)
+
+
+    def forget(self):
+        self._memo.clear()
+
+
+    def __getattr__(self, name):
+        #everything else goes straight to MetaData
+        if name.startswith('__'):
+            raise AttributeError(name)
+        attr = getattr(self.metaget(), name)
+        if not name.startswith(_WRITES) or not callable(attr):
+            return attr
+        def write(*args, **kwargs):
+            self.forget()
+            return attr(*args, **kwargs)
+        return write
+
+
+    def _remember(self, method, *args, **kwargs):
+        #arguments may hold lists (get_seasons), key on their repr
+        key = repr((method, args, sorted(kwargs.items())))
+        if key not in self._memo:
+            self._memo[key] = getattr(self.metaget(), method)(*args, **kwargs)
+        return copy.deepcopy(self._memo[key])
@@ -0,0 +1,147 @@
+'''
+Delta updates of the meta containers.
+
+A full container is a dated snapshot of the meta database plus the image
+packs, a delta carries only what changed between two snapshots. Deltas are
+listed in container_urls.py, each one saying which snapshot it applies on
+top of:
+
+    containers['deltas'] = [
+        {'since': 'March 2012', 'date': 'April 2012', 'url': 'http://...',
+         'filename': 'delta_2012_04.zip', 'size': 6},
+        ]
+
+The delta zip holds a manifest.json and the new or changed images:
+
+    {"since": "March 2012", "date": "April 2012",
+     "rows": {"movie_meta": [{"imdb_id": "tt0111161", "title": ...}, ...],
+              "tvshow_meta": [...]},
+     "images": [{"pack": "movie_covers", "folder": "movie_images",
+                 "name": "covers/s/tt0111161.jpg"}, ...]}
+
+Rows are written with INSERT OR REPLACE, so a changed row replaces the old
+one through the table's unique key. An image is taken from the zip entry
+<folder>/<name> and only unpacked if its pack is installed, eg. no fanart
+is added for someone who never installed the fanart pack.
+
+    for delta in metadelta.chain(containers['deltas'], installed['last_update']):
+        ...download delta...
+        metadelta.apply(path, db_path, folders, installed)
+'''
+
+import os, zipfile
+import zipstream
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    from sqlite3 import dbapi2 as sqlite
+except ImportError:
+    from pysqlite2 import dbapi2 as sqlite
+
+MANIFEST = 'manifest.json'
+
+
+class DeltaError(Exception):
+    pass
+
+
+def chain(deltas, since):
+    '''
+    Return the deltas leading from the snapshot dated since to the newest one,
+    in the order they must be applied. Empty if since is up to date or no
+    delta applies to it, in which case only a full container will do.
+    '''
+    by_since = {}
+    for delta in deltas:
+        by_since[delta['since']] = delta
+
+    found = []
+    seen = set()
+    while since in by_since and since not in seen:
+        seen.add(since)
+        delta = by_since[since]
+        found.append(delta)
+        since = delta['date']
+    return found
+
+
+def apply(path, db_path, folders, installed):
+    '''
+    Apply the delta zip at path to the meta database at db_path
+
+    folders maps the image folder names of the manifest to folders on disk,
+    installed is the addon row of the meta database telling which image
+    packs are installed. Returns (rows, images) written.
+    '''
+    archive = zipfile.ZipFile(path)
+    try:
+        try:
+            manifest = json.loads(archive.read(MANIFEST))
+        except (KeyError, ValueError), e:
+            raise DeltaError('Bad delta manifest in %s: %s' % (path, e))
+
+        if installed.get('last_update') != manifest['since']:
+            raise DeltaError('Delta %s applies on top of %s, installed is %s' % (path, manifest['since'], installed.get('last_update')))
+
+        rows = _apply_rows(db_path, manifest.get('rows', {}))
+
+        images = 0
+        for image in manifest.get('images', []):
+            if installed.get(image['pack']) != 'true':
+                continue
+            folder = folders.get(image['folder'])
+            if not folder:
+                continue
+            _extract(archive, image['folder'] + '/' + image['name'], folder, image['name'])
+            images += 1
+    finally:
+        archive.close()
+
+    print 'Meta Delta - Applied %s: %d rows, %d images' % (manifest['date'], rows, images)
+    return rows, images
+
+
+def _apply_rows(db_path, tables):
+    db = sqlite.connect(db_path)
+    try:
+        count = 0
+        for table, rows in tables.items():
+            #names can't be bound as parameters, only take tables and columns the db really has
+            columns = set([column[1] for column in db.execute('PRAGMA table_info(%s)' % _quote(table))])
+            if not columns:
+                raise DeltaError('Unknown meta table: %s' % table)
+            for row in rows:
+                names = [name for name in row.keys() if name in columns]
+                sql = 'INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (_quote(table), ', '.join([_quote(name) for name in names]), ', '.join(['?'] * len(names)))
+                db.execute(sql, [row[name] for name in names])
+                count += 1
+        #all rows of a delta or none, a failed delta can then simply be applied again
+        db.commit()
+        return count
+    except:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def _quote(name):
+    return '"%s"' % name.replace('"', '""')
+
+
+def _extract(archive, entry, folder, name):
+    target = zipstream.safe_path(folder, name)
+    if target is None or target == os.path.normpath(folder):
+        raise DeltaError('Image outside its folder: %s' % name)
+    parent = os.path.dirname(target)
+    if not os.path.exists(parent):
+        os.makedirs(parent)
+    fh = open(target, 'wb')
+    try:
+        fh.write(archive.read(entry))
+    finally:
+        fh.close()
@@ -0,0 +1,277 @@
+'''
+Headless builder of the meta containers.
+
+Crawls the A-Z index pages of the site side by side, looks up the meta of
+every title listed (each title once, however many pages list it) with a
+pool of workers and zips the meta database and image folders into the
+containers container_urls.py points at:
+
+    python metapack.py --out /path/to/packs [--workers 8]
+
+or from the addon (Create Meta Pack), which runs it with RunScript and no
+arguments, building into the meta_pack folder of the addon profile. Nothing
+is shown in xbmc while it runs, progress goes to the log. It needs
+metahandler, which in turn needs the xbmc modules of a (headless) xbmc.
+
+The titles done are saved to build_state.json in the output folder every
+SAVE_EVERY titles, a build that was interrupted starts again where it
+stopped. Remove the file to build from scratch.
+'''
+
+import os, re, sys, threading, time, zipfile
+from optparse import OptionParser
+import httpclient, workerpool, metabatch
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+ADDON_ID = 'plugin.video.icefilms'
+ADDON_PATH = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+ICEFILMS_URL = 'http://www.icefilms.info/'
+
+#index sections and whether they are split by letter
+SECTIONS = [
+    ('movie', 'music/a-z/', False),
+    ('movie', 'standup/a-z/', False),
+    ('movie', 'other/a-z/', False),
+    ('movie', 'movies/a-z/', True),
+    ('tvshow', 'tv/a-z/', True),
+    ]
+
+#containers made from the image folders: container_urls key, MetaContainer folder, sub folder
+IMAGE_PACKS = [
+    ('mv_covers_filename', 'movie_images', 'covers'),
+    ('mv_backdrop_filename', 'movie_images', 'backdrops'),
+    ('tv_covers_filename', 'tv_images', 'covers'),
+    ('tv_banners_filename', 'tv_images', 'banners'),
+    ('tv_backdrop_filename', 'tv_images', 'backdrops'),
+    ]
+
+PAGE_WORKERS = 4
+WORKERS = 8
+SAVE_EVERY = 50
+STATE_FILE = 'build_state.json'
+
+_title = re.compile('<a name=i id=([^>]*)></a><img class=star><a href=/([^>]+)>(.+?)(?:</a>|<br>)')
+
+
+def index_pages(base_url):
+    '''
+    Return the (media type, url) of every index page to crawl
+    '''
+    letters = ['1'] + [chr(i) for i in range(ord('A'), ord('Z') + 1)]
+    pages = []
+    for media_type, path, by_letter in SECTIONS:
+        if by_letter:
+            for letter in letters:
+                pages.append((media_type, base_url + path + letter))
+        else:
+            pages.append((media_type, base_url + path + '1'))
+    return pages
+
+
+def parse_index(html, media_type):
+    '''
+    Return the meta lookups of the titles listed on an index page
+    '''
+    lookups = []
+    for imdb_id, url, name in _title.findall(html):
+        lookups.append(metabatch.lookup_for(media_type, imdb_id or None, name))
+    return lookups
+
+
+def unique(lookups):
+    #one lookup per title, a title without imdb id is known by its name
+    seen = set()
+    found = []
+    for lookup in lookups:
+        key = title_key(lookup)
+        if key not in seen:
+            seen.add(key)
+            found.append(lookup)
+    return found
+
+
+def title_key(lookup):
+    return '%s|%s' % (lookup[0], metabatch.imdb_key(lookup[2]) or lookup[1])
+
+
+class Builder:
+
+    def __init__(self, out, base_url=ICEFILMS_URL, workers=WORKERS, page_workers=PAGE_WORKERS):
+        self.out = out
+        self.base_url = base_url
+        self.workers = workers
+        self.page_workers = page_workers
+        self.state_file = os.path.join(out, STATE_FILE)
+        self.done = set(self.load_state())
+        self.lock = threading.Lock()
+        self.unsaved = 0
+
+
+    def run(self):
+        from metahandler import metahandlers
+        start = time.time()
+        new_metaget = lambda: metahandlers.MetaData(preparezip=True)
+
+        #all image packs flagged installed so that metahandler downloads every image
+        metaget = new_metaget()
+        metaget.insert_meta_installed(ADDON_ID, last_update='Now', movie_covers='true', tv_covers='true', tv_banners='true', movie_backdrops='true', tv_backdrops='true')
+
+        lookups = self.crawl()
+        todo = [lookup for lookup in lookups if title_key(lookup) not in self.done]
+        print 'Meta Pack - %d titles, %d left to look up' % (len(lookups), len(todo))
+
+        local = threading.local()
+        def fetch(lookup):
+            if not hasattr(local, 'metaget'):
+                local.metaget = new_metaget()
+            try:
+                metabatch.get_meta(local.metaget, lookup)
+            except Exception, e:
+                #not marked done, the next run tries again
+                print 'Meta Pack - Lookup failed for %s: %s' % (lookup[1], e)
+                return
+            self.title_done(lookup)
+
+        workerpool.map_ordered(fetch, todo, workers=self.workers)
+        self.save_state()
+
+        #Ensure to reset addon fields to false so database is ready to deploy
+        metaget.update_meta_installed(ADDON_ID, movie_covers='false', tv_covers='false', tv_banners='false', movie_backdrops='false', tv_backdrops='false')
+
+        self.make_containers(metaget)
+        print 'Meta Pack - Built in %d minutes' % ((time.time() - start) / 60)
+
+
+    def crawl(self):
+        def fetch(page):
+            media_type, url = page
+            try:
+                html = httpclient.request(url, headers={'Referer': self.base_url}).content
+            except Exception, e:
+                #the titles of this page are picked up by the next run
+                print 'Meta Pack - Failed to get %s: %s' % (url, e)
+                return []
+            found = parse_index(html, media_type)
+            print 'Meta Pack - %d titles on %s' % (len(found), url)
+            return found
+
+        lookups = []
+        for found in workerpool.map_ordered(fetch, index_pages(self.base_url), workers=self.page_workers):
+            lookups.extend(found)
+        return unique(lookups)
+
+
+    def title_done(self, lookup):
+        self.lock.acquire()
+        try:
+            self.done.add(title_key(lookup))
+            self.unsaved += 1
+            if self.unsaved < SAVE_EVERY:
+                return
+            self.unsaved = 0
+        finally:
+            self.lock.release()
+        self.save_state()
+
+
+    def load_state(self):
+        try:
+            fh = open(self.state_file, 'r')
+            try:
+                return json.load(fh)['done']
+            finally:
+                fh.close()
+        except (IOError, ValueError, KeyError):
+            return []
+
+
+    def save_state(self):
+        self.lock.acquire()
+        try:
+            done = list(self.done)
+        finally:
+            self.lock.release()
+        tmp = self.state_file + '.tmp'
+        fh = open(tmp, 'w')
+        try:
+            json.dump({'done': done}, fh)
+        finally:
+            fh.close()
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        os.rename(tmp, self.state_file)
+
+
+    def make_containers(self, metaget):
+        #container_urls.py lives in the addon folder
+        if ADDON_PATH not in sys.path:
+            sys.path.append(ADDON_PATH)
+        import container_urls
+        from metahandler import metacontainers
+        containers = container_urls.get()
+        mc = metacontainers.MetaContainer()
+
+        db_zip = os.path.join(self.out, containers['db_filename'])
+        make_zip(db_zip, [(metaget.videocache, os.path.basename(metaget.videocache))], zipfile.ZIP_DEFLATED)
+
+        for key, folder, sub in IMAGE_PACKS:
+            folder = getattr(mc, folder, None)
+            if not folder or not os.path.isdir(os.path.join(folder, sub)):
+                print 'Meta Pack - No %s images to pack' % sub
+                continue
+            files = []
+            for root, dirs, names in os.walk(os.path.join(folder, sub)):
+                for name in names:
+                    path = os.path.join(root, name)
+                    #relative to the image folder, which the pack is unpacked into
+                    files.append((path, os.path.relpath(path, folder).replace(os.sep, '/')))
+            #images are compressed already
+            make_zip(os.path.join(self.out, containers[key]), files, zipfile.ZIP_STORED)
+
+
+def make_zip(path, files, compression):
+    tmp = path + '.tmp'
+    archive = zipfile.ZipFile(tmp, 'w', compression, True)
+    try:
+        for source, name in files:
+            archive.write(source, name)
+    finally:
+        archive.close()
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+    print 'Meta Pack - Wrote %s (%d files)' % (path, len(files))
+
+
+def profile_folder():
+    #output folder when run from the addon
+    try:
+        import xbmc, xbmcaddon
+    except ImportError:
+        return None
+    profile = xbmcaddon.Addon(id=ADDON_ID).getAddonInfo('profile')
+    return os.path.join(xbmc.translatePath(profile), 'meta_pack')
+
+
+def main(args):
+    parser = OptionParser(usage='%prog --out FOLDER [options]')
+    parser.add_option('--out', help='folder the containers are written to [meta_pack in the addon profile, inside xbmc]')
+    parser.add_option('--url', default=ICEFILMS_URL, help='site to crawl [%default]')
+    parser.add_option('--workers', type='int', default=WORKERS, help='meta lookups at once [%default]')
+    parser.add_option('--page-workers', type='int', default=PAGE_WORKERS, help='index pages fetched at once [%default]')
+    options, rest = parser.parse_args(args)
+    if not options.out:
+        options.out = profile_folder()
+    if not options.out:
+        parser.error('--out is required outside xbmc')
+    if not os.path.exists(options.out):
+        os.makedirs(options.out)
+    Builder(options.out, options.url, options.workers, options.page_workers).run()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
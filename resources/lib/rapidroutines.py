@@ -7,7 +7,7 @@ Uses RapidShare API - http://images.rapidshare.com/apidoc.txt
 '''
 
 import re
-import urllib2
+import httpclient
             
 class rapidshare:
     def __init__(self, use_ssl=False):
@@ -183,12 +183,7 @@ class rapidshare:
         print 'RapidRoutines - Requesting URL: %s' % logurl
         
         try:
-            req = urllib2.Request(url)
-            req.add_header('User-Agent', 'Mozilla/5.0 (Windows; U; Windows NT 5.1; en-GB; rv:1.9.0.3) Gecko/2008092417 Firefox/3.0.3')
-            response = urllib2.urlopen(req)
-            html=response.read()
-            response.close()
-            return html
+            return httpclient.request(url).content
         except Exception, e:
             print 'Error retrieving url: %s' % e
             raise Exception('Error occured retrieving URL: %s' % e)
\ No newline at end of file
@@ -0,0 +1,201 @@
+'''
+Resolver engine for file hosts that hand out their links through a chain of
+html forms, which is how every host running the XFileSharing script works:
+
+    GET the file page -> POST the download1 form -> (wait) -> POST the
+    download2 form -> scrape the link from the last page
+
+A host is declared as the list of forms to submit and the pattern (or
+function) that finds the link on the last page:
+
+    vidhog = resolvers.FormWalker('VidHog',
+        [resolvers.Form(submit='method_free'),
+         resolvers.Form(wait='<span id="countdown_str">Wait <span id=".+?">([0-9]*)</span>')],
+        link='<strong><a href="(.+?)">Click Here to download this file</a></strong>')
+    link = vidhog.resolve(url)
+
+Every form is filled from the hidden inputs of the page, parsed in a single
+pass, plus the fields given in the declaration. All requests of one resolve
+go through httpclient and share one cookie jar.
+
+Every page is checked for the maintenance notice. A host showing its errors
+on the page declares their pattern too, eg. errors=[resolvers.PAGE_ERROR].
+'''
+
+import re, time, cookielib
+import httpclient
+
+
+class ResolverError(Exception):
+    pass
+
+
+_form = re.compile('<form\\b.*?</form>', re.I | re.S)
+_input = re.compile('<input\\b([^>]*)>', re.I)
+_attr = re.compile('''([\\w-]+)\\s*=\\s*(?:"([^"]*)"|'([^']*)'|([^\\s"'>]+))''')
+
+#Error pages XFileSharing hosts show instead of the download form,
+#as (pattern, message) with a message of None taking the first group of the pattern
+MAINTENANCE = (re.compile('This server is in maintenance mode'), 'File is currently unavailable on the host')
+PAGE_ERROR = (re.compile('<p class="err">(.+?)</p>'), None)
+
+
+def parse_inputs(html):
+    '''
+    Return (hidden, submits) for the download form of the page
+
+    Both are dicts of input name -> value. A page may hold other forms too
+    (login, search), the download form is the one with a hidden "id" input.
+    '''
+    best = None
+    for form in _form.findall(html) or [html]:
+        hidden = {}
+        submits = {}
+        for tag in _input.findall(form):
+            attrs = {}
+            for name, dquoted, squoted, bare in _attr.findall(tag):
+                attrs[name.lower()] = dquoted or squoted or bare
+            if 'name' not in attrs:
+                continue
+            kind = attrs.get('type', 'text').lower()
+            if kind == 'hidden':
+                hidden[attrs['name']] = attrs.get('value', '')
+            elif kind == 'submit':
+                submits[attrs['name']] = attrs.get('value', '')
+        if 'id' in hidden:
+            return hidden, submits
+        if best is None:
+            best = (hidden, submits)
+    return best
+
+
+def scrape(pattern, flags=0):
+    '''
+    Field value taken from the page with a regex, for values that aren't in
+    a hidden input (eg. set by javascript)
+    '''
+    pattern = re.compile(pattern, flags)
+    def value(html):
+        match = pattern.search(html)
+        if match is None:
+            raise ResolverError('Form field not found: %s' % pattern.pattern)
+        return match.group(1)
+    return value
+
+
+class Form:
+    '''
+    One form submission
+
+    fields: values to send on top of (or instead of) the hidden inputs,
+            a callable value is called with the page html
+    submit: name of the submit button to send along, with its page value
+    wait:   seconds to wait before submitting, or a regex finding them on the page
+    '''
+
+    def __init__(self, fields=None, submit=None, wait=None):
+        self.fields = fields or {}
+        self.submit = submit
+        self.wait = wait
+        if isinstance(wait, basestring):
+            self.wait = re.compile(wait)
+
+    def data(self, html, url):
+        hidden, submits = parse_inputs(html)
+        data = dict(hidden)
+        if self.submit:
+            data[self.submit] = submits.get(self.submit, self.submit)
+        data['referer'] = url
+        for name, value in self.fields.items():
+            if callable(value):
+                value = value(html)
+            data[name] = value
+        return data
+
+    def wait_time(self, html):
+        if self.wait is None or isinstance(self.wait, int):
+            return self.wait
+        match = self.wait.search(html)
+        if match is None:
+            return None
+        return int(match.group(1))
+
+
+class FormWalker:
+    '''
+    Resolver for a host declared as a chain of forms
+
+    link is a regex whose first group is the link, or a function called as
+    link(html, url, data) with the last page and the last data posted.
+    errors are the host's own error patterns, checked on top of MAINTENANCE.
+    '''
+
+    def __init__(self, name, forms, link, flags=0, errors=None):
+        self.name = name
+        self.forms = forms
+        self.errors = [MAINTENANCE] + (errors or [])
+        self.link = link
+        if isinstance(link, basestring):
+            self.link = re.compile(link, flags)
+
+    def resolve(self, url, progress=None, wait=None, cookie_jar=None):
+        '''
+        Walk the forms and return the link, or None if a wait was cancelled
+
+        progress(percent) is called after every page, wait(seconds) must
+        return True once the wait is over and False if it was cancelled.
+        Without it we simply sleep.
+        '''
+        if cookie_jar is None:
+            cookie_jar = cookielib.CookieJar()
+        headers = {'Referer': url}
+        steps = len(self.forms) + 1
+
+        print '%s - Requesting GET URL: %s' % (self.name, url)
+        html = httpclient.request(url, headers=headers, cookie_jar=cookie_jar).content
+        self.check(html)
+
+        data = {}
+        for step, form in enumerate(self.forms):
+            if progress:
+                progress(100 * (step + 1) / steps)
+
+            data = form.data(html, url)
+
+            seconds = form.wait_time(html)
+            if seconds:
+                if wait is None:
+                    time.sleep(seconds)
+                elif not wait(seconds):
+                    return None
+
+            print '%s - Requesting POST URL: %s DATA: %s' % (self.name, url, data)
+            html = httpclient.request(url, data=data, headers=headers, cookie_jar=cookie_jar).content
+            self.check(html)
+
+        if progress:
+            progress(100)
+
+        link = self.find_link(html, url, data)
+        if not link:
+            print '***** %s - Link Not Found' % self.name
+            raise ResolverError('Unable to resolve %s' % self.name)
+        print '%s Link Found: %s' % (self.name, link)
+        return link
+
+    def check(self, html):
+        for pattern, message in self.errors:
+            match = pattern.search(html)
+            if match is not None:
+                if message is None:
+                    message = match.group(1)
+                print '***** %s - Site reported: %s' % (self.name, message)
+                raise ResolverError(message)
+
+    def find_link(self, html, url, data):
+        if callable(self.link):
+            return self.link(html, url, data)
+        match = self.link.search(html)
+        if match is None:
+            return None
+        return match.group(1)
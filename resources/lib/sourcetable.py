@@ -0,0 +1,76 @@
+'''
+Parser for the source table of the Icefilms mirror page.
+
+The mirror page groups its sources in one ripdiv per quality:
+
+    <div class=ripdiv><b>HD 720p</b> ... </div>
+
+Inside it a single part source is a link
+
+    <a rel=3 ... onclick='go(123456)'>Source #3: ...
+
+while a multi part source has a header followed by one link per part
+
+    <p>Source #4: ... onclick='go(123457)'>PART 1 ... onclick='go(123458)'>PART 2 ...
+
+parse() walks the page once and returns a list of
+(quality, source number, part number, ajax id) records, part number being
+None for single part sources. Numbers and ids are kept as strings, as they
+are used to build cache keys and ajax requests.
+'''
+
+import re
+
+DVDRIP = 'DVDRip / Standard Def'
+HD720P = 'HD 720p'
+DVDSCREENER = 'DVD Screener'
+R5R6 = 'R5/R6 DVDRip'
+
+_ripdiv = re.compile('<div class=ripdiv><b>(.+?)</b>(.+?)</div>')
+
+#One alternation for the three things we care about inside a ripdiv:
+#multi part header, single part link, part link
+_entry = re.compile("<p>Source #(\d+):"
+                    "|<a\s+rel=(\d+)[^>]*?onclick='go\((\d+)\)'>Source\s+#\d+:"
+                    "|onclick='go\((\d+)\)'>PART\s+(\d+)")
+
+
+def parse(html):
+    records = []
+    for ripdiv in _ripdiv.finditer(html):
+        quality = ripdiv.group(1)
+        multi = []
+        single = []
+        current = None
+
+        for entry in _entry.finditer(ripdiv.group(2)):
+            header, rel, single_id, part_id, partnum = entry.groups()
+            if header is not None:
+                current = header
+            elif rel is not None:
+                current = None
+                single.append((quality, rel, None, single_id))
+            elif current is not None:
+                multi.append((quality, current, partnum, part_id))
+
+        #a source listed with parts is never also added as a single link
+        multi_sources = set([record[1] for record in multi])
+        single = [record for record in single if record[1] not in multi_sources]
+
+        found = multi + single
+        #sort by source number, keeping the page order of the parts
+        found.sort(key=lambda record: int(record[1]))
+        records.extend(found)
+    return records
+
+
+def qualities(records):
+    found = []
+    for record in records:
+        if record[0] not in found:
+            found.append(record[0])
+    return found
+
+
+def for_quality(records, quality):
+    return [record for record in records if record[0] == quality]
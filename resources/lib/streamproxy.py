@@ -0,0 +1,256 @@
+'''
+Local http server the player reads videos from.
+
+The player is given http://127.0.0.1:<port>/<file name> and the proxy
+answers its (range) requests from a source:
+
+    DownloadSource  a file being downloaded (Download and Watch). Requests
+                    block until the bytes asked for are on disk, and a
+                    request starting somewhere new (a seek, or the index at
+                    the end of the file) moves the download connections there.
+
+    UpstreamSource  a resolved host link, for plain streaming. Each request
+                    is fetched by a read-ahead thread into a bounded memory
+                    buffer, adding the headers of "url|header=value" links,
+                    and picks up with a Range request where it stopped if the
+                    host drops the connection.
+
+    proxy = streamproxy.Proxy(streamproxy.UpstreamSource(link))
+    player.play(proxy.url)
+    ...
+    proxy.close()
+'''
+
+import os, re, time, threading, urllib, urlparse, Queue
+import BaseHTTPServer, SocketServer
+import httpclient, downloader
+from linkcache import split_link
+
+#Smaller chunks than a plain download, the player waits for whole chunks
+CHUNK_SIZE = 1024 * 1024
+
+#Bytes sent to the player per wait, and seconds to wait for them before giving up
+PIECE_SIZE = 256 * 1024
+PIECE_TIMEOUT = 120
+
+#Reconnections to the host in a row before a request is given up
+RECONNECTS = 5
+
+class ProxyError(Exception):
+    pass
+
+
+_types = {'.avi': 'video/x-msvideo', '.mkv': 'video/x-matroska', '.mp4': 'video/mp4', '.flv': 'video/x-flv'}
+
+
+class DownloadSource:
+
+    def __init__(self, download):
+        self.download = download
+        self.name = os.path.basename(download.dest)
+        self.size = download.size
+        self.ranges = True
+
+
+    def stream(self, start, end, write):
+        download = self.download
+        fh = open(download.dest, 'rb')
+        try:
+            position = start
+            while position <= end:
+                piece_end = min(position + PIECE_SIZE, end + 1) - 1
+                #whoever waits last gets the connections, that's where the player is reading
+                if not download.wait_for(position, piece_end, 0):
+                    download.prioritize(position)
+                if not download.wait_for(position, piece_end, PIECE_TIMEOUT):
+                    print 'Stream Proxy - Bytes %d-%d never arrived' % (position, piece_end)
+                    return
+                fh.seek(position)
+                write(fh.read(piece_end - position + 1))
+                position = piece_end + 1
+        finally:
+            fh.close()
+
+
+class UpstreamSource:
+
+    def __init__(self, link, buffer_size=16 * 1024 * 1024):
+        self.url, self.headers = split_link(link)
+        self.name = os.path.basename(urlparse.urlsplit(self.url).path) or 'video'
+        self.buffer_size = buffer_size
+
+        #same probe as the downloader: a 206 tells us ranges work and the size
+        headers = dict(self.headers)
+        headers['Range'] = 'bytes=0-0'
+        response = httpclient.request(self.url, headers=headers, stream=True)
+        try:
+            self.ranges = response.status == 206
+            if self.ranges:
+                self.size = downloader.range_total(response.get_header('Content-Range'))
+            else:
+                self.size = int(response.get_header('Content-Length') or 0)
+            self.url = response.geturl()
+        finally:
+            response.close()
+        if not self.size:
+            raise ProxyError('Unknown size for %s' % self.url)
+
+
+    def stream(self, start, end, write):
+        reader = _ReadAhead(self, start, end)
+        reader.start()
+        try:
+            while True:
+                data = reader.pieces.get()
+                if data is None:
+                    return
+                write(data)
+        finally:
+            reader.stop = True
+
+
+class _ReadAhead(threading.Thread):
+    '''
+    Fetch start-end from the host ahead of the player, into a bounded buffer
+    '''
+
+    def __init__(self, source, start, end):
+        self.source = source
+        self.start_at = start
+        self.end = end
+        self.stop = False
+        self.pieces = Queue.Queue(max(1, source.buffer_size / PIECE_SIZE))
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+
+
+    def run(self):
+        position = self.start_at
+        failures = 0
+        try:
+            while position <= self.end and not self.stop:
+                headers = dict(self.source.headers)
+                if self.source.ranges:
+                    headers['Range'] = 'bytes=%d-%d' % (position, self.end)
+                elif position > 0:
+                    print 'Stream Proxy - Host dropped the stream and has no range support'
+                    return
+                try:
+                    response = httpclient.request(self.source.url, headers=headers, stream=True)
+                    if self.source.ranges and response.status != 206:
+                        #a 200 starts at byte 0, not where the player is
+                        response.close()
+                        print 'Stream Proxy - Host ignored the range request at %d, giving up' % position
+                        return
+                    try:
+                        while position <= self.end and not self.stop:
+                            data = response.read(min(PIECE_SIZE, self.end - position + 1))
+                            if not data:
+                                raise IOError('connection closed at %d' % position)
+                            self.put(data)
+                            position += len(data)
+                            failures = 0
+                    finally:
+                        response.close()
+                except Exception, e:
+                    failures += 1
+                    if failures > RECONNECTS:
+                        print 'Stream Proxy - Giving up at %d: %s' % (position, e)
+                        return
+                    print 'Stream Proxy - Reconnecting at %d: %s' % (position, e)
+                    #straight away the first time, a dropped connection is the usual case
+                    if failures > 1:
+                        time.sleep(1)
+        finally:
+            self.put(None)
+
+
+    def put(self, data):
+        #the player stops reading when it seeks, don't wait on it forever
+        while not self.stop:
+            try:
+                self.pieces.put(data, True, 1)
+                return
+            except Queue.Full:
+                pass
+
+
+class Proxy:
+
+    def __init__(self, source):
+        self.source = source
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.source = source
+        self.port = self.server.server_address[1]
+        self.url = 'http://127.0.0.1:%d/%s' % (self.port, urllib.quote(source.name))
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.setDaemon(True)
+        self.thread.start()
+        print 'Stream Proxy - Serving %s on %s' % (source.name, self.url)
+
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.respond(False)
+
+
+    def do_GET(self):
+        self.respond(True)
+
+
+    def respond(self, body):
+        source = self.server.source
+        size = source.size
+        start, end = 0, size - 1
+
+        match = re.match('bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        if source.ranges and match and (match.group(1) or match.group(2)):
+            if not match.group(1):
+                #suffix range, the last n bytes
+                start = max(0, size - int(match.group(2)))
+            else:
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), size - 1)
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % size)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end, size))
+        else:
+            self.send_response(200)
+
+        extension = os.path.splitext(source.name)[1].lower()
+        self.send_header('Content-Type', _types.get(extension, 'application/octet-stream'))
+        self.send_header('Content-Length', str(end - start + 1))
+        if source.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if not body:
+            return
+
+        try:
+            source.stream(start, end, self.wfile.write)
+        except Exception, e:
+            #the player hangs up whenever it seeks
+            print 'Stream Proxy - Request for %d-%d ended: %s' % (start, end, e)
+
+
+    def log_message(self, format, *args):
+        print 'Stream Proxy - ' + (format % args)
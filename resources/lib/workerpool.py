@@ -0,0 +1,56 @@
+'''
+Tiny thread pool for running blocking calls (mostly http requests) side by side.
+
+    import workerpool
+    pages = workerpool.map_ordered(GetURL, urls, workers=4)
+
+Results come back in the same order as the items, whatever order the calls
+actually finish in.
+'''
+
+import threading, Queue
+
+
+def map_ordered(func, items, workers=4):
+    '''
+    Call func(item) for every item using up to workers threads
+
+    Returns the list of results in the order of items. If any call raised,
+    the first exception is raised again once all threads are done.
+    '''
+    items = list(items)
+    results = [None] * len(items)
+    errors = []
+
+    if not items:
+        return results
+
+    todo = Queue.Queue()
+    for index, item in enumerate(items):
+        todo.put((index, item))
+
+    def worker():
+        while True:
+            try:
+                index, item = todo.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[index] = func(item)
+            except Exception, e:
+                print 'workerpool - Call failed for %s: %s' % (repr(item), e)
+                errors.append(e)
+
+    threads = []
+    for i in range(min(workers, len(items))):
+        thread = threading.Thread(target=worker)
+        thread.setDaemon(True)
+        thread.start()
+        threads.append(thread)
+
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return results
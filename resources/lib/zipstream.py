@@ -0,0 +1,218 @@
+'''
+Extract a zip archive from a stream, entry by entry, as it arrives.
+
+Zip archives start every entry with a local header holding its name and
+sizes, so an archive can be unpacked front to back while it downloads,
+without ever being stored (the central directory at the end only repeats
+what the local headers said). Memory use is bounded by the read size.
+
+    response = httpclient.request(url, stream=True)
+    zipstream.extract(response, dest)
+
+extract() can also start in the middle of an archive, at the offset of an
+entry it reported as done, which is how an interrupted install resumes with
+a Range request.
+'''
+
+import os, struct, zlib, binascii
+
+READ_SIZE = 64 * 1024
+
+_LOCAL = 'PK\x03\x04'
+_CENTRAL = 'PK\x01\x02'
+_END = 'PK\x05\x06'
+_DESCRIPTOR = 'PK\x07\x08'
+
+#flag bits of the local header
+_ENCRYPTED = 0x1
+_HAS_DESCRIPTOR = 0x8
+
+STORED = 0
+DEFLATED = 8
+
+#a size with this value is in the zip64 extra field instead (files over 4 GB, or written as a stream)
+_ZIP64_SIZE = 0xffffffff
+_ZIP64_EXTRA = 0x0001
+
+
+class ZipStreamError(Exception):
+    pass
+
+
+def extract(fh, dest, offset=0, entry_done=None):
+    '''
+    Unpack the entries read from fh into the folder dest
+
+    offset is the position of fh in the archive, it must be the start of an
+    entry. entry_done(name, next_offset) is called after each entry, with
+    the offset to resume from. Returns the number of entries extracted.
+    '''
+    reader = _Reader(fh, offset)
+    count = 0
+    while True:
+        signature = reader.read(4)
+        if signature in (_CENTRAL, _END):
+            return count
+        if signature != _LOCAL:
+            raise ZipStreamError('No entry header at offset %d' % (reader.offset - len(signature)))
+
+        version, flags, method, mtime, mdate, crc, compressed, size, name_length, extra_length = struct.unpack('<HHHHHIIIHH', reader.read(26))
+        name = reader.read(name_length)
+        zip64 = size == _ZIP64_SIZE or compressed == _ZIP64_SIZE
+        if zip64:
+            size, compressed = _zip64_sizes(reader.read(extra_length), size, compressed)
+        else:
+            reader.read(extra_length)
+        if flags & _ENCRYPTED:
+            raise ZipStreamError('Encrypted entry %s' % name)
+
+        path = safe_path(dest, name)
+        if path is None:
+            raise ZipStreamError('Entry %s points outside the target folder' % name)
+        if name.endswith('/'):
+            if not os.path.exists(path):
+                os.makedirs(path)
+        else:
+            folder = os.path.dirname(path)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            out = open(path + '.part', 'wb')
+            try:
+                found_crc, found_size = _copy(reader, out, method, compressed, flags & _HAS_DESCRIPTOR, name)
+            finally:
+                out.close()
+
+            if flags & _HAS_DESCRIPTOR:
+                #the signature of the data descriptor is optional
+                descriptor = reader.read(4)
+                if descriptor != _DESCRIPTOR:
+                    reader.unread(descriptor)
+                if zip64:
+                    crc, compressed, size = struct.unpack('<IQQ', reader.read(20))
+                else:
+                    crc, compressed, size = struct.unpack('<III', reader.read(12))
+
+            if found_crc != crc or found_size != size:
+                os.remove(path + '.part')
+                raise ZipStreamError('Bad CRC or size for %s' % name)
+            if os.path.exists(path):
+                os.remove(path)
+            os.rename(path + '.part', path)
+
+        count += 1
+        if entry_done:
+            entry_done(name, reader.offset)
+
+
+def _copy(reader, out, method, compressed, has_descriptor, name):
+    #returns (crc, size) of the data written
+    crc = 0
+    size = 0
+    if method == STORED:
+        if has_descriptor:
+            raise ZipStreamError('Stored entry %s has no size in its header' % name)
+        remaining = compressed
+        while remaining:
+            data = reader.read(min(READ_SIZE, remaining))
+            out.write(data)
+            crc = binascii.crc32(data, crc)
+            size += len(data)
+            remaining -= len(data)
+
+    elif method == DEFLATED:
+        inflater = zlib.decompressobj(-15)
+        remaining = compressed
+        while True:
+            if has_descriptor:
+                #size unknown, inflate until the deflate stream says it ended
+                data = reader.read_some(READ_SIZE)
+            elif remaining:
+                data = reader.read(min(READ_SIZE, remaining))
+                remaining -= len(data)
+            else:
+                break
+            if not data:
+                raise ZipStreamError('Archive ended inside %s' % name)
+            data = inflater.decompress(data)
+            out.write(data)
+            crc = binascii.crc32(data, crc)
+            size += len(data)
+            if inflater.unused_data:
+                reader.unread(inflater.unused_data)
+                break
+        data = inflater.flush()
+        out.write(data)
+        crc = binascii.crc32(data, crc)
+        size += len(data)
+
+    else:
+        raise ZipStreamError('Unsupported compression %d for %s' % (method, name))
+
+    return crc & 0xffffffff, size
+
+
+def _zip64_sizes(extra, size, compressed):
+    #the zip64 field holds the sizes marked as 0xffffffff in the header, in that order
+    while len(extra) >= 4:
+        kind, length = struct.unpack('<HH', extra[:4])
+        field = extra[4:4 + length]
+        if kind == _ZIP64_EXTRA:
+            if size == _ZIP64_SIZE:
+                size = struct.unpack('<Q', field[:8])[0]
+                field = field[8:]
+            if compressed == _ZIP64_SIZE:
+                compressed = struct.unpack('<Q', field[:8])[0]
+            break
+        extra = extra[4 + length:]
+    return size, compressed
+
+
+def safe_path(dest, name):
+    '''
+    Path of the archive entry name unpacked into dest, None if the name
+    climbs out of dest with .. (a leading / is taken as relative to dest)
+    '''
+    dest = os.path.normpath(dest)
+    path = os.path.normpath(os.path.join(dest, name.replace('\\', '/').lstrip('/')))
+    if path != dest and not path.startswith(dest + os.sep):
+        return None
+    return path
+
+
+class _Reader:
+    '''
+    Exact reads over a stream, keeping count of the archive offset
+    '''
+
+    def __init__(self, fh, offset):
+        self.fh = fh
+        self.offset = offset
+        self.pending = ''
+
+
+    def read(self, amount):
+        data = self.read_some(amount)
+        while len(data) < amount:
+            more = self.read_some(amount - len(data))
+            if not more:
+                raise ZipStreamError('Archive ended at offset %d' % self.offset)
+            data += more
+        return data
+
+
+    def read_some(self, amount):
+        #an empty read means end of body to http streams, never ask for 0 bytes
+        if amount <= 0:
+            return ''
+        if self.pending:
+            data = self.pending[:amount]
+            self.pending = self.pending[amount:]
+        else:
+            data = self.fh.read(amount)
+        self.offset += len(data)
+        return data
+
+
+    def unread(self, data):
+        self.pending = data + self.pending
+        self.offset -= len(data)
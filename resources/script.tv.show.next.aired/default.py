@@ -321,6 +321,8 @@ class NextAired:
         #wesaada's patch for ignoring The etc when sorting favourites list.
         articles = ("a","an","the")
         tupleList.sort(key=lambda s: tuple(word for word in s[1].split() if word.lower() not in articles))
+        #one MetaData (and meta db connection) for all the shows
+        metaget = None
         for thestring in stringList:
             splitter=re.split('\|+', thestring)
             name=splitter[0]
@@ -333,7 +335,8 @@ class NextAired:
             tvshowname = normalize_string( name )
             path = url
             if imdb_id != '':
-                metaget = metahandlers.MetaData(preparezip=False)
+                if metaget is None:
+                    metaget = metahandlers.MetaData(preparezip=False)
                 meta=metaget.get_meta('tvshow', name, imdb_id=imdb_id)
 
             self.TVlist.append( ( tvshowname , path, meta['banner_url'], meta['backdrop_url'], imdb_id ) )
@@ -496,16 +499,21 @@ class NextAired:
        	self.complete_show_data.extend(self.get_list("canceled.db"))
         if self.complete_show_data == "[]":
             self._stop = True
+        # poll fast while the user moves through the list, back off while the selection stays put
+        delay = 100
         while not self._stop:
             self.selecteditem = xbmc.getInfoLabel("ListItem.TVShowTitle")
             if self.selecteditem != self.previousitem:
+                delay = 100
                 self.WINDOW.clearProperty("NextAired.Label")
                 self.previousitem = self.selecteditem
                 for item in self.complete_show_data:
                     if self.selecteditem == item.get("localname", ""):
                         self.set_labels('windowproperty', item)
                         break
-            xbmc.sleep(100)
+            else:
+                delay = min(delay * 2, 800)
+            xbmc.sleep(delay)
             if not xbmc.getCondVisibility("Window.IsVisible(10025)"):
                 self.WINDOW.clearProperty("NextAired.Label")
                 self._stop = True